@@ -9,16 +9,83 @@ CSS_BUCKET = ''         # name of the css bucket
 IMAGE_BUCKET = ''       # name of the image bucket
 JS_BUCKET = ''          # name of the js bucket
 
+TARGETS = []            # bucket sets each file is built once for & uploaded to concurrently, eg. [{'name': 'eu', 'aws_profile': 'eu', 'css_bucket': 'eu-css'}, ...],
+                        # keys left out (aws_config_path, aws_profile, css_bucket, js_bucket, image_bucket) default to the settings above, empty for those alone
+TARGET_CONCURRENCY = 4  # number of targets a file is uploaded to at once, per upload worker
+
+S3_ENDPOINT = ''        # host:port of an S3 compatible endpoint reached over plain http (eg. a local stand-in), may be left empty for AWS
+
+S3_BACKEND = 'boto'     # 'boto', or 'asyncio' to send existence checks, small uploads, listings & deletes from a shared event loop
+S3_CONCURRENCY = 64     # max number of requests in flight at once with the asyncio backend
+S3_TIMEOUT = 70         # seconds an asyncio request waits to connect, then for its response, before failing as a retried timeout (like boto's socket timeout)
+S3_POOL_SIZE = 16       # max number of boto connections shared by all threads & buckets, each S3 call checks one out while it runs
+
+MULTIPART_THRESHOLD = 16 * 1024 * 1024  # files at least this big are uploaded in parts (multipart upload)
+MULTIPART_PART_SIZE = 8 * 1024 * 1024   # size of each uploaded part, S3 requires at least 5 MB (checked at startup)
+MULTIPART_CONCURRENCY = 4               # number of parts of a file uploaded concurrently
+MULTIPART_RETRIES = 3                   # attempts per part before the whole upload is aborted
+
+S3_RETRIES = 5          # attempts of each S3 call failing with a transient error (5xx, throttling, dropped connection) before giving up
+S3_BACKOFF_BASE = 0.2   # seconds, the wait before retry n is random between 0 and S3_BACKOFF_BASE * 2^(n-1) (full jitter)
+S3_BACKOFF_MAX = 20     # seconds, upper bound of the wait between two attempts
+
+S3_ADAPTIVE_LIMIT = True        # limit the requests sent at once to each bucket, raised while they succeed & lowered when S3 throttles (503 SlowDown) or slows down
+S3_LIMIT_INITIAL = 0            # requests in flight per bucket at the start of a run, 0 for the most the workers send at once
+                                # (UPLOAD_WORKERS or DELETE_CONCURRENCY, S3_CONCURRENCY with the asyncio backend)
+S3_LIMIT_MIN = 1                # the limit never drops below this
+S3_LIMIT_MAX = 128              # nor grows above this (boto requests are also bound by S3_POOL_SIZE, asyncio ones by S3_CONCURRENCY)
+S3_LIMIT_LATENCY_FACTOR = 3.0   # lower the limit when the recent latency of a kind of fixed size request (existence check, listing, delete, multipart part)
+                                # gets this many times its average, 0 to only react to throttling
+
 XML_PATH = ''           # path of the xml file containing latest file versions
 
+MANIFEST_KEY = ''       # key of the manifest object listing deployed versions in each bucket, may be left empty to disable manifests
+
+METRICS_PATH = ''       # folder receiving the per-stage metrics report of each run (mydeploy.* / mycleanup.*), may be left empty to only print the summary
+METRICS_FORMAT = 'json' # 'json', or 'prometheus' for the node exporter textfile collector
+
 
 # config specific to deployment script
 JAVA_PATH = ''          # path of the folder containing java binary, may default to empty if already defined in system path
 MINIFIER_PATH = ''      # path of the folder containing the minifiers binaries (closure compiler & yuicompressor)
+CSS_MINIFIER = 'java'   # 'java' for yuicompressor, 'python' for the in-process minifier of myminify.py (no JVM needed), or 'copy' to upload files unminified
+JS_MINIFIER = 'java'    # 'java' for closure compiler, 'python' for in-process whitespace & comment stripping (no renaming), or 'copy' to upload files unminified
 PREFIX_PATH = ''        # path of the repo www folder
 
+CACHE_PATH = ''         # folder of the local cache of minified & gzipped files, may be left empty to disable caching
+CACHE_MAX_BYTES = 512 * 1024 * 1024  # size cap of the cache, least recently used files are evicted first
+
+JOURNAL_PATH = ''       # file recording each built & uploaded file, a rerun after a failed deploy resumes from it without checking S3 again,
+                        # removed after a run without failures (may be left empty to disable)
+
+STREAMING = False       # pipe minifier output through gzip straight into the upload, without temp & versioned files in the repo folder
+SPOOL_MAX_BYTES = 4 * 1024 * 1024  # streamed files bigger than this are buffered in the system temp folder instead of memory
+
+BROTLI = False          # also upload a Brotli compressed variant of each css & js file under its versioned key + '.br', needs the brotli package
+BROTLI_QUALITY = 11     # 0 (fastest) to 11 (smallest)
+
+IMAGE_OPTIMISATION = False  # losslessly recompress png & strip jpeg metadata before upload, bytes saved are reported per file & in total
+IMAGE_WORKERS = 0       # number of processes optimising images, 0 for one per cpu core
+JPEGTRAN_PATH = ''      # path of the folder containing jpegtran, used for jpeg huffman optimisation when found (may default to empty if in system path)
+
+CSS_BATCH_SIZE = 50     # number of css files minified by a single yuicompressor (java) run, 1 to start java once per file (unused when streaming)
+
+BUILD_WORKERS = 2       # number of files minified & gzipped concurrently
+UPLOAD_WORKERS = 4      # number of files uploaded concurrently
+PIPELINE_QUEUE_SIZE = 8 # max number of files waiting between stages, bounds memory usage
+
+WATCH_INTERVAL = 1.0    # seconds between two checks of the xml index & indexed files in watch mode (mydeploy.py --watch)
+
+DEDUPLICATE = True      # copy objects server-side instead of uploading when identical content (same md5) is already deployed in the bucket
+
+BULK_EXISTENCE_THRESHOLD = 100  # buckets with at least this many indexed files are listed once to find existing versions,
+                                # smaller ones are checked with one request per file
+
 
 # config specific to cleanup script
 CSS_PREFIX = ''         # prefix of base path in buckets (eg. base folder name)
 IMAGE_PREFIX = ''       # to narrow down selections during bucket.list() operations
 JS_PREFIX = ''          # by excluding other irrelevant folders (log, etc)
+
+DELETE_BATCH_SIZE = 1000  # number of keys removed per multi-object delete request, S3 allows at most 1000
+DELETE_CONCURRENCY = 4    # number of delete requests in flight at once
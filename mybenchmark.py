@@ -0,0 +1,500 @@
+import argparse
+import contextlib
+import json
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+import mycleanup
+import mydeploy
+import mymetrics
+
+from mylocals3 import LocalS3Server
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+
+BUCKETS = {'css': 'bench-css', 'js': 'bench-js', 'image': 'bench-images'}
+
+EXTENSIONS = {'css': '.css', 'js': '.js', 'image': '.png'}
+
+MEDIAN_SIZES = {'css': 8 * 1024, 'js': 24 * 1024, 'image': 32 * 1024}
+
+# (section, metric, True when higher is better)
+CHECKS = [
+    ('deploy', 'files_per_sec', True),
+    ('deploy', 'bytes_per_sec', True),
+    ('cleanup', 'files_per_sec', True),
+    (None, 'peak_rss_kb', False),
+    ]
+
+FIRST_VERSION = '000000000001'
+NEXT_VERSION = '000000000002'
+
+
+def parse_mix(mix):
+    weights = [int(weight) for weight in mix.split(':')]
+
+    if len(weights) != 3 or sum(weights) <= 0:
+        raise ValueError('mix should look like css:js:image, eg. 40:40:20')
+
+    return dict(zip(('css', 'js', 'image'), weights))
+
+
+def generate_workspace(folder, count, mix=None, seed=0, size_scale=1.0,
+                       max_size=1024 * 1024):
+    rng = random.Random(seed)
+    mix = mix or parse_mix('40:40:20')
+    pools = {'css': make_text_pool(rng, '.rule-{0} {{ margin: 0 {1}px; '
+                                        'color: #{2:06x}; }}\n'),
+             'js': make_text_pool(rng, 'function f{0}(a) {{ return a * {1} + '
+                                       '{2}; }}\n'),
+             'image': rng.getrandbits(8 * 65536).to_bytes(65536, 'little')}
+    types = sorted(mix)
+    weights = [mix[type_] for type_ in types]
+    prefix = os.path.join(folder, 'www') + os.sep
+    entries = []
+    total = 0
+
+    for folder_name in mydeploy.FOLDERS.values():
+        os.makedirs(os.path.join(prefix, folder_name), exist_ok=True)
+
+    for number in range(count):
+        type_ = choose(rng, types, weights)
+        median = MEDIAN_SIZES[type_] * size_scale
+        size = int(min(max(rng.lognormvariate(math.log(median), 0.8), 64),
+                       max_size))
+        url = 'bench-' + str(number).zfill(6) + EXTENSIONS[type_]
+
+        if type_ == 'image':
+            content = make_png(rng, pools['image'], size)
+        else:
+            content = slice_pool(rng, pools[type_], size)
+
+        with open(os.path.join(prefix, mydeploy.FOLDERS[type_] + url),
+                  'wb') as f:
+            f.write(content)
+
+        entries.append((url, type_))
+        total += len(content)
+
+    xml_path = os.path.join(folder, 'index.xml')
+    next_xml_path = os.path.join(folder, 'index-next.xml')
+    write_index(xml_path, entries, FIRST_VERSION)
+    write_index(next_xml_path, entries, NEXT_VERSION)
+
+    return {'prefix': prefix, 'xml': xml_path, 'next_xml': next_xml_path,
+            'files': count, 'bytes': total,
+            'types': dict((type_, sum(1 for entry in entries
+                                      if entry[1] == type_))
+                          for type_ in types)}
+
+
+def choose(rng, values, weights):
+    point = rng.uniform(0, sum(weights))
+
+    for value, weight in zip(values, weights):
+        point -= weight
+
+        if point <= 0:
+            return value
+
+    return values[-1]
+
+
+def make_text_pool(rng, template, size=65536):
+    lines = []
+    length = 0
+
+    while length < size:
+        line = template.format(len(lines), rng.randint(0, 99),
+                               rng.getrandbits(24))
+        lines.append(line)
+        length += len(line)
+
+    return ''.join(lines).encode('utf-8')
+
+
+def slice_pool(rng, pool, size):
+    start = rng.randrange(len(pool))
+    content = (pool[start:] + pool * (size // len(pool) + 1))[:size]
+    return content
+
+
+def make_png(rng, pool, size):
+    width = 64
+    height = max(1, size // (width * 3 + 1))
+    row = width * 3
+    raw = b''.join(b'\x00' + slice_pool(rng, pool, row)
+                   for _ in range(height))
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                       8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(raw, 1)) +
+            chunk(b'IEND', b''))
+
+
+def write_index(path, entries, version):
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="utf-8" ?>\n<staticFiles>\n')
+
+        for url, type_ in entries:
+            f.write('\t<file url="' + url + '">\n'
+                    '\t\t<fileType>' + type_ + '</fileType>\n'
+                    '\t\t<fileVersion>' + version + '</fileVersion>\n'
+                    '\t</file>\n')
+
+        f.write('</staticFiles>\n')
+
+
+def serve(latency, connection):
+    server = LocalS3Server(latency).start()
+    connection.send(server.endpoint)
+    connection.recv()
+    server.stop()
+    connection.send(server.requests)
+
+
+@contextlib.contextmanager
+def local_s3(latency):
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=serve, args=(latency, child))
+    process.daemon = True
+    process.start()
+    stats = {}
+
+    try:
+        yield parent.recv(), stats
+    finally:
+        parent.send('stop')
+        stats.update(parent.recv())
+        process.join()
+
+
+def get_peak_rss_kb():
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # linux reports kilobytes, macOS bytes
+    if sys.platform == 'darwin':
+        peak //= 1024
+
+    return peak
+
+
+def run_benchmark(files=1000, latency_ms=0.0, mix=None, seed=0,
+                  size_scale=1.0, minifier='copy', backend='boto',
+                  optimise_images=False):
+    folder = tempfile.mkdtemp(prefix='mybenchmark-')
+
+    try:
+        workspace = generate_workspace(folder, files, mix, seed, size_scale)
+        config_path = os.path.join(folder, 'boto.cfg')
+
+        with open(config_path, 'w') as f:
+            f.write('[bench]\naws_access_key_id = bench\n'
+                    'aws_secret_access_key = bench\n')
+
+        with local_s3(latency_ms / 1000.0) as (endpoint, requests):
+            settings = {'AWS_CONFIG_PATH': config_path,
+                        'AWS_PROFILE': 'bench',
+                        'CSS_BUCKET': BUCKETS['css'],
+                        'JS_BUCKET': BUCKETS['js'],
+                        'IMAGE_BUCKET': BUCKETS['image'],
+                        'S3_ENDPOINT': endpoint,
+                        'S3_BACKEND': backend}
+            deploy_settings = dict(settings,
+                                   CACHE_PATH='',
+                                   IMAGE_OPTIMISATION=optimise_images,
+                                   CSS_MINIFIER=minifier,
+                                   JS_MINIFIER=minifier,
+                                   PREFIX_PATH=workspace['prefix'],
+                                   XML_PATH=workspace['xml'])
+            cleanup_settings = dict(settings,
+                                    CSS_PREFIX='',
+                                    JS_PREFIX='',
+                                    IMAGE_PREFIX='',
+                                    XML_PATH=workspace['next_xml'])
+
+            with mydeploy.configured(settings, mydeploy):
+                connection = mydeploy.S3Util.connect(
+                    mydeploy.S3Util.get_aws_credentials(config_path, 'bench'))
+
+                for name in BUCKETS.values():
+                    connection.create_bucket(name)
+
+            with open(os.devnull, 'w') as devnull:
+                with contextlib.redirect_stdout(devnull):
+                    start = time.perf_counter()
+                    failures = mydeploy.deploy_main(settings=deploy_settings)
+                    deploy_seconds = time.perf_counter() - start
+                    deploy_stages = mymetrics.current().report()['stages']
+
+                    before = count_versioned_keys(connection, settings)
+                    start = time.perf_counter()
+                    mycleanup.cleanup_main(settings=cleanup_settings)
+                    cleanup_seconds = time.perf_counter() - start
+                    cleanup_stages = mymetrics.current().report()['stages']
+                    deleted = (before -
+                               count_versioned_keys(connection, settings))
+
+        return {
+            'files': workspace['files'],
+            'bytes': workspace['bytes'],
+            'types': workspace['types'],
+            'seed': seed,
+            'latency_ms': latency_ms,
+            'minifier': minifier,
+            'backend': backend,
+            'optimise_images': optimise_images,
+            'deploy': {
+                'seconds': round(deploy_seconds, 4),
+                'files_per_sec': round(workspace['files'] / deploy_seconds, 2),
+                'bytes_per_sec': round(workspace['bytes'] / deploy_seconds),
+                'failed': len(failures),
+                'stages': deploy_stages,
+                },
+            'cleanup': {
+                'seconds': round(cleanup_seconds, 4),
+                'files_per_sec': round(deleted / cleanup_seconds, 2),
+                'deleted': deleted,
+                'stages': cleanup_stages,
+                },
+            'requests': requests,
+            'peak_rss_kb': get_peak_rss_kb(),
+            }
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def compare_minifiers(files=200, mix=None, seed=0, size_scale=1.0,
+                      backends=('java', 'python')):
+    folder = tempfile.mkdtemp(prefix='mybenchmark-')
+
+    try:
+        workspace = generate_workspace(folder, files,
+                                       mix or parse_mix('50:50:0'), seed,
+                                       size_scale)
+        sources = [(type_, os.path.join(workspace['prefix'],
+                                        mydeploy.FOLDERS[type_], name))
+                   for type_ in ('css', 'js')
+                   for name in sorted(os.listdir(os.path.join(
+                       workspace['prefix'], mydeploy.FOLDERS[type_])))]
+        output = os.path.join(folder, 'minified')
+        results = {}
+
+        for backend in backends:
+            with mydeploy.configured({'CSS_MINIFIER': backend,
+                                      'JS_MINIFIER': backend}, mydeploy):
+                for type_, path in sources:
+                    result = results.setdefault(backend, {}).setdefault(
+                        type_, {'files': 0, 'failed': 0, 'seconds': 0.0,
+                                'bytes_in': 0, 'bytes_out': 0})
+                    start = time.perf_counter()
+
+                    try:
+                        with open(os.devnull, 'w') as devnull:
+                            with contextlib.redirect_stderr(devnull):
+                                code = mydeploy.Minifier.minify_file(
+                                    type_, path, output)
+                    except OSError:
+                        code = None
+                        result['failed'] += 1
+                    else:
+                        if code or not os.path.exists(output):
+                            result['failed'] += 1
+                        else:
+                            result['files'] += 1
+                            result['bytes_in'] += os.path.getsize(path)
+                            result['bytes_out'] += os.path.getsize(output)
+
+                    result['seconds'] += time.perf_counter() - start
+
+                    if os.path.exists(output):
+                        os.remove(output)
+
+        for per_type in results.values():
+            for result in per_type.values():
+                result['seconds'] = round(result['seconds'], 4)
+
+                if result['files']:
+                    result['files_per_sec'] = round(
+                        result['files'] / result['seconds'], 2)
+                    result['ratio'] = round(
+                        result['bytes_out'] / result['bytes_in'], 4)
+
+        return results
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def print_minifier_comparison(results):
+    print('Minifier comparison (files/s, output size / input size)')
+
+    for backend, per_type in sorted(results.items()):
+        for type_, result in sorted(per_type.items()):
+            line = '  ' + backend + ' ' + type_ + ': '
+
+            if result['files']:
+                line += (str(result['files_per_sec']) + ' files/s, ratio ' +
+                         str(result['ratio']) + ', ' +
+                         str(result['bytes_out']) + ' bytes')
+            else:
+                line += 'unavailable'
+
+            if result['failed']:
+                line += ', ' + str(result['failed']) + ' failed'
+
+            print(line)
+
+
+def count_versioned_keys(connection, settings):
+    with mydeploy.configured(settings, mydeploy):
+        return sum(1 for name in BUCKETS.values()
+                   for key in mydeploy.S3Util.list_keys(
+                       connection.get_bucket(name))
+                   if mydeploy.VERSIONED_PATTERN.search('/' + key))
+
+
+def compare_with_baseline(report, baseline, tolerance):
+    regressions = []
+
+    for section, metric, higher_is_better in CHECKS:
+        current = (report.get(section) or {}) if section else report
+        previous = (baseline.get(section) or {}) if section else baseline
+        current = current.get(metric)
+        previous = previous.get(metric)
+        name = (section + ' ' if section else '') + metric
+
+        if current is None or not previous:
+            continue
+
+        if higher_is_better:
+            regressed = current < previous * (1 - tolerance)
+        else:
+            regressed = current > previous * (1 + tolerance)
+
+        if regressed:
+            regressions.append(name + ' regressed: ' + str(current) +
+                               ' against baseline ' + str(previous))
+
+    return regressions
+
+
+def print_report(report):
+    print('Benchmark of ' + str(report['files']) + ' files (' +
+          str(report['bytes']) + ' bytes), ' + str(report['latency_ms']) +
+          ' ms latency, ' + report['minifier'] + ' minifier, ' +
+          report['backend'] + ' backend')
+
+    for section in ('deploy', 'cleanup'):
+        result = report[section]
+        print(section + ': ' + str(result['seconds']) + ' s, ' +
+              str(result['files_per_sec']) + ' files/s' +
+              (', ' + str(result['bytes_per_sec']) + ' bytes/s'
+               if 'bytes_per_sec' in result else ''))
+
+        for stage, timing in sorted(result['stages'].items()):
+            print('  ' + stage + ': ' + str(timing['seconds']) + ' s in ' +
+                  str(timing['calls']) + ' calls, p50 ' +
+                  mymetrics.format_seconds(timing['p50']) + ' s, p95 ' +
+                  mymetrics.format_seconds(timing['p95']) + ' s')
+
+    if report['deploy']['failed']:
+        print('Failed files: ' + str(report['deploy']['failed']))
+
+    print('Peak RSS: ' + (str(report['peak_rss_kb']) + ' KB'
+                          if report['peak_rss_kb'] is not None
+                          else 'unavailable'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark deploy & cleanup against a local S3 stand-in')
+    parser.add_argument('--files', type=int, default=1000,
+                        help='number of generated static files')
+    parser.add_argument('--mix', default='40:40:20',
+                        help='relative share of css:js:image files')
+    parser.add_argument('--size-scale', type=float, default=1.0,
+                        help='multiplier of the median file size per type')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='latency in milliseconds added to each request')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--minifier', choices=('copy', 'java', 'python'),
+                        default='copy',
+                        help='copy files instead of minifying them (default), '
+                             'run the java minifiers or the in-process '
+                             'python one')
+    parser.add_argument('--compare-minifiers', action='store_true',
+                        help='only time every minifier backend on the '
+                             'generated css & js files and compare sizes')
+    parser.add_argument('--backend', choices=('boto', 'asyncio'),
+                        default='boto', help='S3 client used by the scripts')
+    parser.add_argument('--optimise-images', action='store_true',
+                        help='losslessly optimise images before upload')
+    parser.add_argument('--output', help='write the report as json')
+    parser.add_argument('--baseline',
+                        help='fail when slower than this json report')
+    parser.add_argument('--save-baseline',
+                        help='store the report as baseline json')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative regression against baseline')
+    args = parser.parse_args(argv)
+
+    if args.compare_minifiers:
+        results = compare_minifiers(args.files, parse_mix(args.mix),
+                                    args.seed, args.size_scale)
+        print_minifier_comparison(results)
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+        return 0
+
+    report = run_benchmark(args.files, args.latency, parse_mix(args.mix),
+                           args.seed, args.size_scale, args.minifier,
+                           args.backend, args.optimise_images)
+    print_report(report)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+
+    if report['deploy']['failed']:
+        return 1
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_with_baseline(report, json.load(f),
+                                                args.tolerance)
+
+        for regression in regressions:
+            print('Regression: ' + regression)
+
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
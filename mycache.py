@@ -0,0 +1,135 @@
+import collections
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+
+def get_file_digest(path, chunk_size=65536):
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class ArtifactCache(object):
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def make_key(*parts):
+        digest = hashlib.sha256()
+
+        for part in parts:
+            digest.update(part.encode('utf-8') + b'\0')
+
+        return digest.hexdigest()
+
+    def contains(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def open(self, key):
+        # opened under the lock, a put or an eviction removing the entry
+        # afterwards does not take it from the caller
+        with self._lock:
+            if key in self._entries:
+                path = self._path_of(key)
+
+                try:
+                    entry_file = open(path, 'rb')
+                except FileNotFoundError:
+                    # removed from outside, counted as a miss
+                    self._size -= self._entries.pop(key)
+                else:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+
+                    try:
+                        os.utime(path, None)
+                    except OSError:
+                        pass
+
+                    return entry_file
+
+            self.misses += 1
+            return None
+
+    def put(self, key, source_path):
+        with open(source_path, 'rb') as source_file:
+            self.put_file(key, source_file)
+
+    def put_file(self, key, source_file):
+        handle, temp_path = tempfile.mkstemp(dir=self.path, suffix='.part')
+
+        with os.fdopen(handle, 'wb') as temp_file:
+            shutil.copyfileobj(source_file, temp_file)
+            size = temp_file.tell()
+
+        if size > self.max_bytes:
+            os.remove(temp_path)
+            return
+
+        with self._lock:
+            os.replace(temp_path, self._path_of(key))
+
+            if key in self._entries:
+                self._size -= self._entries.pop(key)
+
+            self._entries[key] = size
+            self._size += size
+            self._evict()
+
+    def summary(self):
+        return ('Cache: ' + str(self.hits) + ' hits, ' +
+                str(self.misses) + ' misses, ' +
+                str(self.evictions) + ' evictions, ' +
+                str(len(self._entries)) + ' entries (' +
+                str(self._size) + ' bytes)')
+
+    def _path_of(self, key):
+        return os.path.join(self.path, key)
+
+    def _load(self):
+        found = []
+
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+
+            if name.endswith('.part'):
+                os.remove(path)
+                continue
+
+            stat = os.stat(path)
+            found.append((stat.st_mtime, name, stat.st_size))
+
+        for mtime, name, size in sorted(found):
+            self._entries[name] = size
+            self._size += size
+
+        self._evict()
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+
+            try:
+                os.remove(self._path_of(key))
+            except OSError:
+                pass
@@ -1,9 +1,23 @@
 
-import re
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import sys
+
+import mydeploy
+import mylimiter
+import mymetrics
 
 from mydeploy import (
+    BROTLI_SUFFIX,
     get_file_objects,
+    Manifest,
+    print_limit_summary,
+    print_pool_summary,
+    profile_startup,
     S3Util,
+    VERSIONED_PATTERN,
     )
 
 from environment_config import (
@@ -15,38 +29,168 @@ from environment_config import (
     CSS_PREFIX,
     IMAGE_PREFIX,
     JS_PREFIX,
+    DELETE_BATCH_SIZE,
+    DELETE_CONCURRENCY,
+    MANIFEST_KEY,
+    METRICS_PATH,
+    METRICS_FORMAT,
     XML_PATH
     )
 
 
-def cleanup_main():
+def cleanup_main(dry_run_path=None, settings=None):
+    # the S3 calls read their settings from mydeploy
+    with mydeploy.configured(settings, sys.modules[__name__], mydeploy):
+        cleanup(dry_run_path)
+
+
+def cleanup(dry_run_path):
+
+    metrics = mymetrics.start('cleanup')
+    limiters = mylimiter.start()
 
     c = S3Util.create_connection_pools(AWS_CONFIG_PATH, AWS_PROFILE,
                                        CSS_BUCKET, JS_BUCKET, IMAGE_BUCKET)
 
     existing_versioned_files_in_xml = get_file_objects(c, XML_PATH)
 
-    keys_in_xml = [item.versioned_path_in_bucket for item
-                   in existing_versioned_files_in_xml]
+    keys_in_xml = set(item.versioned_path_in_bucket for item
+                      in existing_versioned_files_in_xml)
+    keys_in_xml.update([key + BROTLI_SUFFIX for key in keys_in_xml])
 
-    for bucket in [
-                   (c['css_bucket'], CSS_PREFIX),
-                   (c['js_bucket'], JS_PREFIX),
-                   (c['image_bucket'], IMAGE_PREFIX)]:
+    plan = open(dry_run_path, 'w') if dry_run_path else None
 
-        keys_matching_pattern = get_all_matching_keys(bucket[0], bucket[1])
+    try:
+        for bucket in [
+                       (c['css_bucket'], CSS_PREFIX),
+                       (c['js_bucket'], JS_PREFIX),
+                       (c['image_bucket'], IMAGE_PREFIX)]:
 
-        for key_ in keys_matching_pattern:
+            manifest = load_manifest(bucket[0])
 
-            if (key_.key in keys_in_xml):
-                print('Skipping deletion of http://' + bucket[0].name +
-                      '.s3.amazonaws.com/' + key_.key +
-                      ', currently indexed in XML file \n')
+            # keys outside the listed folders are missing from the manifest
+            # until the prefix cleaned up has been listed once
+            if manifest is not None and not manifest.covers(bucket[1]):
+                manifest.add_listing([bucket[1]])
 
+            if manifest is not None:
+                keys_matching_pattern = iter_manifest_matching_keys(
+                    manifest, bucket[1])
             else:
-                key_.delete()
-                print('Deleted http://' + bucket[0].name +
-                      '.s3.amazonaws.com/' + key_.key + '\n')
+                keys_matching_pattern = iter_matching_keys(bucket[0],
+                                                           bucket[1])
+
+            keys_to_delete = iter_keys_to_delete(bucket[0],
+                                                 keys_matching_pattern,
+                                                 keys_in_xml)
+
+            if plan is not None:
+                write_deletion_plan(bucket[0], keys_to_delete, plan)
+                continue
+
+            try:
+                delete_keys_in_batches(bucket[0], keys_to_delete, manifest)
+            finally:
+                if manifest is not None:
+                    manifest.save()
+    finally:
+        if plan is not None:
+            plan.close()
+
+    print_pool_summary(c)
+    print_limit_summary(limiters)
+    print(metrics.summary())
+
+    if METRICS_PATH:
+        print('Metrics written to ' +
+              metrics.write(METRICS_PATH, METRICS_FORMAT))
+
+
+def iter_keys_to_delete(bucket, keys, keys_in_xml):
+    for key_ in keys:
+
+        if (key_ in keys_in_xml):
+            print('Skipping deletion of http://' + bucket.name +
+                  '.s3.amazonaws.com/' + key_ +
+                  ', currently indexed in XML file \n')
+
+        else:
+            yield key_
+
+
+def write_deletion_plan(bucket, keys, plan):
+    count = 0
+
+    for key_ in keys:
+        plan.write('http://' + bucket.name + '.s3.amazonaws.com/' +
+                   key_ + '\n')
+        count += 1
+
+    print('Planned deletion of ' + str(count) + ' keys from ' +
+          bucket.name + ' -> ' + plan.name + '\n')
+
+
+def iter_batches(keys, size):
+    keys = iter(keys)
+
+    while True:
+        batch = list(itertools.islice(keys, size))
+
+        if not batch:
+            return
+
+        yield batch
+
+
+def delete_keys_in_batches(bucket, keys, manifest=None):
+    pending = collections.deque()
+
+    with concurrent.futures.ThreadPoolExecutor(DELETE_CONCURRENCY) as executor:
+        for batch in iter_batches(keys, DELETE_BATCH_SIZE):
+            if len(pending) >= DELETE_CONCURRENCY:
+                report_deletions(bucket, pending.popleft().result(), manifest)
+
+            pending.append(executor.submit(S3Util.delete_keys, bucket, batch))
+
+        while pending:
+            report_deletions(bucket, pending.popleft().result(), manifest)
+
+
+def report_deletions(bucket, result, manifest=None):
+    for deleted in result.deleted:
+        if manifest is not None:
+            manifest.remove(deleted.key)
+
+        print('Deleted http://' + bucket.name +
+              '.s3.amazonaws.com/' + deleted.key + '\n')
+
+    for error in result.errors:
+        print('Failed deletion of http://' + bucket.name +
+              '.s3.amazonaws.com/' + error.key + ': ' +
+              str(error.code) + ' ' + str(error.message) + '\n')
+
+
+def load_manifest(bucket):
+    if not MANIFEST_KEY:
+        return None
+
+    manifest = Manifest(bucket, MANIFEST_KEY)
+
+    if manifest.load():
+        return manifest
+
+    return None
+
+
+def iter_manifest_matching_keys(manifest, prefix_=None):
+    return (key for key in sorted(manifest.entries)
+            if key.startswith(prefix_ or '') and
+            is_matching_versioned_pattern(key))
+
+
+def iter_matching_keys(bucket, prefix_=None):
+    return (key for key in S3Util.list_keys(bucket, prefix_)
+            if is_matching_versioned_pattern(key))
 
 
 def get_all_matching_keys(bucket, prefix_=None):
@@ -55,8 +199,22 @@ def get_all_matching_keys(bucket, prefix_=None):
 
 
 def is_matching_versioned_pattern(path):
-    return bool(re.search('\/(.*-\d{12}\..*$)', path))
+    return VERSIONED_PATTERN.search(path) is not None
 
 
 if __name__ == '__main__':
-    cleanup_main()
+    parser = argparse.ArgumentParser(
+        description='Delete versioned static files no longer indexed in XML')
+    parser.add_argument('--dry-run', metavar='PLAN_PATH',
+                        help='write the keys that would be deleted to '
+                             'PLAN_PATH instead of deleting them')
+    parser.add_argument('--startup-profile', action='store_true',
+                        help='print the time spent importing modules and in '
+                             'each startup phase, then exit without cleaning '
+                             'up')
+    args = parser.parse_args()
+
+    if args.startup_profile:
+        profile_startup('mycleanup')
+    else:
+        cleanup_main(dry_run_path=args.dry_run)
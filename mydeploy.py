@@ -1,10 +1,25 @@
 
+import argparse
 import boto
+import boto.s3.connection
+import boto.s3.multipart
+import concurrent.futures
 import configparser
+import contextlib
+import copy
+import environment_config
 import gzip
+import hashlib
+import io
+import json
 import os
 import re
+import shutil
 import subprocess
+import sys
+import tempfile
+import threading
+import time
 import xml.etree.ElementTree as ET
 
 from environment_config import (
@@ -13,107 +28,1035 @@ from environment_config import (
     CSS_BUCKET,
     IMAGE_BUCKET,
     JS_BUCKET,
+    S3_ENDPOINT,
+    TARGETS,
+    TARGET_CONCURRENCY,
+    S3_BACKEND,
+    S3_POOL_SIZE,
+    MULTIPART_THRESHOLD,
+    MULTIPART_PART_SIZE,
+    MULTIPART_CONCURRENCY,
+    MULTIPART_RETRIES,
     PREFIX_PATH,
     XML_PATH,
     JAVA_PATH,
     MINIFIER_PATH,
+    CSS_MINIFIER,
+    JS_MINIFIER,
+    BUILD_WORKERS,
+    UPLOAD_WORKERS,
+    PIPELINE_QUEUE_SIZE,
+    BULK_EXISTENCE_THRESHOLD,
+    DEDUPLICATE,
+    CSS_BATCH_SIZE,
+    CACHE_PATH,
+    CACHE_MAX_BYTES,
+    JOURNAL_PATH,
+    STREAMING,
+    SPOOL_MAX_BYTES,
+    BROTLI,
+    BROTLI_QUALITY,
+    IMAGE_OPTIMISATION,
+    IMAGE_WORKERS,
+    JPEGTRAN_PATH,
+    MANIFEST_KEY,
+    METRICS_PATH,
+    METRICS_FORMAT,
     )
 
+import mylimiter
+import mymetrics
+import myretry
 
-def deploy_main(skip_existing=True):
+from myjournal import Journal
+
+from mycache import (
+    ArtifactCache,
+    get_file_digest,
+    )
+
+from mypipeline import Pipeline
+
+from mystartup import StartupProfile
+
+from mys3pool import (
+    ConnectionPool,
+    PooledBucket,
+    )
+
+
+VERSIONED_PATTERN = re.compile(r'\/(.*-\d{12}\..*$)')
+
+VERSIONABLE_PATH = re.compile(r'(.*)\.(css|js|gif|jpg|jpeg|png)$')
+
+FOLDERS = {'css': 'css/', 'js': 'scripts/', 'image': 'images/'}
+
+BROTLI_SUFFIX = '.br'
+
+GZIP_CHUNK_SIZE = 64 * 1024
+
+BUNDLE_TYPES = ('css', 'js')
+
+# a js file missing its last semicolon must not run into the next one
+BUNDLE_SEPARATORS = {'css': b'\n', 'js': b'\n;\n'}
+
+# number of files checked against the buckets at once while they are
+# streamed into the pipeline
+CHECK_BATCH_SIZE = 1000
+
+# smallest part S3 accepts, but for the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def deploy_main(skip_existing=True, settings=None):
+    with configured(settings, sys.modules[__name__]):
+        return deploy(skip_existing)
+
+
+def deploy(skip_existing):
+
+    check_settings()
+
+    metrics = mymetrics.start('deploy')
+
+    targets = connect_targets()
+
+    file_objects = FileIndex(targets[0].connection_pools, XML_PATH,
+                             validate=True)
+
+    deployment = Deployment(targets)
+
+    try:
+        deployment.load_manifests(file_objects)
+        failures = deployment.run(file_objects, skip_existing)
+    finally:
+        deployment.close()
+
+    deployment.print_pool_summary()
+    report_metrics(metrics)
+
+    return failures
+
+
+@contextlib.contextmanager
+def configured(settings, *modules):
+    # names of environment_config given other values for one run, in the
+    # modules that read them, then restored
+    settings = settings or {}
+    saved = []
+
+    for name in settings:
+        if not hasattr(environment_config, name):
+            raise ValueError('Unknown setting ' + name)
+
+    try:
+        for module in modules:
+            for name, value in settings.items():
+                if hasattr(module, name):
+                    saved.append((module, name, getattr(module, name)))
+                    setattr(module, name, value)
+
+        yield
+    finally:
+        for module, name, value in reversed(saved):
+            setattr(module, name, value)
+
+
+def check_settings():
+    if BROTLI:
+        get_brotli()
+
+    for type_ in ('css', 'js'):
+        Minifier.backend(type_)
+
+    if MULTIPART_PART_SIZE < MIN_PART_SIZE:
+        raise ValueError('MULTIPART_PART_SIZE must be at least ' +
+                         str(MIN_PART_SIZE) + ' bytes, S3 rejects smaller '
+                         'parts: ' + str(MULTIPART_PART_SIZE))
+
+    for target in TARGETS:
+        if not target.get('name'):
+            raise ValueError('Every entry of TARGETS needs a name: ' +
+                             repr(target))
+
+
+def connect_buckets():
+    return S3Util.create_connection_pools(AWS_CONFIG_PATH, AWS_PROFILE,
+                                         CSS_BUCKET, JS_BUCKET, IMAGE_BUCKET)
+
+
+def connect_targets():
+    if not TARGETS:
+        return [Target('default', connect_buckets())]
+
+    return [Target(target['name'], S3Util.create_connection_pools(
+                target.get('aws_config_path', AWS_CONFIG_PATH),
+                target.get('aws_profile', AWS_PROFILE),
+                target.get('css_bucket', CSS_BUCKET),
+                target.get('js_bucket', JS_BUCKET),
+                target.get('image_bucket', IMAGE_BUCKET)))
+            for target in TARGETS]
 
-    connection_pools = S3Util.create_connection_pools(AWS_CONFIG_PATH,
-                                                      AWS_PROFILE,
-                                                      CSS_BUCKET,
-                                                      JS_BUCKET,
-                                                      IMAGE_BUCKET)
 
-    file_objects = get_file_objects(connection_pools, XML_PATH)
+class Target(object):
 
-    if skip_existing:
-        file_objects = [item for item in file_objects
-                        if not item.exists_in_bucket()]
+    def __init__(self, name, connection_pools):
+        # buckets the built files are published to, with what is known of
+        # their content & what failed to reach them during a run
+        self.name = name
+        self.connection_pools = connection_pools
+        self.manifests = {}
+        self.content_index = ContentIndex() if DEDUPLICATE else None
+        self.uploaded = []
+        self.failures = []
+        self.error = None
+        self.key_index = None
+
+    def get_items(self, file_objects):
+        return (item.for_target(self.connection_pools)
+                for item in file_objects)
+
+    def get_bucket(self, item):
+        if item.connection_pools is self.connection_pools:
+            return item.associated_bucket
+
+        return self.connection_pools[item.type_ + '_bucket']
+
+    def load_manifests(self, file_objects):
+        missing = (item for item in self.get_items(file_objects)
+                   if item.associated_bucket.name not in self.manifests)
+        manifests = Manifest.load_all(missing, MANIFEST_KEY)
+
+        for name, manifest in manifests.items():
+            self.manifests[name] = manifest
+
+            if self.content_index is not None:
+                self.content_index.add_manifest(name, manifest)
+
+    def index_keys(self, file_objects, skip_existing=True):
+        # a pass over the whole index, listing the buckets with many files
+        self.key_index = None
+
+        if skip_existing:
+            self.key_index = KeyIndex(self.get_items(file_objects),
+                                      BULK_EXISTENCE_THRESHOLD,
+                                      self.manifests, self.content_index)
+
+    def find_missing(self, file_objects, journal=None):
+        items = list(self.get_items(file_objects))
+        originals = dict(zip(items, file_objects))
+        resumed = 0
+
+        if journal is not None:
+            remaining = resume_uploads(items, journal, self.manifests,
+                                       self.content_index)
+            resumed = len(items) - len(remaining)
+            items = remaining
+
+        if self.key_index is not None:
+            items = remove_existing(items, self.key_index)
+
+        return [originals[item] for item in items], resumed
+
+    def upload(self, item, journal=None, check_remote=False):
+        bucket = self.get_bucket(item)
+        key = item.versioned_path_in_bucket
+
+        try:
+            (md5, size), variants = item.upload(self.content_index, bucket,
+                                                check_remote)
+        except Exception as e:
+            self.failures.append((item, e))
+            raise
+
+        manifest = self.manifests.get(bucket.name)
+
+        if manifest is not None:
+            manifest.add(key, md5, size)
+
+            for variant in variants:
+                manifest.add(*variant)
+
+        if journal is not None:
+            journal.record(bucket.name, key, 'upload',
+                           {'md5': md5, 'size': size, 'variants': variants})
+
+        self.uploaded.append(key)
+
+    def save_manifests(self):
+        for manifest in self.manifests.values():
+            manifest.save()
+
+    def summary(self):
+        # failures without an item kept the whole target from being checked
+        lines = ['Failed checking target ' + self.name + ': ' + repr(error)
+                 if item is None else
+                 'Failed upload of ' + item.path_in_filesystem + ' to ' +
+                 self.name + ': ' + repr(error)
+                 for item, error in self.failures]
+        lines.append('Target ' + self.name + ': ' + str(len(self.uploaded)) +
+                     ' uploaded, ' + str(len(self.failures)) + ' failed')
+        return '\n'.join(lines)
+
+
+class Deployment(object):
+
+    def __init__(self, targets, streaming=None):
+        # state kept from one run to the next: connections, manifests,
+        # known content, cache and image optimisation processes
+        self.targets = targets
+        self.streaming = STREAMING if streaming is None else streaming
+        self.cache = None
+        self.images = None
+        self.limiters = mylimiter.start()
+
+        if CACHE_PATH:
+            self.cache = ArtifactCache(CACHE_PATH, CACHE_MAX_BYTES)
+
+        if IMAGE_OPTIMISATION:
+            from myimages import ImageOptimiser
+            self.images = ImageOptimiser(self.cache, IMAGE_WORKERS,
+                                         JPEGTRAN_PATH)
+
+    def load_manifests(self, file_objects):
+        for target in self.targets:
+            target.error = None
+
+            if not MANIFEST_KEY:
+                continue
+
+            # a target that cannot be read is left out of the run, the
+            # others are still deployed
+            try:
+                target.load_manifests(file_objects)
+            except Exception as e:
+                target.error = e
+
+    def run(self, file_objects, skip_existing=True):
+        targets = self.targets
+        cache = self.cache
+        images = self.images
+        streaming = self.streaming
+
+        journal = None
+        resuming = False
+        built = set()
+
+        if JOURNAL_PATH:
+            journal = Journal(JOURNAL_PATH)
+            resuming = journal.load() > 0
+
+        # each file is built once, then uploaded to every target missing it
+        destinations = {}
+        counts = {'resumed': 0, 'built': 0}
+        checked = []
+        unchecked = []
+
+        def fail_check(target, error):
+            target.failures.append((None, error))
+            unchecked.append((None, 'check', error))
+
+        for target in targets:
+            target.uploaded = []
+            target.failures = []
+
+            try:
+                if target.error is not None:
+                    raise target.error
+
+                target.index_keys(file_objects, skip_existing)
+            except Exception as e:
+                fail_check(target, e)
+                continue
+
+            checked.append(target)
+
+        if images is not None:
+            images.reset_counts()
+
+        def iter_missing():
+            # items are streamed into the pipeline, checked against the
+            # targets a batch at a time
+            for batch in iter_batches(file_objects, CHECK_BATCH_SIZE):
+                missing = dict((item, []) for item in batch)
+
+                for target in list(checked):
+                    try:
+                        found, resumed = target.find_missing(
+                            batch, journal if resuming else None)
+                    except Exception as e:
+                        fail_check(target, e)
+                        checked.remove(target)
+                        continue
+
+                    counts['resumed'] += resumed
+
+                    for item in found:
+                        missing[item].append(target)
+
+                batch = [item for item in batch if missing[item]]
+
+                # streamed artifacts only live in memory, nothing to resume
+                if resuming and not streaming:
+                    for item in batch:
+                        if item.restore_build(journal.get(
+                                item.associated_bucket.name,
+                                item.versioned_path_in_bucket, 'build')):
+                            built.add(item)
+                            counts['built'] += 1
+
+                if not streaming:
+                    MinifierBatch.assign([item for item in batch
+                                          if item not in built and
+                                          not item.is_in_cache(cache)],
+                                         CSS_BATCH_SIZE)
+
+                if images is not None:
+                    # the images of a batch are queued together so all
+                    # cores are kept busy while the pipeline works through
+                    # the other files
+                    for item in batch:
+                        if item.type_ == 'image':
+                            images.submit(item.path_in_filesystem)
+
+                for item in batch:
+                    destinations[item] = missing[item]
+                    yield item
+
+        def build(item):
+            try:
+                if item in built:
+                    built.discard(item)
+                    print('\nresumed ' + item.versioned_path_in_filesystem +
+                          ' from journal')
+                    return
+
+                item.build(cache, streaming, images)
+            except Exception:
+                destinations.pop(item, None)
+                raise
+
+            if journal is not None and not streaming:
+                journal.record(item.associated_bucket.name,
+                               item.versioned_path_in_bucket, 'build',
+                               {'brotli_path': item.brotli_path})
+
+        fan_out = None
+
+        if len(targets) > 1:
+            fan_out = concurrent.futures.ThreadPoolExecutor(
+                min(len(targets), TARGET_CONCURRENCY) * UPLOAD_WORKERS)
+
+        # forced uploads still leave out content the bucket already has
+        check_remote = not skip_existing
+
+        def upload(item):
+            item_targets = destinations.pop(item)
+
+            try:
+                if len(item_targets) == 1:
+                    item_targets[0].upload(item, journal, check_remote)
+                    return
+
+                item.share_artifacts()
+                futures = [fan_out.submit(target.upload, item, journal,
+                                          check_remote)
+                           for target in item_targets]
+
+                # a failing target does not stop the upload to the others
+                errors = [future.exception() for future in futures]
+
+                for error in errors:
+                    if error is not None:
+                        raise error
+            finally:
+                item.close_artifacts()
+
+        pipeline = Pipeline([('build', build, BUILD_WORKERS),
+                             ('upload', upload, UPLOAD_WORKERS)],
+                            PIPELINE_QUEUE_SIZE)
+
+        try:
+            failures = pipeline.run(iter_missing())
+        finally:
+            if fan_out is not None:
+                fan_out.shutdown()
+
+            for target in targets:
+                target.save_manifests()
+
+            if journal is not None:
+                journal.close()
+
+        if resuming:
+            print('Resumed from journal ' + journal.path + ': ' +
+                  str(counts['resumed']) + ' files already uploaded, ' +
+                  str(counts['built']) + ' already built')
+
+        if journal is not None:
+            if failures or unchecked:
+                print('Journal kept at ' + JOURNAL_PATH +
+                      ', the next run resumes from it')
+            else:
+                journal.remove()
+
+        for item, stage, error in failures:
+            # upload failures are reported by each target
+            if stage != 'upload' or fan_out is None:
+                print('Failed processing of ' + item.path_in_filesystem +
+                      ' at ' + stage + ' stage: ' + repr(error))
+
+        if fan_out is not None or unchecked:
+            for target in targets:
+                print(target.summary())
+
+        print('\nProcessed ' + str(pipeline.completed) + ' files, ' +
+              str(len(failures)) + ' failed')
+
+        if cache is not None:
+            print(cache.summary())
+
+        if images is not None:
+            print(images.summary())
+
+        return failures + unchecked
+
+    def print_pool_summary(self):
+        for target in self.targets:
+            if len(self.targets) > 1:
+                print('Target ' + target.name + ':')
+
+            print_pool_summary(target.connection_pools)
+
+        print_limit_summary(self.limiters)
+
+    def close(self):
+        if self.images is not None:
+            self.images.close()
+
+
+def profile_startup(module):
+    profile = StartupProfile(module)
+
+    with profile.phase('connection pools'):
+        connection_pools = connect_buckets()
+
+    with profile.phase('xml index'):
+        file_objects = get_file_objects(connection_pools, XML_PATH)
+
+    print('\n' + profile.summary())
+    print(str(len(file_objects)) + ' indexed files')
+    print_pool_summary(connection_pools)
+
+
+def print_pool_summary(connection_pools):
+    pool = getattr(connection_pools['css_bucket'], 'pool', None)
+
+    if pool is not None:
+        print(pool.summary())
+
+
+def get_brotli():
+    # only imported by runs uploading brotli variants
+    try:
+        import brotli
+    except ImportError:
+        raise ImportError('BROTLI is enabled but the brotli package '
+                          'is not installed (pip install brotli)')
+
+    return brotli
+
+
+def print_limit_summary(limiters):
+    summary = limiters.summary()
+
+    if summary is not None:
+        print(summary)
+
+
+def report_metrics(metrics):
+    print(metrics.summary())
+
+    if METRICS_PATH:
+        print('Metrics written to ' +
+              metrics.write(METRICS_PATH, METRICS_FORMAT))
+
+
+def resume_uploads(file_objects, journal, manifests, content_index):
+    remaining = []
 
     for item in file_objects:
-        if (len(item.version) == 12 and item.version.isdigit()):
-            item.process()
-        else:
-            print('Skipping processing of ' +
-                  item.versioned_path_in_filesystem +
-                  ', version does not equal 12 digits')
+        bucket_name = item.associated_bucket.name
+        key = item.versioned_path_in_bucket
+        entry = journal.get(bucket_name, key, 'upload')
+
+        if entry is None:
+            remaining.append(item)
+            continue
+
+        manifest = manifests.get(bucket_name)
+        uploads = [[key, entry['md5'], entry['size']]] + entry['variants']
+
+        for path, md5, size in uploads:
+            if manifest is not None:
+                manifest.add(path, md5, size)
+
+            if content_index is not None:
+                content_index.add(bucket_name, md5, path)
+
+    return remaining
+
+
+def remove_existing(file_objects, key_index):
+    found = [key_index.contains(item) for item in file_objects]
+
+    # files the index knows nothing about are probed together, so the
+    # asyncio backend can send the requests concurrently
+    probed = iter(S3Util.files_exist(
+        [(item.versioned_path_in_bucket, item.associated_bucket)
+         for item, exists in zip(file_objects, found) if exists is None]))
+
+    return [item for item, exists in zip(file_objects, found)
+            if not (next(probed) if exists is None else exists)]
+
+
+def iter_batches(items, size):
+    batch = []
+
+    for item in items:
+        batch.append(item)
+
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def group_by_bucket(file_objects):
+    # the bucket & versioned keys of the files of each bucket, the items
+    # themselves are not kept
+    keys_per_bucket = {}
+
+    for item in file_objects:
+        bucket = item.associated_bucket
+        keys_per_bucket.setdefault(bucket.name, (bucket, []))[1].append(
+            item.versioned_path_in_bucket)
+
+    return keys_per_bucket
+
+
+def has_valid_version(item):
+    if (len(item.version) == 12 and item.version.isdigit()):
+        return True
+
+    print('Skipping processing of ' +
+          item.versioned_path_in_filesystem +
+          ', version does not equal 12 digits')
+    return False
 
 
 def get_file_objects(connection_pools, xml_path):
-    files = XMLParser.create_matrix_from_xml(xml_path)
-    file_objects = objectify_entries(files, connection_pools)
-    return file_objects
+    return list(iter_file_objects(connection_pools, xml_path))
+
 
+def iter_file_objects(connection_pools, xml_path, validate=False):
+    # bundles follow the files, only the versions of their possible
+    # members are kept meanwhile
+    bundles = []
+    members = {}
 
-def objectify_entries(entries_matrix, connection_pools):
+    def iter_entries():
+        for tag, entry in XMLParser.iter_index(xml_path):
+            if tag == 'file':
+                yield entry
+            else:
+                bundles.append(entry)
 
-    items = []
+    for item in objectify_entries(iter_entries(), connection_pools, validate):
+        if item.type_ in BUNDLE_TYPES:
+            members[(item.type_, item.url)] = item.version
+
+        yield item
+
+    for bundle in objectify_bundles(bundles, members, connection_pools):
+        yield bundle
+
+
+class FileIndex(object):
+
+    def __init__(self, connection_pools, xml_path, validate=False):
+        # the index is parsed & validated once into plain tuples, each pass
+        # over it creates the items again so they are dropped once
+        # processed
+        self.connection_pools = connection_pools
+        self.entries = []
+        self.bundles = []
+
+        for item in iter_file_objects(connection_pools, xml_path, validate):
+            if isinstance(item, Bundle):
+                self.bundles.append((item.url, item.type_,
+                                     [(member.url, member.version)
+                                      for member in item.members]))
+            else:
+                self.entries.append((item.url, item.type_, item.version))
+
+    def __iter__(self):
+        for url, type_, version in self.entries:
+            yield StaticFile(PREFIX_PATH, url, type_, version,
+                             self.connection_pools)
+
+        for url, type_, members in self.bundles:
+            yield Bundle(PREFIX_PATH, url, type_,
+                         [StaticFile(PREFIX_PATH, member_url, type_, version,
+                                     self.connection_pools)
+                          for member_url, version in members],
+                         self.connection_pools)
+
+    def __len__(self):
+        return len(self.entries) + len(self.bundles)
+
+
+def objectify_entries(entries_matrix, connection_pools, validate=False):
 
     for entry in entries_matrix:
         file_path = entry[0]
         file_type = entry[1]
         file_version = entry[2]
 
+        if file_type not in FOLDERS:
+            print('Skipping processing of ' + file_path +
+                  ', unknown file type ' + str(file_type))
+            continue
+
+        if not VERSIONABLE_PATH.search(file_path):
+            print('Skipping processing of ' + file_path +
+                  ', unsupported file extension')
+            continue
+
         f = StaticFile(PREFIX_PATH, file_path, file_type,
                        file_version, connection_pools)
-        items.append(f)
 
-    return items
+        if validate and not has_valid_version(f):
+            continue
+
+        yield f
+
+
+def objectify_bundles(bundles, members, connection_pools):
+    seen = set()
+
+    for url, type_, member_urls in bundles:
+        if type_ not in BUNDLE_TYPES:
+            print('Skipping bundle ' + url + ', only css & js files can be '
+                  'bundled')
+            continue
+
+        if not VERSIONABLE_PATH.search(url):
+            print('Skipping bundle ' + url + ', unsupported file extension')
+            continue
+
+        # both would be uploaded under the same key
+        if (type_, url) in members:
+            print('Skipping bundle ' + url + ', an indexed file has the '
+                  'same url')
+            continue
+
+        if (type_, url) in seen:
+            print('Skipping bundle ' + url + ', another bundle has the '
+                  'same url')
+            continue
+
+        seen.add((type_, url))
+
+        missing = [member_url for member_url in member_urls
+                   if (type_, member_url) not in members]
+
+        if missing or not member_urls:
+            print('Skipping bundle ' + url + ', ' +
+                  ('member ' + missing[0] + ' is not a valid indexed ' +
+                   type_ + ' file' if missing else 'no members'))
+            continue
+
+        yield Bundle(PREFIX_PATH, url, type_,
+                     [StaticFile(PREFIX_PATH, member_url, type_,
+                                 members[(type_, member_url)],
+                                 connection_pools)
+                      for member_url in member_urls],
+                     connection_pools)
+
+
+def read_artifact(artifact):
+    if artifact is None or isinstance(artifact, bytes):
+        return artifact
+
+    artifact.seek(0)
+    content = artifact.read()
+    artifact.close()
+    return content
+
+
+def open_artifact(artifact):
+    if isinstance(artifact, bytes):
+        return io.BytesIO(artifact)
+
+    return artifact
 
 
 class StaticFile(object):
 
+    __slots__ = ('prefix_path', 'url', 'type_', 'version', 'connection_pools',
+                 'bucket', 'minified_path', 'gzipped_path', 'minifier_batch',
+                 'cache_key', 'artifact', 'brotli_path', 'brotli_artifact')
+
     def __init__(self, prefix_path, file_path,
                  type_, version, connection_pools):
 
-        if type_ == 'css':
-            self.file_path = 'css/' + file_path
+        self.prefix_path = prefix_path
+        self.url = file_path
+        self.type_ = type_
+        self.version = version
+        self.connection_pools = connection_pools
+        self.bucket = None
+        self.minifier_batch = None
+        self.cache_key = None
+        self.artifact = None
+        self.brotli_path = None
+        self.brotli_artifact = None
+
+        if type_ == 'image':
+            self.gzipped_path = self.path_in_filesystem
 
-        elif type_ == 'js':
-            self.file_path = 'scripts/' + file_path
+    @property
+    def file_path(self):
+        return FOLDERS[self.type_] + self.url
 
-        elif type_ == 'image':
-            self.file_path = 'images/' + file_path
+    @property
+    def path_in_filesystem(self):
+        return self.prefix_path + self.file_path
 
-        self.type_ = type_
-        self.version = version
-        self.path_in_filesystem = prefix_path + self.file_path
-        self.versioned_path_in_bucket = self.get_versioned_file_path(with_prefix=False)
-        self.versioned_path_in_filesystem = self.get_versioned_file_path(with_prefix=True)
+    @property
+    def versioned_path_in_bucket(self):
+        return self.get_versioned_file_path(with_prefix=False)
 
-        if type_ == 'css':
-            self.associated_bucket = connection_pools['css_bucket']
+    @property
+    def versioned_path_in_filesystem(self):
+        return self.get_versioned_file_path(with_prefix=True)
 
-        elif type_ == 'js':
-            self.associated_bucket = connection_pools['js_bucket']
+    @property
+    def brotli_path_in_bucket(self):
+        return self.versioned_path_in_bucket + BROTLI_SUFFIX
 
-        elif type_ == 'image':
-            self.associated_bucket = connection_pools['image_bucket']
-            self.gzipped_path = self.path_in_filesystem
+    @property
+    def associated_bucket(self):
+        if self.bucket is None:
+            self.bucket = self.connection_pools[self.type_ + '_bucket']
+
+        return self.bucket
+
+    @associated_bucket.setter
+    def associated_bucket(self, bucket):
+        self.bucket = bucket
 
     def process(self):
+        self.build()
+        self.upload()
+
+    def build(self, cache=None, streaming=False, images=None):
         print('\n')
 
+        if streaming:
+            return self.build_stream(cache, images)
+
         if self.type_ == 'css' or self.type_ == 'js':
-            self.minify()
-            self.gzip()
+            if not self.restore_from_cache(cache):
+                self.minify()
+                self.gzip()
+                self.store_in_cache(cache)
+
+        elif images is not None:
+            optimised_path = self.optimise(images)
+
+            if optimised_path != self.path_in_filesystem:
+                self.gzipped_path = self.path_in_filesystem + '.temp.opt'
+                shutil.copyfile(optimised_path, self.gzipped_path)
 
         self.rename()
-        self.upload()
+
+    def build_stream(self, cache=None, images=None):
+        if self.type_ == 'image':
+            path = self.path_in_filesystem
+
+            if images is not None:
+                path = self.optimise(images)
+
+            self.artifact = open(path, 'rb')
+            return
+
+        if cache is not None:
+            cached_file, brotli_cached_file = self.open_cached(cache)
+
+            if cached_file is not None:
+                self.artifact = cached_file
+                self.brotli_artifact = brotli_cached_file
+
+                print('restored ' + self.path_in_filesystem +
+                      ' from cache -> memory')
+                return
+
+        self.artifact = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+
+        if BROTLI:
+            self.brotli_artifact = tempfile.SpooledTemporaryFile(
+                max_size=SPOOL_MAX_BYTES)
+
+        try:
+            with mymetrics.timer('stream') as sample:
+                minified_size = Minifier.minify_and_gzip_stream(
+                    self.path_in_filesystem, self.type_, self.artifact,
+                    self.brotli_artifact)
+                sample.bytes_in = mymetrics.file_size(self.path_in_filesystem)
+                sample.bytes_out = self.artifact.tell()
+        except Exception:
+            self.close_artifacts()
+            raise
+
+        print('minified & gzipped ' + self.path_in_filesystem +
+              ' -> memory (' + str(self.artifact.tell()) + ' bytes)')
+
+        if BROTLI:
+            self.report_brotli(minified_size, self.artifact.tell(),
+                               self.brotli_artifact.tell())
+
+        if cache is not None:
+            self.artifact.seek(0)
+            cache.put_file(self.get_cache_key(), self.artifact)
+
+            if BROTLI:
+                self.brotli_artifact.seek(0)
+                cache.put_file(self.get_brotli_cache_key(),
+                               self.brotli_artifact)
+
+    def share_artifacts(self):
+        # targets are uploaded concurrently, each one reads the bytes with
+        # its own file object
+        self.artifact = read_artifact(self.artifact)
+        self.brotli_artifact = read_artifact(self.brotli_artifact)
+
+    def close_artifacts(self):
+        for artifact in (self.artifact, self.brotli_artifact):
+            if artifact is not None and not isinstance(artifact, bytes):
+                artifact.close()
+
+        self.artifact = None
+        self.brotli_artifact = None
+
+    def get_cache_key(self):
+        if self.cache_key is None:
+            self.cache_key = ArtifactCache.make_key(
+                Minifier.identity(self.type_),
+                get_file_digest(self.path_in_filesystem))
+
+        return self.cache_key
+
+    def get_brotli_cache_key(self):
+        return ArtifactCache.make_key(self.get_cache_key(),
+                                      Minifier.BROTLI_SETTINGS)
+
+    def is_in_cache(self, cache):
+        if cache is None or self.type_ not in ('css', 'js'):
+            return False
+
+        if BROTLI and not cache.contains(self.get_brotli_cache_key()):
+            return False
+
+        return cache.contains(self.get_cache_key())
+
+    def open_cached(self, cache):
+        cached_files = [cache.open(self.get_cache_key())]
+
+        if BROTLI:
+            cached_files.append(cache.open(self.get_brotli_cache_key()))
+
+        if None in cached_files:
+            for cached_file in cached_files:
+                if cached_file is not None:
+                    cached_file.close()
+
+            return None, None
+
+        return cached_files[0], cached_files[-1] if BROTLI else None
+
+    def restore_from_cache(self, cache):
+        if cache is None:
+            return False
+
+        cached_file, brotli_cached_file = self.open_cached(cache)
+
+        if cached_file is None:
+            return False
+
+        self.gzipped_path = self.path_in_filesystem + '.temp.gz'
+
+        with cached_file, open(self.gzipped_path, 'wb') as f:
+            shutil.copyfileobj(cached_file, f)
+
+        if BROTLI:
+            self.brotli_path = self.path_in_filesystem + '.temp.br'
+
+            with brotli_cached_file, open(self.brotli_path, 'wb') as f:
+                shutil.copyfileobj(brotli_cached_file, f)
+
+        print('restored ' + self.path_in_filesystem +
+              ' from cache -> ' + self.gzipped_path)
+        return True
+
+    def store_in_cache(self, cache):
+        if cache is not None:
+            cache.put(self.get_cache_key(), self.gzipped_path)
+
+            if self.brotli_path is not None:
+                cache.put(self.get_brotli_cache_key(), self.brotli_path)
+
+    def restore_build(self, entry):
+        if entry is None:
+            return False
+
+        brotli_path = entry['brotli_path']
+
+        # built with other settings, or the files are gone
+        if BROTLI != (brotli_path is not None):
+            return False
+
+        for path in (self.versioned_path_in_filesystem, brotli_path):
+            if path is not None and not os.path.exists(path):
+                return False
+
+        self.brotli_path = brotli_path
+        return True
+
+    def optimise(self, images):
+        optimised_path, bytes_in, bytes_out = images.optimise(
+            self.path_in_filesystem)
+
+        print('optimised ' + self.path_in_filesystem + ': ' +
+              str(bytes_in) + ' -> ' + str(bytes_out) + ' bytes, ' +
+              str(bytes_in - bytes_out) + ' saved')
+        return optimised_path
 
     def minify(self):
         input_ = self.path_in_filesystem
         self.minified_path = input_ + '.temp'
 
-        if self.type_ == 'css':
-            Minifier.compress_css(input_, self.minified_path)
+        with mymetrics.timer('minify') as sample:
+            if self.minifier_batch is not None:
+                self.minifier_batch.minify(self)
+            else:
+                Minifier.minify_file(self.type_, input_, self.minified_path)
 
-        elif self.type_ == 'js':
-            Minifier.compile_js(input_, self.minified_path)
+            sample.bytes_in = mymetrics.file_size(input_)
+            sample.bytes_out = mymetrics.file_size(self.minified_path)
 
         print('minified ' + self.path_in_filesystem +
               ' -> ' + self.minified_path)
@@ -122,39 +1065,366 @@ class StaticFile(object):
         input_ = self.minified_path
         self.gzipped_path = input_ + '.gz'
 
-        Minifier.gzip_file(input_, self.gzipped_path)
+        if BROTLI:
+            self.brotli_path = input_ + '.br'
+
+        with mymetrics.timer('gzip') as sample:
+            Minifier.gzip_file(input_, self.gzipped_path, self.brotli_path)
+            sample.bytes_in = mymetrics.file_size(input_)
+            sample.bytes_out = mymetrics.file_size(self.gzipped_path)
         print('gzipped ' + self.minified_path + ' -> ' + self.gzipped_path)
 
+        if self.brotli_path is not None:
+            self.report_brotli(sample.bytes_in, sample.bytes_out,
+                               mymetrics.file_size(self.brotli_path))
+
+    def report_brotli(self, minified_size, gzipped_size, brotli_size):
+        mymetrics.count('brotli', 'bytes_in', minified_size)
+        mymetrics.count('brotli', 'bytes_out', brotli_size)
+
+        saved = 0.0
+
+        if gzipped_size:
+            saved = 100.0 * (gzipped_size - brotli_size) / gzipped_size
+
+        print('brotli ' + self.path_in_filesystem + ': ' +
+              str(brotli_size) + ' bytes, ' + str(round(saved, 1)) +
+              '% smaller than gzip (' + str(gzipped_size) + ' bytes)')
+
     def get_versioned_file_path(self, with_prefix=True):
         if with_prefix:
             input_path = self.path_in_filesystem
         else:
             input_path = self.file_path
 
-        split = re.search(r'(.*)\.(css|js|gif|jpg|jpeg|png)$',
-                          input_path).groups()
+        split = VERSIONABLE_PATH.search(input_path).groups()
         return (split[0] + '-' + self.version + '.' + split[1])
 
     def rename(self):
-        os.rename(self.gzipped_path, self.versioned_path_in_filesystem)
+        with mymetrics.timer('rename'):
+            os.rename(self.gzipped_path, self.versioned_path_in_filesystem)
+
+            if self.brotli_path is not None:
+                brotli_path = self.versioned_path_in_filesystem + BROTLI_SUFFIX
+                os.rename(self.brotli_path, brotli_path)
+                self.brotli_path = brotli_path
+
         print('renamed ' + self.gzipped_path +
               ' -> ' + self.versioned_path_in_filesystem)
 
-    def upload(self):
-        S3Util.upload_gzipped_file_to_bucket(self.versioned_path_in_filesystem,
-                                             self.versioned_path_in_bucket,
-                                             self.type_,
-                                             self.associated_bucket)
+    def upload(self, content_index=None, bucket=None, check_remote=False):
+        if bucket is None:
+            bucket = self.associated_bucket
+
+        variants = []
+
+        if self.artifact is not None:
+            uploaded = S3Util.upload_gzipped_stream_to_bucket(
+                open_artifact(self.artifact), self.versioned_path_in_bucket,
+                self.type_, bucket, content_index=content_index,
+                check_remote=check_remote)
+
+            if self.brotli_artifact is not None:
+                variants.append(self.upload_brotli(
+                    open_artifact(self.brotli_artifact), bucket,
+                    content_index, check_remote))
+        else:
+            uploaded = S3Util.upload_gzipped_file_to_bucket(
+                self.versioned_path_in_filesystem,
+                self.versioned_path_in_bucket,
+                self.type_,
+                bucket,
+                content_index=content_index,
+                check_remote=check_remote)
+
+            if self.brotli_path is not None:
+                with open(self.brotli_path, 'rb') as brotli_file:
+                    variants.append(self.upload_brotli(
+                        brotli_file, bucket, content_index, check_remote))
 
         print('uploaded ' + self.versioned_path_in_bucket + ' -> ' +
-              'http://' + self.associated_bucket.name +
+              'http://' + bucket.name +
               '.s3.amazonaws.com/' + self.versioned_path_in_bucket)
 
-    def exists_in_bucket(self):
+        return uploaded, variants
+
+    def upload_brotli(self, source_file, bucket, content_index=None,
+                      check_remote=False):
+        md5, size = S3Util.upload_gzipped_stream_to_bucket(
+            source_file, self.brotli_path_in_bucket, self.type_,
+            bucket, encoding='br', content_index=content_index,
+            check_remote=check_remote)
+
+        print('uploaded ' + self.brotli_path_in_bucket + ' -> ' +
+              'http://' + bucket.name +
+              '.s3.amazonaws.com/' + self.brotli_path_in_bucket)
+
+        return self.brotli_path_in_bucket, md5, size
+
+    def for_target(self, connection_pools):
+        # the same file, looked up in the buckets of another target
+        if connection_pools is self.connection_pools:
+            return self
+
+        item = copy.copy(self)
+        item.connection_pools = connection_pools
+        item.bucket = None
+        return item
+
+    def exists_in_bucket(self, key_index=None):
+        if key_index is not None:
+            found = key_index.contains(self)
+
+            if found is not None:
+                return found
+
         return S3Util.file_exists_in_s3_bucket(self.versioned_path_in_bucket,
                                                self.associated_bucket)
 
 
+class Bundle(StaticFile):
+
+    __slots__ = ('members', 'folder')
+
+    def __init__(self, prefix_path, file_path, type_, members,
+                 connection_pools):
+        super().__init__(prefix_path, file_path, type_,
+                         Bundle.get_version(members), connection_pools)
+        self.members = members
+        self.folder = None
+
+    def get_version(members):
+        # any change of a member version, of the members or of their order
+        # gives a new bundle version, hence a new versioned key
+        digest = hashlib.sha256()
+
+        for member in members:
+            digest.update((member.url + ' ' + member.version + '\n').encode(
+                'utf-8'))
+
+        return str(int(digest.hexdigest(), 16) % 10 ** 12).zfill(12)
+
+    def build(self, cache=None, streaming=False, images=None):
+        # built in a private folder, removed once uploaded, so the working
+        # copy is never written to
+        self.folder = tempfile.mkdtemp(prefix='newdeployments-bundle-')
+        self.prefix_path = self.folder + '/'
+
+        try:
+            self.concatenate()
+            super().build(cache, streaming, images)
+        except Exception:
+            self.remove_folder()
+            raise
+
+        os.remove(self.path_in_filesystem)
+
+    def close_artifacts(self):
+        super().close_artifacts()
+        self.remove_folder()
+
+    def remove_folder(self):
+        if self.folder is not None:
+            shutil.rmtree(self.folder, ignore_errors=True)
+            self.folder = None
+
+    def get_cache_key(self):
+        if self.cache_key is None:
+            self.cache_key = ArtifactCache.make_key(
+                Minifier.identity(self.type_), 'bundle',
+                *[member.url + ' ' + get_file_digest(member.path_in_filesystem)
+                  for member in self.members])
+
+        return self.cache_key
+
+    def concatenate(self):
+        output = self.path_in_filesystem
+        folder = os.path.dirname(output)
+
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        with mymetrics.timer('bundle') as sample:
+            with open(output, 'wb') as output_file:
+                for index, member in enumerate(self.members):
+                    if index:
+                        output_file.write(BUNDLE_SEPARATORS[self.type_])
+
+                    with open(member.path_in_filesystem, 'rb') as member_file:
+                        shutil.copyfileobj(member_file, output_file)
+
+                    sample.bytes_in += mymetrics.file_size(
+                        member.path_in_filesystem)
+
+                sample.bytes_out = output_file.tell()
+
+        print('bundled ' + str(len(self.members)) + ' files -> ' + output)
+
+
+class KeyIndex(object):
+
+    def __init__(self, file_objects, threshold, manifests=None,
+                 content_index=None):
+        self.keys = {}
+        manifests = manifests or {}
+
+        for name, (bucket, paths) in group_by_bucket(file_objects).items():
+            if name in manifests:
+                self.keys[name] = manifests[name].entries
+                continue
+
+            if len(paths) < threshold:
+                continue
+
+            keys = set()
+
+            for prefix in get_listing_prefixes(paths):
+                for key, etag, _ in S3Util.list_key_entries(bucket, prefix):
+                    keys.add(key)
+
+                    if content_index is not None:
+                        content_index.add(bucket.name, etag, key)
+
+            self.keys[bucket.name] = keys
+            print('Listed ' + str(len(keys)) + ' existing keys in ' +
+                  bucket.name + ' for ' + str(len(paths)) + ' indexed files')
+
+    def contains(self, item):
+        keys = self.keys.get(item.associated_bucket.name)
+
+        if keys is None:
+            return None
+
+        return item.versioned_path_in_bucket in keys
+
+
+class ContentIndex(object):
+
+    def __init__(self, manifests=None):
+        self.keys = {}
+        self._lock = threading.Lock()
+
+        for name, manifest in (manifests or {}).items():
+            self.add_manifest(name, manifest)
+
+    def add_manifest(self, bucket_name, manifest):
+        for key, entry in manifest.entries.items():
+            self.add(bucket_name, entry['md5'], key)
+
+    def add(self, bucket_name, md5, key):
+        # multipart etags are not the md5 of the content
+        if not md5 or '-' in md5 or not VERSIONED_PATTERN.search('/' + key):
+            return
+
+        with self._lock:
+            self.keys.setdefault((bucket_name, md5), key)
+
+    def find(self, bucket_name, md5):
+        return self.keys.get((bucket_name, md5))
+
+    def discard(self, bucket_name, md5):
+        with self._lock:
+            self.keys.pop((bucket_name, md5), None)
+
+
+class Manifest(object):
+
+    def __init__(self, bucket, key):
+        self.bucket = bucket
+        self.key = key
+        self.entries = None
+        # prefixes whose keys are all listed in the entries, a manifest
+        # created from the indexed folders misses the keys of other folders
+        self.prefixes = []
+        self.changed = False
+        self._lock = threading.Lock()
+
+    def load_all(file_objects, key):
+        manifests = {}
+
+        for name, (bucket, paths) in group_by_bucket(file_objects).items():
+            manifest = Manifest(bucket, key)
+
+            if not manifest.load():
+                manifest.bootstrap(get_listing_prefixes(paths))
+
+            manifests[name] = manifest
+
+        return manifests
+
+    def load(self):
+        content = S3Util.get_file_content(self.key, self.bucket)
+
+        if content is None:
+            return False
+
+        content = json.loads(content.decode('utf-8'))
+        self.entries = content['keys']
+        self.prefixes = content.get('prefixes', [])
+        print('Loaded manifest of ' + str(len(self.entries)) +
+              ' deployed keys from ' + self.bucket.name)
+        return True
+
+    def bootstrap(self, prefixes):
+        self.entries = {}
+        self.add_listing(prefixes)
+        print('Created manifest of ' + str(len(self.entries)) +
+              ' deployed keys from listing of ' + self.bucket.name)
+
+    def add_listing(self, prefixes):
+        for prefix in prefixes:
+            for key, etag, size in S3Util.list_key_entries(self.bucket,
+                                                           prefix):
+                if VERSIONED_PATTERN.search(key):
+                    md5 = etag if '-' not in etag else None
+                    self.add(key, md5, size)
+
+            with self._lock:
+                self.prefixes.append(prefix)
+                self.changed = True
+
+    def covers(self, prefix):
+        return any(prefix.startswith(listed) for listed in self.prefixes)
+
+    def add(self, key, md5, size):
+        with self._lock:
+            self.entries[key] = {'md5': md5, 'size': size}
+            self.changed = True
+
+    def remove(self, key):
+        with self._lock:
+            if self.entries.pop(key, None) is not None:
+                self.changed = True
+
+    def save(self):
+        with self._lock:
+            if not self.changed:
+                return
+
+            content = json.dumps({'keys': self.entries,
+                                  'prefixes': sorted(self.prefixes)},
+                                 sort_keys=True)
+            self.changed = False
+
+        S3Util.put_manifest(content, self.key, self.bucket)
+        print('Saved manifest of ' + str(len(self.entries)) +
+              ' deployed keys to ' + self.bucket.name)
+
+
+def get_listing_prefixes(paths):
+    folders = set(path.rpartition('/')[0] + '/' for path in paths)
+    prefixes = []
+
+    if '/' in folders:
+        return ['']
+
+    for folder in sorted(folders):
+        if not (prefixes and folder.startswith(prefixes[-1])):
+            prefixes.append(folder)
+
+    return prefixes
+
+
 class S3Util(object):
 
     def create_connection_pools(config_path, profile,
@@ -162,14 +1432,13 @@ class S3Util(object):
                                 image_bucket_name):
 
         cred = S3Util.get_aws_credentials(config_path, profile)
+        pool = ConnectionPool(lambda: S3Util.connect(cred), S3_POOL_SIZE)
 
-        css_bucket = S3Util.connect_to_bucket(cred, css_bucket_name)
-        js_bucket = S3Util.connect_to_bucket(cred, js_bucket_name)
-        image_bucket = S3Util.connect_to_bucket(cred, image_bucket_name)
-
-        return {'css_bucket': css_bucket,
-                'js_bucket': js_bucket,
-                'image_bucket': image_bucket}
+        # nothing is sent until a bucket is used, and never to validate it,
+        # a wrong bucket name fails the first request made to it
+        return {'css_bucket': PooledBucket(pool, css_bucket_name),
+                'js_bucket': PooledBucket(pool, js_bucket_name),
+                'image_bucket': PooledBucket(pool, image_bucket_name)}
 
     def get_aws_credentials(path, profile):
         config = configparser.ConfigParser()
@@ -179,26 +1448,155 @@ class S3Util(object):
                 'secret': p['aws_secret_access_key']}
 
     def connect_to_bucket(profile, bucket):
-        connection = boto.connect_s3(profile['id'], profile['secret'])
+        connection = S3Util.connect(profile)
         return connection.get_bucket(bucket)
 
+    @contextlib.contextmanager
+    def checkout(bucket):
+        if isinstance(bucket, PooledBucket):
+            with bucket.checkout() as checked_out:
+                yield checked_out
+        else:
+            yield bucket
+
+    def connect(profile):
+        if not S3_ENDPOINT:
+            connection = boto.connect_s3(profile['id'], profile['secret'])
+        else:
+            host, _, port = S3_ENDPOINT.partition(':')
+            connection = boto.connect_s3(
+                profile['id'], profile['secret'], host=host,
+                port=int(port) if port else None, is_secure=False,
+                calling_format=boto.s3.connection.OrdinaryCallingFormat())
+
+        # calls are retried by myretry, with backoff limits from the config
+        connection.num_retries = 0
+        return connection
+
+    @mymetrics.timed('exists')
+    @myretry.retried('exists', 1)
     def file_exists_in_s3_bucket(path, bucket):
-        k = boto.s3.key.Key(bucket)
-        k.key = path
-        return k.exists()
+        if S3_BACKEND == 'asyncio':
+            from mys3async import AsyncS3Util
+            return AsyncS3Util.file_exists_in_s3_bucket(path, bucket)
+
+        with S3Util.checkout(bucket) as bucket:
+            k = boto.s3.key.Key(bucket)
+            k.key = path
+            return k.exists()
+
+    @mymetrics.timed('exists')
+    @myretry.retried('exists', 1)
+    def get_etag(path, bucket):
+        if S3_BACKEND == 'asyncio':
+            from mys3async import AsyncS3Util
+            return AsyncS3Util.get_etag(path, bucket)
+
+        with S3Util.checkout(bucket) as bucket:
+            key = bucket.get_key(path)
+
+        if key is None:
+            return None
+
+        return key.etag.strip('"')
+
+    def files_exist(paths_and_buckets):
+        if S3_BACKEND == 'asyncio':
+            from mys3async import AsyncS3Util
+            return AsyncS3Util.files_exist(paths_and_buckets)
+
+        return [S3Util.file_exists_in_s3_bucket(path, bucket)
+                for path, bucket in paths_and_buckets]
+
+    def list_keys(bucket, prefix=''):
+        return (entry[0] for entry in
+                S3Util.list_key_entries(bucket, prefix))
+
+    def list_key_entries(bucket, prefix=''):
+        if S3_BACKEND == 'asyncio':
+            from mys3async import AsyncS3Util
+            entries = AsyncS3Util.list_key_entries(bucket, prefix)
+        else:
+            entries = S3Util.iter_listing_pages(bucket, prefix)
+
+        return mymetrics.timed_iter('list', entries)
+
+    def iter_listing_pages(bucket, prefix):
+        marker = ''
+
+        while True:
+            page = myretry.call('list', bucket, S3Util.get_listing_page,
+                                bucket, prefix, marker)
+
+            for item in page:
+                yield item.key, item.etag.strip('"'), item.size
+
+            if not page.is_truncated or not len(page):
+                return
+
+            marker = page.next_marker or page[-1].key
+
+    def get_listing_page(bucket, prefix, marker):
+        # a connection is only held while fetching a page, callers may
+        # need connections of their own before consuming the rest
+        with S3Util.checkout(bucket) as checked_out:
+            return checked_out.get_all_keys(prefix=prefix, marker=marker)
+
+    @mymetrics.timed('delete')
+    @myretry.retried('delete', 0)
+    def delete_keys(bucket, paths):
+        if S3_BACKEND == 'asyncio':
+            from mys3async import AsyncS3Util
+            return AsyncS3Util.delete_keys(bucket, paths)
+
+        with S3Util.checkout(bucket) as bucket:
+            return bucket.delete_keys(paths, quiet=False)
+
+    @mymetrics.timed('manifest')
+    @myretry.retried('manifest', 1)
+    def get_file_content(path, bucket):
+        with S3Util.checkout(bucket) as bucket:
+            k = boto.s3.key.Key(bucket)
+            k.key = path
+
+            try:
+                return k.get_contents_as_string()
+            except boto.exception.S3ResponseError as e:
+                if e.status == 404:
+                    return None
+                raise
+
+    @mymetrics.timed('manifest')
+    @myretry.retried('manifest', 2)
+    def put_manifest(content, path, bucket):
+        with S3Util.checkout(bucket) as bucket:
+            k = boto.s3.key.Key(bucket)
+            k.key = path
+            k.set_contents_from_string(
+                content, headers={'Content-Type': 'application/json',
+                                  'Cache-Control': 'no-cache'})
 
     def upload_gzipped_file_to_bucket(source_path, uploaded_as_path,
-                                      file_type, bucket):
-        k = boto.s3.key.Key(bucket)
-        k.key = uploaded_as_path
-
+                                      file_type, bucket, encoding='gzip',
+                                      content_index=None, check_remote=False):
+        with open(source_path, 'rb') as source_file:
+            return S3Util.upload_gzipped_stream_to_bucket(source_file,
+                                                   uploaded_as_path,
+                                                   file_type, bucket,
+                                                   encoding, content_index,
+                                                   check_remote)
+
+    def upload_gzipped_stream_to_bucket(source_file, uploaded_as_path,
+                                        file_type, bucket, encoding='gzip',
+                                        content_index=None,
+                                        check_remote=False):
         if file_type == 'css':
-            headers = {'Content-Encoding': 'gzip',
+            headers = {'Content-Encoding': encoding,
                        'Content-Type': 'text/css',
                        'Cache-Control': 'max-age=31536000'}
 
         elif file_type == 'js':
-            headers = {'Content-Encoding': 'gzip',
+            headers = {'Content-Encoding': encoding,
                        'Content-Type': 'application/javascript',
                        'Cache-Control': 'max-age=31536000'}
 
@@ -206,30 +1604,264 @@ class S3Util(object):
             headers = {'Cache-Control':
                        str.encode('max-age=31536000, no transform, public')}
 
-        k.set_contents_from_filename(source_path,
-                                     headers=headers, policy='public-read')
+        source_file.seek(0)
+        md5 = boto.utils.compute_md5(source_file)
+        size = md5[2]
+        source_file.seek(0)
+
+        # multipart etags are not an md5, those objects are uploaded again
+        if check_remote and S3Util.get_etag(uploaded_as_path,
+                                            bucket) == md5[0]:
+            mymetrics.count('upload', 'skipped')
+            print('skipped ' + uploaded_as_path + ', ' + str(size) +
+                  ' identical bytes already deployed')
+            return md5[0], size
+
+        if content_index is not None:
+            existing_path = content_index.find(bucket.name, md5[0])
+
+            if existing_path is not None:
+                if S3Util.copy_in_bucket(existing_path, uploaded_as_path,
+                                         bucket, size):
+                    return md5[0], size
+
+                content_index.discard(bucket.name, md5[0])
+
+        with mymetrics.timer('upload') as sample:
+            if size >= MULTIPART_THRESHOLD:
+                # parts are retried one by one, see upload_multipart_to_bucket
+                S3Util.upload_multipart_to_bucket(
+                    source_file, size, uploaded_as_path, headers, bucket)
+            else:
+                S3Util.put_file(source_file, md5, uploaded_as_path, headers,
+                                bucket)
+
+            sample.bytes_out = size
+
+        if content_index is not None:
+            content_index.add(bucket.name, md5[0], uploaded_as_path)
+
+        return md5[0], size
+
+    @myretry.retried('upload', 4)
+    def put_file(source_file, md5, uploaded_as_path, headers, bucket):
+        source_file.seek(0)
+
+        if S3_BACKEND == 'asyncio':
+            from mys3async import AsyncS3Util
+            AsyncS3Util.put(bucket, uploaded_as_path, source_file.read(),
+                            headers)
+            return
+
+        with S3Util.checkout(bucket) as checked_out:
+            k = boto.s3.key.Key(checked_out)
+            k.key = uploaded_as_path
+            k.set_contents_from_file(source_file, headers=headers,
+                                     policy='public-read', md5=md5[:2])
+
+    @myretry.retried('copy', 2)
+    def copy_in_bucket(source_path, copied_as_path, bucket, size):
+        with mymetrics.timer('copy') as sample:
+            with S3Util.checkout(bucket) as checked_out:
+                try:
+                    # the copy keeps content type, encoding & cache control
+                    checked_out.copy_key(copied_as_path, checked_out.name,
+                                         source_path,
+                                         headers={'x-amz-acl': 'public-read'})
+                except boto.exception.S3ResponseError as e:
+                    if e.status == 404:
+                        print('Uploading ' + copied_as_path + ', identical ' +
+                              source_path + ' no longer exists')
+                        return False
+                    raise
+
+            sample.bytes_in = size
+
+        print('copied ' + source_path + ' -> ' + copied_as_path +
+              ' instead of uploading ' + str(size) + ' identical bytes')
+        return True
+
+    def upload_multipart_to_bucket(source_file, size, uploaded_as_path,
+                                   headers, bucket):
+        # each request of the upload checks out its own pooled connection,
+        # parts are sent concurrently
+        upload = S3Util.initiate_upload(uploaded_as_path, headers, bucket)
+        source_lock = threading.Lock()
+        limiter = mylimiter.get(bucket)
+
+        def upload_part(part_number):
+            with source_lock:
+                source_file.seek((part_number - 1) * MULTIPART_PART_SIZE)
+                data = source_file.read(MULTIPART_PART_SIZE)
+
+            for attempt in range(1, MULTIPART_RETRIES + 1):
+                try:
+                    with limiter.slot('part'):
+                        with S3Util.checkout_upload(bucket,
+                                                    upload) as checked_out:
+                            checked_out.upload_part_from_file(
+                                io.BytesIO(data), part_number)
+                    return
+                except Exception as e:
+                    if attempt == MULTIPART_RETRIES:
+                        raise
+
+                    mymetrics.count('upload', 'retries')
+
+                    print('Retrying part ' + str(part_number) + ' of ' +
+                          uploaded_as_path + ' after error: ' + repr(e))
+
+                    if myretry.is_transient(e):
+                        time.sleep(myretry.get_delay(attempt))
+
+        part_count = max(1, -(-size // MULTIPART_PART_SIZE))
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                    MULTIPART_CONCURRENCY) as executor:
+                list(executor.map(upload_part, range(1, part_count + 1)))
+
+            S3Util.complete_upload(upload, bucket)
+        except Exception:
+            S3Util.cancel_upload(upload, bucket)
+            raise
+
+    @myretry.retried('upload', 2)
+    def initiate_upload(uploaded_as_path, headers, bucket):
+        with S3Util.checkout(bucket) as checked_out:
+            return checked_out.initiate_multipart_upload(
+                uploaded_as_path, headers=headers, policy='public-read')
+
+    @myretry.retried('upload', 1)
+    def complete_upload(upload, bucket):
+        with S3Util.checkout_upload(bucket, upload) as checked_out:
+            checked_out.complete_upload()
+
+    @myretry.retried('upload', 1)
+    def cancel_upload(upload, bucket):
+        with S3Util.checkout_upload(bucket, upload) as checked_out:
+            checked_out.cancel_upload()
+
+    @contextlib.contextmanager
+    def checkout_upload(bucket, upload):
+        # the multipart upload as seen through a checked out connection
+        with S3Util.checkout(bucket) as checked_out:
+            bound = boto.s3.multipart.MultiPartUpload(checked_out)
+            bound.key_name = upload.key_name
+            bound.id = upload.id
+            yield bound
 
 
 class XMLParser(object):
 
     def create_matrix_from_xml(path):
-        tree = ET.parse(path)
-        root = tree.getroot()
-        packed = []
+        return [list(entry) for entry in XMLParser.iter_entries(path)]
+
+    def iter_entries(path):
+        for tag, entry in XMLParser.iter_index(path):
+            if tag == 'file':
+                yield entry
+
+    def iter_bundles(path):
+        for tag, bundle in XMLParser.iter_index(path):
+            if tag == 'bundle':
+                yield bundle
+
+    def iter_index(path):
+        # files & bundles in a single pass over the index
+        for element in XMLParser.iter_elements(path):
+            if element.tag == 'file':
+                yield 'file', (element.attrib['url'],
+                               element[0].text,
+                               element[1].text)
+
+            elif element.tag == 'bundle':
+                yield 'bundle', (element.attrib['url'],
+                                 element.findtext('fileType'),
+                                 [member.attrib['url']
+                                  for member in element.iter('member')])
 
-        for file_element in root:
-            file_name = file_element.attrib['url']
-            file_type = file_element[0].text
-            file_version = file_element[1].text
+    def iter_elements(path):
+        depth = 0
+        root = None
 
-            sublist = [file_name, file_type, file_version]
-            packed.append(sublist)
+        for event, element in ET.iterparse(path, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
 
-        return packed
+                if root is None:
+                    root = element
+
+                continue
+
+            depth -= 1
+
+            if depth != 1:
+                continue
+
+            yield element
+            root.remove(element)
 
 
 class Minifier(object):
 
+    # part of the cache keys, changed with the gzip output so entries built
+    # before are not served
+    GZIP_SETTINGS = 'gzip compresslevel=9 mtime=0'
+
+    BROTLI_SETTINGS = 'brotli quality=' + str(BROTLI_QUALITY) + ' mode=text'
+
+    BACKENDS = ('java', 'python', 'copy')
+
+    jar_digests = {}
+
+    def backend(type_):
+        backend = CSS_MINIFIER if type_ == 'css' else JS_MINIFIER
+
+        if backend not in Minifier.BACKENDS:
+            raise ValueError('Unknown ' + type_ + ' minifier ' +
+                             repr(backend) + ', expected one of ' +
+                             ', '.join(Minifier.BACKENDS))
+
+        return backend
+
+    def identity(type_):
+        if Minifier.backend(type_) == 'copy':
+            return type_ + ' copy ' + Minifier.GZIP_SETTINGS
+
+        if Minifier.backend(type_) == 'python':
+            import myminify
+            return (type_ + ' myminify ' + myminify.VERSION + ' ' +
+                    Minifier.GZIP_SETTINGS)
+
+        if type_ == 'css':
+            jar = MINIFIER_PATH + 'yuicompressor-2.4.8.jar'
+        else:
+            jar = MINIFIER_PATH + 'compiler.jar'
+
+        if jar not in Minifier.jar_digests:
+            try:
+                Minifier.jar_digests[jar] = get_file_digest(jar)
+            except OSError:
+                Minifier.jar_digests[jar] = jar
+
+        return (type_ + ' ' + Minifier.jar_digests[jar] + ' ' +
+                Minifier.GZIP_SETTINGS)
+
+    def minify_file(type_, input_, output):
+        if Minifier.backend(type_) == 'copy':
+            shutil.copyfile(input_, output)
+            return 0
+
+        if Minifier.backend(type_) == 'python':
+            import myminify
+            return myminify.minify_file(type_, input_, output)
+
+        if type_ == 'css':
+            return Minifier.compress_css(input_, output)
+
+        return Minifier.compile_js(input_, output)
+
     def compress_css(input_, output):
         return subprocess.call([JAVA_PATH + 'java', '-jar',
                                 MINIFIER_PATH + 'yuicompressor-2.4.8.jar',
@@ -242,11 +1874,161 @@ class Minifier(object):
                                 '--js', input_,
                                 '--js_output_file', output])
 
-    def gzip_file(input_, output):
+    def compress_css_batch(inputs, suffix):
+        return subprocess.call([JAVA_PATH + 'java', '-jar',
+                                MINIFIER_PATH + 'yuicompressor-2.4.8.jar'] +
+                               inputs +
+                               ['-o', '$:' + suffix])
+
+    def gzip_file(input_, output, brotli_output=None):
         with open(input_, 'rb') as input_file:
-            with gzip.open(output, 'wb') as output_file:
-                output_file.writelines(input_file)
+            with open(output, 'wb') as output_file:
+                if brotli_output is None:
+                    Minifier.gzip_stream(input_file, output_file)
+                    return
+
+                with open(brotli_output, 'wb') as brotli_file:
+                    Minifier.gzip_stream(input_file, output_file, brotli_file)
+
+    def open_css_stream(input_):
+        return subprocess.Popen([JAVA_PATH + 'java', '-jar',
+                                 MINIFIER_PATH + 'yuicompressor-2.4.8.jar',
+                                 input_],
+                                stdout=subprocess.PIPE)
+
+    def open_js_stream(input_):
+        return subprocess.Popen([JAVA_PATH + 'java', '-jar',
+                                 MINIFIER_PATH + 'compiler.jar',
+                                 '--js', input_],
+                                stdout=subprocess.PIPE)
+
+    def gzip_stream(input_file, output_file, brotli_file=None):
+        # the minified input is read once, feeding both compressors
+        compressor = None
+        size = 0
+
+        if brotli_file is not None:
+            brotli = get_brotli()
+            compressor = brotli.Compressor(mode=brotli.MODE_TEXT,
+                                           quality=BROTLI_QUALITY)
+
+        # no file name & a zero mtime in the header, the same input always
+        # gives the same bytes, hence the same md5 as the deployed object
+        with gzip.GzipFile(filename='', mode='wb', fileobj=output_file,
+                           mtime=0) as gzip_file:
+            for chunk in iter(lambda: input_file.read(GZIP_CHUNK_SIZE), b''):
+                gzip_file.write(chunk)
+                size += len(chunk)
+
+                if compressor is not None:
+                    brotli_file.write(compressor.process(chunk))
+
+        if compressor is not None:
+            brotli_file.write(compressor.finish())
+
+        return size
+
+    def minify_and_gzip_stream(input_, type_, output_file, brotli_file=None):
+        if Minifier.backend(type_) == 'copy':
+            with open(input_, 'rb') as input_file:
+                return Minifier.gzip_stream(input_file, output_file,
+                                            brotli_file)
+
+        if Minifier.backend(type_) == 'python':
+            import myminify
+            with open(input_, 'rb') as input_file:
+                minified = io.BytesIO(myminify.minify(type_,
+                                                      input_file.read()))
+
+            return Minifier.gzip_stream(minified, output_file, brotli_file)
+
+        if type_ == 'css':
+            process = Minifier.open_css_stream(input_)
+        else:
+            process = Minifier.open_js_stream(input_)
+
+        try:
+            with process.stdout:
+                size = Minifier.gzip_stream(process.stdout, output_file,
+                                            brotli_file)
+        except Exception:
+            process.kill()
+            process.wait()
+            raise
+
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode,
+                                                process.args)
+
+        return size
+
+
+class MinifierBatch(object):
+
+    def __init__(self, items):
+        self.items = items
+        self.done = False
+        self._lock = threading.Lock()
+
+    def assign(file_objects, size):
+        if Minifier.backend('css') != 'java':
+            return []
+
+        # bundles only exist on disk while they are being built
+        css_items = [item for item in file_objects if item.type_ == 'css' and
+                     not isinstance(item, Bundle)]
+        size = max(size, 1)
+        batches = []
+
+        for start in range(0, len(css_items), size):
+            chunk = css_items[start:start + size]
+
+            if len(chunk) < 2:
+                continue
+
+            batch = MinifierBatch(chunk)
+
+            for item in chunk:
+                item.minifier_batch = batch
+
+            batches.append(batch)
+
+        return batches
+
+    def minify(self, item):
+        with self._lock:
+            if not self.done:
+                self.run()
+                self.done = True
+
+        if not os.path.exists(item.minified_path):
+            Minifier.compress_css(item.path_in_filesystem, item.minified_path)
+
+    def run(self):
+        inputs = [item.path_in_filesystem for item in self.items]
+
+        for input_ in inputs:
+            if os.path.exists(input_ + '.temp'):
+                os.remove(input_ + '.temp')
+
+        Minifier.compress_css_batch(inputs, '.temp')
 
 
 if __name__ == '__main__':
-    deploy_main()
+    parser = argparse.ArgumentParser(
+        description='Minify, compress & upload static files indexed in XML')
+    parser.add_argument('--startup-profile', action='store_true',
+                        help='print the time spent importing modules and in '
+                             'each startup phase, then exit without deploying')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running, deploying the entries whose '
+                             'version or content changes, until interrupted')
+    args = parser.parse_args()
+
+    if args.startup_profile:
+        profile_startup('mydeploy')
+    elif args.watch:
+        from mywatch import watch_main
+        watch_main()
+    elif deploy_main():
+        sys.exit(1)
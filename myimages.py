@@ -0,0 +1,304 @@
+import concurrent.futures
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import zlib
+
+import mymetrics
+
+from mycache import (
+    ArtifactCache,
+    get_file_digest,
+    )
+
+# part of the cache key of optimised images, to be bumped on output changes
+VERSION = '1'
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+JPEG_SIGNATURE = b'\xff\xd8'
+
+# metadata chunks with no effect on how the image is displayed
+STRIPPED_PNG_CHUNKS = frozenset([b'tEXt', b'zTXt', b'iTXt', b'tIME', b'pHYs'])
+
+PNG_STRATEGIES = (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED)
+
+
+def optimise_image(source, output, jpegtran=None):
+    start = time.perf_counter()
+
+    with open(source, 'rb') as source_file:
+        data = source_file.read()
+
+    if data.startswith(PNG_SIGNATURE):
+        optimised = optimise_png(data)
+
+    elif data.startswith(JPEG_SIGNATURE):
+        optimised = optimise_jpeg(data)
+
+        if jpegtran:
+            optimised = run_jpegtran(jpegtran, optimised, output)
+
+    else:
+        optimised = data
+
+    if len(optimised) < len(data):
+        with open(output, 'wb') as output_file:
+            output_file.write(optimised)
+    else:
+        optimised = data
+
+    return len(data), len(optimised), time.perf_counter() - start
+
+
+def iter_png_chunks(data):
+    position = len(PNG_SIGNATURE)
+
+    while position + 12 <= len(data):
+        length, kind = struct.unpack('>I4s', data[position:position + 8])
+        body = data[position + 8:position + 8 + length]
+
+        if len(body) < length:
+            raise ValueError('truncated ' + repr(kind) + ' chunk')
+
+        yield kind, body
+        position += 12 + length
+
+        if kind == b'IEND':
+            return
+
+    raise ValueError('missing IEND chunk')
+
+
+def make_png_chunk(kind, body):
+    return (struct.pack('>I', len(body)) + kind + body +
+            struct.pack('>I', zlib.crc32(kind + body) & 0xffffffff))
+
+
+def optimise_png(data):
+    try:
+        chunks = list(iter_png_chunks(data))
+        idat = b''.join(body for kind, body in chunks if kind == b'IDAT')
+        pixels = zlib.decompress(idat)
+    except (ValueError, struct.error, zlib.error):
+        return data
+
+    # animated pngs number their frame chunks, leave them alone
+    if any(kind == b'acTL' for kind, _ in chunks):
+        return data
+
+    for strategy in PNG_STRATEGIES:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 15, 9, strategy)
+        compressed = compressor.compress(pixels) + compressor.flush()
+
+        if len(compressed) < len(idat):
+            idat = compressed
+
+    output = [PNG_SIGNATURE]
+
+    for kind, body in chunks:
+        if kind in STRIPPED_PNG_CHUNKS:
+            continue
+
+        if kind == b'IDAT':
+            if idat is not None:
+                output.append(make_png_chunk(kind, idat))
+                idat = None
+            continue
+
+        output.append(make_png_chunk(kind, body))
+
+    optimised = b''.join(output)
+    return optimised if len(optimised) < len(data) else data
+
+
+def optimise_jpeg(data):
+    output = [JPEG_SIGNATURE]
+    position = len(JPEG_SIGNATURE)
+
+    while position + 4 <= len(data):
+        if data[position] != 0xff:
+            return data
+
+        marker = data[position + 1]
+
+        if marker == 0xff:
+            position += 1
+            continue
+
+        # entropy coded data follows the start of scan, copied as is
+        if marker == 0xda:
+            output.append(data[position:])
+            optimised = b''.join(output)
+            return optimised if len(optimised) < len(data) else data
+
+        if marker == 0x01 or 0xd0 <= marker <= 0xd7:
+            output.append(data[position:position + 2])
+            position += 2
+            continue
+
+        length = struct.unpack('>H', data[position + 2:position + 4])[0]
+        segment = data[position:position + 2 + length]
+
+        if keep_jpeg_segment(marker, segment[4:]):
+            output.append(segment)
+
+        position += 2 + length
+
+    return data
+
+
+def keep_jpeg_segment(marker, body):
+    if marker == 0xfe:
+        return False
+
+    if not 0xe0 <= marker <= 0xef:
+        return True
+
+    if marker == 0xe0:
+        return body.startswith(b'JFIF\0')
+
+    if marker == 0xe1 and body.startswith(b'Exif\0\0'):
+        # browsers rotate images according to their exif orientation
+        return get_exif_orientation(body[6:]) not in (None, 1)
+
+    if marker == 0xe2:
+        return body.startswith(b'ICC_PROFILE\0')
+
+    # adobe segment tells how colours were transformed
+    return marker == 0xee
+
+
+def get_exif_orientation(tiff):
+    order = '<' if tiff[:2] == b'II' else '>'
+
+    try:
+        offset = struct.unpack(order + 'I', tiff[4:8])[0]
+        count = struct.unpack(order + 'H', tiff[offset:offset + 2])[0]
+
+        for index in range(count):
+            entry = offset + 2 + index * 12
+            tag, _, _, value = struct.unpack(order + 'HHIH',
+                                             tiff[entry:entry + 10])
+
+            if tag == 0x0112:
+                return value
+    except struct.error:
+        return None
+
+    return None
+
+
+def run_jpegtran(jpegtran, data, output):
+    input_ = output + '.in'
+    optimised = output + '.out'
+
+    try:
+        with open(input_, 'wb') as input_file:
+            input_file.write(data)
+
+        if subprocess.call([jpegtran, '-copy', 'all', '-optimize',
+                            '-outfile', optimised, input_],
+                           stderr=subprocess.DEVNULL) != 0:
+            return data
+
+        with open(optimised, 'rb') as optimised_file:
+            result = optimised_file.read()
+
+        return result if result and len(result) < len(data) else data
+    finally:
+        for path in (input_, optimised):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class ImageOptimiser(object):
+
+    def __init__(self, cache=None, workers=0, jpegtran_path=''):
+        self.cache = cache
+        self.jpegtran = shutil.which(jpegtran_path + 'jpegtran')
+        self.settings = ('images ' + VERSION +
+                         (' jpegtran' if self.jpegtran else ''))
+        self.folder = tempfile.mkdtemp(prefix='newdeployments-images-')
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            workers or None)
+        self.jobs = {}
+        self.stored = set()
+        self.files = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+
+    def submit(self, path):
+        # keyed by the current content, an image edited between two runs
+        # of a watch is optimised again
+        key = ArtifactCache.make_key(self.settings, get_file_digest(path))
+
+        with self._lock:
+            if key in self.jobs:
+                return key
+
+            cached_file = None
+            output = os.path.join(self.folder, key)
+
+            if self.cache is not None:
+                cached_file = self.cache.open(key)
+
+            if cached_file is not None:
+                # copied out of the cache, where it may be evicted
+                with cached_file, open(output, 'wb') as f:
+                    shutil.copyfileobj(cached_file, f)
+
+                future = concurrent.futures.Future()
+                future.set_result((os.path.getsize(path),
+                                   os.path.getsize(output), 0.0))
+                self.stored.add(key)
+                self.jobs[key] = (future, output)
+            else:
+                self.jobs[key] = (self.executor.submit(
+                    optimise_image, path, output, self.jpegtran), output)
+
+        return key
+
+    def optimise(self, path):
+        key = self.submit(path)
+        future, output = self.jobs[key]
+        bytes_in, bytes_out, seconds = future.result()
+
+        if bytes_out >= bytes_in:
+            output = path
+
+        with self._lock:
+            self.files += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            store = self.cache is not None and key not in self.stored
+            self.stored.add(key)
+
+        if store:
+            self.cache.put(key, output)
+
+        mymetrics.current().record('optimise', seconds, bytes_in, bytes_out)
+        return output, bytes_in, bytes_out
+
+    def reset_counts(self):
+        with self._lock:
+            self.files = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+
+    def summary(self):
+        saved = self.bytes_in - self.bytes_out
+        share = 100.0 * saved / self.bytes_in if self.bytes_in else 0.0
+
+        return ('Images: ' + str(self.files) + ' optimised, ' + str(saved) +
+                ' of ' + str(self.bytes_in) + ' bytes saved (' +
+                str(round(share, 1)) + '%)')
+
+    def close(self):
+        self.executor.shutdown()
+        shutil.rmtree(self.folder, ignore_errors=True)
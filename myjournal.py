@@ -0,0 +1,73 @@
+import json
+import os
+import threading
+
+
+class Journal(object):
+
+    def __init__(self, path):
+        # append-only, one json line per completed stage of a file, so a
+        # deploy killed halfway leaves at most its last line unfinished
+        self.path = path
+        self.entries = {}
+        self.complete = True
+        self._file = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return 0
+
+        count = 0
+
+        with open(self.path, 'rb') as journal_file:
+            data = journal_file.read()
+
+        self.complete = not data or data.endswith(b'\n')
+
+        for line in data.splitlines():
+            try:
+                entry = json.loads(line.decode('utf-8'))
+            except ValueError:
+                continue
+
+            key = (entry['bucket'], entry['key'])
+            self.entries.setdefault(key, {})[entry['stage']] = entry
+            count += 1
+
+        return count
+
+    def get(self, bucket_name, key, stage):
+        return self.entries.get((bucket_name, key), {}).get(stage)
+
+    def record(self, bucket_name, key, stage, details=None):
+        entry = dict(details or {})
+        entry.update({'bucket': bucket_name, 'key': key, 'stage': stage})
+        line = json.dumps(entry, sort_keys=True) + '\n'
+
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a')
+
+                if not self.complete:
+                    self._file.write('\n')
+                    self.complete = True
+
+            self._file.write(line)
+            # flushed, not synced: a killed process loses nothing, a power
+            # cut at worst the last lines, which are then simply redone
+            self._file.flush()
+
+            self.entries.setdefault((bucket_name, key), {})[stage] = entry
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def remove(self):
+        self.close()
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,230 @@
+import contextlib
+import threading
+import time
+
+from environment_config import (
+    DELETE_CONCURRENCY,
+    S3_ADAPTIVE_LIMIT,
+    S3_BACKEND,
+    S3_CONCURRENCY,
+    S3_LIMIT_INITIAL,
+    S3_LIMIT_MIN,
+    S3_LIMIT_MAX,
+    S3_LIMIT_LATENCY_FACTOR,
+    UPLOAD_WORKERS,
+    )
+
+THROTTLING_STATUSES = frozenset([429, 503])
+
+THROTTLING_CODES = frozenset(['SlowDown', 'Throttling', 'ThrottlingException',
+                              'RequestLimitExceeded', 'TooManyRequests'])
+
+THROTTLED_DECREASE = 0.5
+SLOW_DECREASE = 0.9
+
+# smoothing of the recent & long-term latency of each stage, the latency
+# signal is only used once a stage has enough samples
+RECENT_WEIGHT = 0.3
+AVERAGE_WEIGHT = 0.02
+LATENCY_SAMPLES = 20
+
+# the latency of uploads & copies grows with the size of each file, only
+# requests of about the same size every time tell the bucket slows down
+LATENCY_STAGES = frozenset(['exists', 'list', 'delete', 'part'])
+
+def is_throttling(error):
+    status = getattr(error, 'status', None)
+    code = getattr(error, 'error_code', None) or getattr(error, 'code', None)
+
+    return status in THROTTLING_STATUSES or code in THROTTLING_CODES
+
+
+def get_initial_limit():
+    if S3_LIMIT_INITIAL:
+        return S3_LIMIT_INITIAL
+
+    # as many requests as the workers send at once, batched asyncio
+    # existence checks send up to S3_CONCURRENCY
+    workers = max(UPLOAD_WORKERS, DELETE_CONCURRENCY)
+
+    if S3_BACKEND == 'asyncio':
+        workers = max(workers, S3_CONCURRENCY)
+
+    return workers
+
+
+class Limiters(object):
+
+    def __init__(self):
+        # the limit of each bucket, learnt during one run
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def get(self, bucket):
+        if bucket is None or not S3_ADAPTIVE_LIMIT:
+            return UNLIMITED
+
+        name = getattr(bucket, 'name', bucket)
+
+        with self._lock:
+            limiter = self._limiters.get(name)
+
+            if limiter is None:
+                limiter = AdaptiveLimiter(name, get_initial_limit(),
+                                          S3_LIMIT_MIN, S3_LIMIT_MAX,
+                                          S3_LIMIT_LATENCY_FACTOR)
+                self._limiters[name] = limiter
+
+            return limiter
+
+    def summary(self):
+        with self._lock:
+            limiters = sorted(self._limiters.items())
+
+        if not limiters:
+            return None
+
+        lines = ['Request limits per bucket '
+                 '(start -> end, lowest - highest):']
+
+        for name, limiter in limiters:
+            lines.append('  ' + limiter.summary())
+
+        return '\n'.join(lines)
+
+
+class AdaptiveLimiter(object):
+
+    def __init__(self, name, initial, minimum, maximum, latency_factor=0):
+        # additive increase / multiplicative decrease of the requests sent
+        # at once, like tcp congestion control: +1 per window of successful
+        # requests using the whole limit, halved when S3 throttles, cut by
+        # 10% when a stage gets much slower than usual
+        self.name = name
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.initial = min(max(initial, self.minimum), self.maximum)
+        self.limit = float(self.initial)
+        self.lowest = self.highest = self.initial
+        self.latency_factor = latency_factor
+        self.in_flight = 0
+        self.calls = 0
+        self.throttled = 0
+        self.slow = 0
+        self.waited = 0.0
+        self.decreased = 0.0
+        self._latencies = {}
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        start = time.perf_counter()
+
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+
+            self.in_flight += 1
+            now = time.perf_counter()
+            self.waited += now - start
+            return now
+
+    def release(self, started, stage='', throttled=False):
+        now = time.perf_counter()
+
+        with self._condition:
+            full = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            self.calls += 1
+
+            if throttled:
+                self.throttled += 1
+                self.decrease(started, now, THROTTLED_DECREASE)
+
+            elif self.is_slow(stage, now - started):
+                self.slow += 1
+                self.decrease(started, now, SLOW_DECREASE)
+
+            elif full:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                self.highest = max(self.highest, int(self.limit))
+
+            self._condition.notify_all()
+
+    def decrease(self, started, now, factor):
+        # requests sent before the last decrease were sent at the previous
+        # limit, they must not cut it again
+        if started < self.decreased:
+            return
+
+        self.limit = max(self.minimum, self.limit * factor)
+        self.lowest = min(self.lowest, int(self.limit))
+        self.decreased = now
+
+    def is_slow(self, stage, seconds):
+        if not self.latency_factor or stage not in LATENCY_STAGES:
+            return False
+
+        samples, recent, average = self._latencies.get(stage,
+                                                       (0, seconds, seconds))
+        recent += (seconds - recent) * RECENT_WEIGHT
+        average += (seconds - average) * AVERAGE_WEIGHT
+        self._latencies[stage] = (samples + 1, recent, average)
+
+        return (samples >= LATENCY_SAMPLES and
+                recent > average * self.latency_factor)
+
+    @contextlib.contextmanager
+    def slot(self, stage=''):
+        started = self.acquire()
+        throttled = False
+
+        try:
+            yield
+        except Exception as e:
+            throttled = is_throttling(e)
+            raise
+        finally:
+            self.release(started, stage, throttled)
+
+    def summary(self):
+        with self._condition:
+            return (self.name + ': ' + str(self.initial) + ' -> ' +
+                    str(int(self.limit)) + ' (' + str(self.lowest) + ' - ' +
+                    str(self.highest) + '), ' + str(self.calls) +
+                    ' requests, ' + str(self.throttled) + ' throttled, ' +
+                    str(self.slow) + ' slow, ' +
+                    str(round(self.waited, 3)) + ' s waiting')
+
+
+class Unlimited(object):
+
+    def acquire(self):
+        return 0.0
+
+    def release(self, started, stage='', throttled=False):
+        pass
+
+    @contextlib.contextmanager
+    def slot(self, stage=''):
+        yield
+
+
+UNLIMITED = Unlimited()
+
+
+_current = Limiters()
+
+
+def current():
+    return _current
+
+
+def start():
+    # S3 calls take their slots from the limits of the run started last
+    global _current
+    _current = Limiters()
+    return _current
+
+
+def get(bucket):
+    return _current.get(bucket)
@@ -0,0 +1,317 @@
+import email.utils
+import hashlib
+import http.server
+import socketserver
+import threading
+import time
+import urllib.parse
+import uuid
+import xml.etree.ElementTree as ET
+
+from xml.sax.saxutils import escape
+
+
+class LocalS3Server(object):
+
+    def __init__(self, latency=0.0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.buckets = {}
+        self.uploads = {}
+        self.requests = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+        self._server = _ThreadingHTTPServer((host, port), _Handler)
+        self._server.s3 = self
+        self._thread = None
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    @property
+    def endpoint(self):
+        return self.host + ':' + str(self.port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def create_bucket(self, name):
+        with self.lock:
+            self.buckets.setdefault(name, {})
+
+    def count(self, method, in_flight):
+        with self.lock:
+            if in_flight > 0:
+                self.requests[method] = self.requests.get(method, 0) + 1
+
+            self.in_flight += in_flight
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class _Object(object):
+
+    def __init__(self, data, headers):
+        self.data = data
+        self.headers = headers
+        self.etag = '"' + hashlib.md5(data).hexdigest() + '"'
+        self.modified = time.time()
+
+
+STORED_HEADERS = ('content-type', 'content-encoding', 'cache-control')
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.handle_request('HEAD')
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def handle_request(self, method):
+        s3 = self.server.s3
+        s3.count(method, 1)
+
+        try:
+            self.handle_s3_request(s3, method)
+        finally:
+            s3.count(method, -1)
+
+    def handle_s3_request(self, s3, method):
+        if s3.latency:
+            time.sleep(s3.latency)
+
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query, keep_blank_values=True)
+        bucket_name, _, key = url.path.lstrip('/').partition('/')
+        key = urllib.parse.unquote(key)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        with s3.lock:
+            bucket = s3.buckets.get(bucket_name)
+
+            if method == 'PUT' and not key:
+                s3.buckets.setdefault(bucket_name, {})
+                return self.respond(200)
+
+            if bucket is None:
+                return self.error(404, 'NoSuchBucket')
+
+            if not key:
+                if method == 'POST' and 'delete' in query:
+                    return self.delete_objects(bucket, body)
+
+                return self.list_objects(bucket, query, method)
+
+            if 'uploads' in query:
+                return self.initiate_upload(bucket_name, key)
+
+            if 'uploadId' in query:
+                return self.multipart(method, bucket, key, query, body)
+
+            if method == 'PUT':
+                return self.put_object(bucket, key, body)
+
+            if method == 'DELETE':
+                bucket.pop(key, None)
+                return self.respond(204)
+
+            obj = bucket.get(key)
+
+            if obj is None:
+                return self.error(404, 'NoSuchKey', method == 'HEAD')
+
+            headers = dict(obj.headers)
+            headers['ETag'] = obj.etag
+            headers['Last-Modified'] = email.utils.formatdate(
+                obj.modified, usegmt=True)
+            self.respond(200, obj.data, headers, method == 'HEAD')
+
+    def put_object(self, bucket, key, body):
+        source = self.headers.get('x-amz-copy-source')
+
+        if source is not None:
+            source_bucket, _, source_key = urllib.parse.unquote(
+                source).lstrip('/').partition('/')
+            original = self.server.s3.buckets.get(source_bucket, {}).get(
+                source_key)
+
+            if original is None:
+                return self.error(404, 'NoSuchKey')
+
+            headers = dict(original.headers)
+
+            if self.headers.get('x-amz-metadata-directive') == 'REPLACE':
+                headers = self.stored_headers()
+
+            copied = _Object(original.data, headers)
+            bucket[key] = copied
+            return self.respond(200, (
+                '<CopyObjectResult><LastModified>' +
+                self.iso_date(copied.modified) +
+                '</LastModified><ETag>' + escape(copied.etag) +
+                '</ETag></CopyObjectResult>').encode('utf-8'))
+
+        obj = _Object(body, self.stored_headers())
+        bucket[key] = obj
+        self.respond(200, headers={'ETag': obj.etag})
+
+    def stored_headers(self):
+        return dict((name, value) for name, value in self.headers.items()
+                    if name.lower() in STORED_HEADERS or
+                    name.lower().startswith('x-amz-meta-'))
+
+    def list_objects(self, bucket, query, method):
+        prefix = query.get('prefix', [''])[0]
+        marker = query.get('marker', [''])[0]
+        max_keys = int(query.get('max-keys', ['1000'])[0])
+
+        keys = sorted(key for key in bucket
+                      if key.startswith(prefix) and key > marker)
+        truncated = len(keys) > max_keys
+        keys = keys[:max_keys]
+
+        contents = ''.join(
+            '<Contents><Key>' + escape(key) + '</Key><LastModified>' +
+            self.iso_date(bucket[key].modified) + '</LastModified><ETag>' +
+            escape(bucket[key].etag) + '</ETag><Size>' +
+            str(len(bucket[key].data)) +
+            '</Size><StorageClass>STANDARD</StorageClass></Contents>'
+            for key in keys)
+
+        self.respond(200, (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<ListBucketResult><Prefix>' + escape(prefix) +
+            '</Prefix><Marker>' + escape(marker) + '</Marker><MaxKeys>' +
+            str(max_keys) + '</MaxKeys><IsTruncated>' +
+            str(truncated).lower() + '</IsTruncated>' + contents +
+            '</ListBucketResult>').encode('utf-8'),
+            head_only=method == 'HEAD')
+
+    def delete_objects(self, bucket, body):
+        deleted = []
+
+        for element in ET.fromstring(body).iter():
+            if element.tag.split('}')[-1] == 'Key':
+                bucket.pop(element.text, None)
+                deleted.append(element.text)
+
+        self.respond(200, (
+            '<?xml version="1.0" encoding="UTF-8"?><DeleteResult>' +
+            ''.join('<Deleted><Key>' + escape(key) + '</Key></Deleted>'
+                    for key in deleted) +
+            '</DeleteResult>').encode('utf-8'))
+
+    def initiate_upload(self, bucket_name, key):
+        upload_id = uuid.uuid4().hex
+        self.server.s3.uploads[upload_id] = {'headers': self.stored_headers(),
+                                             'parts': {}}
+
+        self.respond(200, (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<InitiateMultipartUploadResult><Bucket>' + escape(bucket_name) +
+            '</Bucket><Key>' + escape(key) + '</Key><UploadId>' + upload_id +
+            '</UploadId></InitiateMultipartUploadResult>').encode('utf-8'))
+
+    def multipart(self, method, bucket, key, query, body):
+        upload_id = query['uploadId'][0]
+        upload = self.server.s3.uploads.get(upload_id)
+
+        if upload is None:
+            return self.error(404, 'NoSuchUpload')
+
+        if method == 'PUT':
+            part = _Object(body, {})
+            upload['parts'][int(query['partNumber'][0])] = part
+            return self.respond(200, headers={'ETag': part.etag})
+
+        if method == 'GET':
+            return self.respond(200, (
+                '<?xml version="1.0" encoding="UTF-8"?><ListPartsResult>'
+                '<UploadId>' + upload_id + '</UploadId><IsTruncated>false'
+                '</IsTruncated>' + ''.join(
+                    '<Part><PartNumber>' + str(number) + '</PartNumber>'
+                    '<ETag>' + escape(part.etag) + '</ETag><Size>' +
+                    str(len(part.data)) + '</Size></Part>'
+                    for number, part in sorted(upload['parts'].items())) +
+                '</ListPartsResult>').encode('utf-8'))
+
+        del self.server.s3.uploads[upload_id]
+
+        if method == 'DELETE':
+            return self.respond(204)
+
+        parts = [upload['parts'][number] for number in sorted(upload['parts'])]
+        obj = _Object(b''.join(part.data for part in parts), upload['headers'])
+        obj.etag = ('"' + hashlib.md5(b''.join(
+            bytes.fromhex(part.etag.strip('"')) for part in parts)).hexdigest() +
+            '-' + str(len(parts)) + '"')
+        bucket[key] = obj
+
+        self.respond(200, (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<CompleteMultipartUploadResult><Key>' + escape(key) +
+            '</Key><ETag>' + escape(obj.etag) +
+            '</ETag></CompleteMultipartUploadResult>').encode('utf-8'))
+
+    def error(self, status, code, head_only=False):
+        self.respond(status, (
+            '<?xml version="1.0" encoding="UTF-8"?><Error><Code>' + code +
+            '</Code><Message>' + code + '</Message></Error>').encode('utf-8'),
+            head_only=head_only)
+
+    def respond(self, status, body=b'', headers=None, head_only=False):
+        self.send_response(status)
+
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        if not head_only:
+            self.wfile.write(body)
+
+    def iso_date(self, timestamp):
+        return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(timestamp))
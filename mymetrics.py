@@ -0,0 +1,251 @@
+import array
+import contextlib
+import functools
+import json
+import math
+import os
+import threading
+import time
+
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Sample(object):
+
+    __slots__ = ('bytes_in', 'bytes_out')
+
+    def __init__(self):
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+
+class Metrics(object):
+
+    def __init__(self, job=''):
+        self.job = job
+        self.started = time.perf_counter()
+        self._seconds = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        sample = Sample()
+        start = time.perf_counter()
+        failed = True
+
+        try:
+            yield sample
+            failed = False
+        finally:
+            self.record(stage, time.perf_counter() - start,
+                        sample.bytes_in, sample.bytes_out, failed)
+
+    def record(self, stage, seconds, bytes_in=0, bytes_out=0, failed=False):
+        with self._lock:
+            if stage not in self._seconds:
+                self._seconds[stage] = array.array('d')
+                self._counters[stage] = {'bytes_in': 0, 'bytes_out': 0,
+                                         'errors': 0, 'retries': 0}
+
+            self._seconds[stage].append(seconds)
+            counters = self._counters[stage]
+            counters['bytes_in'] += bytes_in
+            counters['bytes_out'] += bytes_out
+            counters['errors'] += failed
+
+    def count(self, stage, counter, value=1):
+        with self._lock:
+            counters = self._counters.setdefault(
+                stage, {'bytes_in': 0, 'bytes_out': 0,
+                        'errors': 0, 'retries': 0})
+            self._seconds.setdefault(stage, array.array('d'))
+            counters[counter] = counters.get(counter, 0) + value
+
+    def report(self):
+        with self._lock:
+            stages = dict((stage, (sorted(self._seconds[stage]),
+                                   dict(self._counters[stage])))
+                          for stage in self._seconds)
+
+        result = {}
+
+        for stage, (seconds, counters) in stages.items():
+            entry = {'calls': len(seconds),
+                     'seconds': round(sum(seconds), 6),
+                     'max': round(seconds[-1], 6) if seconds else 0.0}
+
+            for quantile in QUANTILES:
+                entry['p' + str(int(quantile * 100))] = round(
+                    percentile(seconds, quantile), 6)
+
+            entry.update(counters)
+
+            if counters['bytes_in'] and counters['bytes_out']:
+                entry['ratio'] = round(counters['bytes_out'] /
+                                       counters['bytes_in'], 4)
+
+            result[stage] = entry
+
+        return {'job': self.job,
+                'wall_seconds': round(time.perf_counter() - self.started, 6),
+                'stages': result}
+
+    def summary(self):
+        report = self.report()
+        lines = ['Stage timings in seconds (p50 / p95 / p99), ' +
+                 str(round(report['wall_seconds'], 3)) + ' s wall time:']
+
+        for stage, entry in sorted(report['stages'].items()):
+            line = ('  ' + stage.ljust(8) + str(entry['calls']).rjust(7) +
+                    ' calls  ' + format_seconds(entry['p50']) + ' / ' +
+                    format_seconds(entry['p95']) + ' / ' +
+                    format_seconds(entry['p99']) + '  total ' +
+                    format_seconds(entry['seconds']))
+
+            if entry['bytes_in'] or entry['bytes_out']:
+                line += ('  ' + str(entry['bytes_in']) + ' -> ' +
+                         str(entry['bytes_out']) + ' bytes')
+
+            if 'ratio' in entry:
+                line += ' (ratio ' + str(entry['ratio']) + ')'
+
+            if entry['retries']:
+                line += '  ' + str(entry['retries']) + ' retries'
+
+            if entry['errors']:
+                line += '  ' + str(entry['errors']) + ' errors'
+
+            lines.append(line)
+
+        return '\n'.join(lines)
+
+    def to_json(self):
+        return json.dumps(self.report(), indent=2, sort_keys=True)
+
+    def to_prometheus(self, prefix='newdeployments'):
+        report = self.report()
+        job = 'job="' + self.job + '"'
+        lines = ['# HELP ' + prefix + '_stage_seconds Wall time per call '
+                 'of each stage',
+                 '# TYPE ' + prefix + '_stage_seconds summary']
+
+        for stage, entry in sorted(report['stages'].items()):
+            labels = job + ',stage="' + stage + '"'
+
+            for quantile in QUANTILES:
+                lines.append(prefix + '_stage_seconds{' + labels +
+                             ',quantile="' + str(quantile) + '"} ' +
+                             repr(entry['p' + str(int(quantile * 100))]))
+
+            lines.append(prefix + '_stage_seconds_sum{' + labels + '} ' +
+                         repr(entry['seconds']))
+            lines.append(prefix + '_stage_seconds_count{' + labels + '} ' +
+                         str(entry['calls']))
+
+        for counter in ('bytes_in', 'bytes_out', 'errors', 'retries'):
+            lines.append('# TYPE ' + prefix + '_stage_' + counter +
+                         '_total counter')
+
+            for stage, entry in sorted(report['stages'].items()):
+                lines.append(prefix + '_stage_' + counter + '_total{' + job +
+                             ',stage="' + stage + '"} ' + str(entry[counter]))
+
+        lines.append('# TYPE ' + prefix + '_wall_seconds gauge')
+        lines.append(prefix + '_wall_seconds{' + job + '} ' +
+                     repr(report['wall_seconds']))
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, folder, format_='json'):
+        if format_ == 'prometheus':
+            path = os.path.join(folder, 'my' + self.job + '.prom')
+            content = self.to_prometheus()
+        else:
+            path = os.path.join(folder, 'my' + self.job + '.json')
+            content = self.to_json()
+
+        os.makedirs(folder, exist_ok=True)
+
+        # written aside then moved, so collectors never read half a file
+        with open(path + '.part', 'w') as f:
+            f.write(content)
+
+        os.replace(path + '.part', path)
+        return path
+
+
+def percentile(sorted_values, quantile):
+    if not sorted_values:
+        return 0.0
+
+    # nearest-rank method
+    index = max(0, math.ceil(quantile * len(sorted_values)) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def format_seconds(seconds):
+    return '{0:.4f}'.format(seconds)
+
+
+_current = Metrics()
+
+
+def current():
+    return _current
+
+
+def start(job):
+    global _current
+    _current = Metrics(job)
+    return _current
+
+
+def timer(stage):
+    return _current.timer(stage)
+
+
+def count(stage, counter, value=1):
+    _current.count(stage, counter, value)
+
+
+def timed(stage):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with _current.timer(stage):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def timed_iter(stage, iterable):
+    # only the time spent fetching items is recorded, as a single call,
+    # so lazily consumed listings are not charged for their consumers
+    iterator = iter(iterable)
+    seconds = 0.0
+
+    try:
+        while True:
+            start_ = time.perf_counter()
+
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                seconds += time.perf_counter() - start_
+
+            yield item
+    finally:
+        _current.record(stage, seconds)
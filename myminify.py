@@ -0,0 +1,276 @@
+import re
+
+# part of the cache key of minified files, to be bumped on output changes
+VERSION = '1'
+
+CSS_TOKENS = re.compile(r'("(?:[^"\\\n]|\\.)*"?|\'(?:[^\'\\\n]|\\.)*\'?)|'
+                        r'(/\*.*?(?:\*/|\Z))', re.S)
+
+CSS_SPACES = re.compile(r'\s+')
+
+CSS_PUNCTUATION = re.compile(r' ?([{};,>]) ?')
+
+JS_TOKENS = re.compile(r'(?P<space>\s+)|'
+                       r'(?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))|'
+                       r'(?P<string>"(?:[^"\\\n]|\\.)*"?|'
+                       r'\'(?:[^\'\\\n]|\\.)*\'?)|'
+                       r'(?P<code>[^\s"\'`/]+)|'
+                       r'(?P<other>.)', re.S)
+
+JS_LAST_WORD = re.compile(r'[\w$]+$')
+
+# a newline may be dropped after or before these characters without
+# changing how automatic semicolon insertion reads the code
+NEWLINE_SAFE_AFTER = '{[(;,=:?&|!~<>*%^'
+NEWLINE_SAFE_BEFORE = '}]),;:?.'
+
+# a slash after these characters or keywords starts a regex, not a division
+REGEX_AFTER = '([{,;:=!&|?+-*%<>~^}'
+REGEX_KEYWORDS = frozenset(['return', 'typeof', 'instanceof', 'in', 'of',
+                            'new', 'delete', 'void', 'throw', 'case', 'do',
+                            'else', 'yield', 'await'])
+
+
+def minify(type_, data):
+    text = data.decode('utf-8', 'surrogateescape')
+
+    if type_ == 'css':
+        text = minify_css(text)
+    else:
+        text = minify_js(text)
+
+    return text.encode('utf-8', 'surrogateescape')
+
+
+def minify_file(type_, input_, output):
+    with open(input_, 'rb') as input_file:
+        data = minify(type_, input_file.read())
+
+    with open(output, 'wb') as output_file:
+        output_file.write(data)
+
+
+def minify_css(text):
+    parts = []
+    code = []
+
+    def flush():
+        if code:
+            minified = minify_css_code(''.join(code))
+
+            if parts and parts[-1].startswith('/*!'):
+                minified = minified.lstrip()
+
+            parts.append(minified)
+            del code[:]
+
+    position = 0
+
+    for match in CSS_TOKENS.finditer(text):
+        code.append(text[position:match.start()])
+        position = match.end()
+
+        if match.group(1) is not None:
+            flush()
+            parts.append(match.group(1))
+
+        elif match.group(2).startswith('/*!'):
+            flush()
+
+            if parts:
+                parts[-1] = parts[-1].rstrip()
+
+            parts.append(match.group(2))
+
+        else:
+            code.append(' ')
+
+    code.append(text[position:])
+    flush()
+
+    return ''.join(parts).strip()
+
+
+def minify_css_code(code):
+    code = CSS_SPACES.sub(' ', code)
+    code = CSS_PUNCTUATION.sub(r'\1', code)
+    code = code.replace(': ', ':').replace(';}', '}')
+    return code
+
+
+def is_word_char(char):
+    return char.isalnum() or char in '_$\\' or ord(char) > 127
+
+
+def skip_string(text, position):
+    quote = text[position]
+    position += 1
+
+    while position < len(text):
+        char = text[position]
+
+        if char == '\\':
+            position += 2
+            continue
+
+        if char == quote or char == '\n':
+            return position + 1
+
+        position += 1
+
+    return len(text)
+
+
+def skip_template(text, position):
+    position += 1
+
+    while position < len(text):
+        char = text[position]
+
+        if char == '\\':
+            position += 2
+            continue
+
+        if char == '`':
+            return position + 1
+
+        if char == '$' and text.startswith('{', position + 1):
+            position = skip_block(text, position + 2)
+            continue
+
+        position += 1
+
+    return len(text)
+
+
+def skip_block(text, position):
+    depth = 1
+
+    while position < len(text):
+        char = text[position]
+
+        if char in '\'"':
+            position = skip_string(text, position)
+            continue
+
+        if char == '`':
+            position = skip_template(text, position)
+            continue
+
+        if char == '{':
+            depth += 1
+
+        elif char == '}':
+            depth -= 1
+
+            if not depth:
+                return position + 1
+
+        position += 1
+
+    return len(text)
+
+
+def skip_regex(text, position):
+    in_class = False
+    position += 1
+
+    while position < len(text):
+        char = text[position]
+
+        if char == '\\':
+            position += 2
+            continue
+
+        if char == '\n':
+            return position
+
+        if char == '[':
+            in_class = True
+
+        elif char == ']':
+            in_class = False
+
+        elif char == '/' and not in_class:
+            position += 1
+
+            while position < len(text) and is_word_char(text[position]):
+                position += 1
+
+            return position
+
+        position += 1
+
+    return len(text)
+
+
+def get_separator(space, before, after):
+    if space == '\n' and not (before in NEWLINE_SAFE_AFTER or
+                              after in NEWLINE_SAFE_BEFORE):
+        return '\n'
+
+    if is_word_char(before) and (is_word_char(after) or
+                                 (before.isdigit() and after == '.')):
+        return ' '
+
+    if (before == after and before in '+-/') or (before + after) == '/*':
+        return ' '
+
+    return ''
+
+
+def starts_regex(last_token):
+    if not last_token or last_token[-1] in REGEX_AFTER:
+        return True
+
+    word = JS_LAST_WORD.search(last_token)
+    return word is not None and word.group() in REGEX_KEYWORDS
+
+
+def minify_js(text):
+    output = []
+    space = None
+    last_token = ''
+    position = 0
+
+    while position < len(text):
+        match = JS_TOKENS.match(text, position)
+        kind = match.lastgroup
+        token = match.group()
+        position = match.end()
+
+        if kind == 'space' or (kind == 'comment' and
+                               not token.startswith('/*!')):
+            if '\n' in token or '\r' in token:
+                space = '\n'
+            elif space is None:
+                space = ' '
+            continue
+
+        if token == '`':
+            position = skip_template(text, position - 1)
+            token = text[match.start():position]
+
+        elif token == '/' and starts_regex(last_token):
+            position = skip_regex(text, position - 1)
+            token = text[match.start():position]
+
+        if space is not None and output:
+            separator = get_separator(space, output[-1][-1], token[0])
+
+            if separator:
+                output.append(separator)
+
+        output.append(token)
+        space = None
+
+        if kind == 'comment':
+            continue
+
+        # regex literals and strings are operands, not operators
+        if len(token) > 1 and token[0] in '/\'"`':
+            token = 'a'
+
+        last_token = token
+
+    return ''.join(output)
@@ -0,0 +1,74 @@
+import queue
+import threading
+
+
+_DONE = object()
+
+
+class Pipeline(object):
+
+    def __init__(self, stages, queue_size=1):
+        # stages is a list of (name, function, number_of_workers) tuples,
+        # each function is called with a single item and its return value
+        # is ignored, the same item is handed over to the next stage
+        self.stages = stages
+        self.queue_size = queue_size
+        self.completed = 0
+        self.failures = []
+        self._lock = threading.Lock()
+
+    def run(self, items):
+        queues = [queue.Queue(self.queue_size) for stage in self.stages]
+        remaining = [stage[2] for stage in self.stages]
+        threads = []
+
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage[2]):
+                t = threading.Thread(target=self._work,
+                                     args=(index, queues, remaining))
+                t.daemon = True
+                t.start()
+                threads.append(t)
+
+        try:
+            for item in items:
+                queues[0].put(item)
+        finally:
+            for _ in range(self.stages[0][2]):
+                queues[0].put(_DONE)
+
+            for t in threads:
+                t.join()
+
+        return self.failures
+
+    def _work(self, index, queues, remaining):
+        name, function = self.stages[index][:2]
+        is_last = index == len(self.stages) - 1
+
+        while True:
+            item = queues[index].get()
+
+            if item is _DONE:
+                break
+
+            try:
+                function(item)
+            except Exception as e:
+                with self._lock:
+                    self.failures.append((item, name, e))
+                continue
+
+            if is_last:
+                with self._lock:
+                    self.completed += 1
+            else:
+                queues[index + 1].put(item)
+
+        with self._lock:
+            remaining[index] -= 1
+            last_worker_out = remaining[index] == 0
+
+        if last_worker_out and not is_last:
+            for _ in range(self.stages[index + 1][2]):
+                queues[index + 1].put(_DONE)
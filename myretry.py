@@ -0,0 +1,90 @@
+import concurrent.futures
+import functools
+import http.client
+import random
+import socket
+import time
+
+import mylimiter
+import mymetrics
+
+from environment_config import (
+    S3_RETRIES,
+    S3_BACKOFF_BASE,
+    S3_BACKOFF_MAX,
+    )
+
+TRANSIENT_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+TRANSIENT_CODES = frozenset(['SlowDown', 'RequestTimeout', 'InternalError',
+                             'ServiceUnavailable', 'Throttling'])
+
+# asyncio is left out for the runs not using it, its timeouts are the
+# futures ones & its incomplete reads are EOFErrors
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, socket.timeout,
+                    socket.gaierror, http.client.HTTPException,
+                    concurrent.futures.TimeoutError, EOFError)
+
+
+def is_transient(error):
+    status = getattr(error, 'status', None)
+
+    if isinstance(status, int):
+        code = getattr(error, 'error_code', None) or getattr(error, 'code',
+                                                             None)
+        return status in TRANSIENT_STATUSES or code in TRANSIENT_CODES
+
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+def get_delay(attempt):
+    # full jitter: anywhere between no wait and the exponential ceiling,
+    # so clients throttled together do not retry together
+    ceiling = min(S3_BACKOFF_MAX, S3_BACKOFF_BASE * 2 ** (attempt - 1))
+    return random.uniform(0, ceiling)
+
+
+def call(stage, bucket, function, *args, **kwargs):
+    # every attempt holds a slot of the adaptive limit of its bucket, a
+    # throttled attempt lowers it before being retried
+    limiter = mylimiter.get(bucket)
+    attempt = 1
+
+    while True:
+        started = limiter.acquire()
+
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            limiter.release(started, stage, mylimiter.is_throttling(e))
+
+            if attempt >= S3_RETRIES or not is_transient(e):
+                raise
+
+            time.sleep(back_off(stage, attempt, e))
+            attempt += 1
+        else:
+            limiter.release(started, stage)
+            return result
+
+
+def back_off(stage, attempt, error):
+    delay = get_delay(attempt)
+    mymetrics.count(stage, 'retries')
+
+    print('Retrying ' + stage + ' in ' + str(round(delay, 2)) +
+          ' s after error: ' + repr(error))
+
+    return delay
+
+
+def retried(stage, bucket_index):
+    # the bucket the call is sent to, by its position in the arguments
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            return call(stage, args[bucket_index], function, *args, **kwargs)
+
+        return wrapper
+
+    return decorate
@@ -0,0 +1,520 @@
+import asyncio
+import base64
+import email.utils
+import hashlib
+import hmac
+import mimetypes
+import ssl
+import threading
+import urllib.parse
+import xml.etree.ElementTree as ET
+
+import boto.s3.connection
+import boto.s3.multidelete
+
+import mylimiter
+import mymetrics
+import myretry
+
+from environment_config import (
+    S3_CONCURRENCY,
+    S3_RETRIES,
+    S3_TIMEOUT,
+    )
+
+from xml.sax.saxutils import escape
+
+
+SUBRESOURCES = ('delete', 'partNumber', 'uploadId', 'uploads')
+
+
+class S3Error(Exception):
+
+    def __init__(self, status, code, message=''):
+        super().__init__(str(status) + ' ' + code + ' ' + message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+def string_to_sign(method, resource, headers):
+    lowered = dict((name.lower(), str(value).strip())
+                   for name, value in headers.items())
+    amz_headers = ''.join(name + ':' + lowered[name] + '\n'
+                          for name in sorted(lowered)
+                          if name.startswith('x-amz-'))
+
+    return (method + '\n' + lowered.get('content-md5', '') + '\n' +
+            lowered.get('content-type', '') + '\n' +
+            lowered.get('date', '') + '\n' + amz_headers + resource)
+
+
+def sign(secret_key, method, resource, headers):
+    digest = hmac.new(secret_key.encode('utf-8'),
+                      string_to_sign(method, resource,
+                                     headers).encode('utf-8'),
+                      hashlib.sha1).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+
+class AsyncConnectionPool(object):
+
+    def __init__(self, host, port, is_secure, max_idle):
+        self.host = host
+        self.port = port
+        self.ssl = ssl.create_default_context() if is_secure else None
+        self.max_idle = max_idle
+        self.opened = 0
+        self.reused = 0
+        self._idle = []
+
+    async def acquire(self):
+        while self._idle:
+            reader, writer = self._idle.pop()
+
+            if not reader.at_eof():
+                self.reused += 1
+                return reader, writer, True
+
+            writer.close()
+
+        reader, writer = await asyncio.open_connection(
+            self.host, self.port, ssl=self.ssl)
+        self.opened += 1
+        return reader, writer, False
+
+    def release(self, connection, reusable):
+        reader, writer = connection
+
+        if reusable and len(self._idle) < self.max_idle:
+            self._idle.append(connection)
+        else:
+            writer.close()
+
+    def close(self):
+        while self._idle:
+            self._idle.pop()[1].close()
+
+
+class AsyncS3Client(object):
+
+    def __init__(self, access_key, secret_key, host='s3.amazonaws.com',
+                 port=None, is_secure=True, path_style=False,
+                 concurrency=64, timeout=70):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.host = host
+        self.port = port or (443 if is_secure else 80)
+        self.is_secure = is_secure
+        self.path_style = path_style
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.pools = {}
+        self._semaphore = None
+
+    def stats(self):
+        return {'opened': sum(pool.opened for pool in self.pools.values()),
+                'reused': sum(pool.reused for pool in self.pools.values()),
+                'idle': sum(len(pool._idle) for pool in self.pools.values())}
+
+    async def exists(self, bucket, key):
+        status, headers, body = await self.request('HEAD', bucket, key,
+                                                   expected=(200, 404))
+        return status == 200
+
+    async def etag(self, bucket, key):
+        status, headers, body = await self.request('HEAD', bucket, key,
+                                                   expected=(200, 404))
+
+        if status == 404:
+            return None
+
+        return headers.get('etag', '').strip('"')
+
+    async def put(self, bucket, key, body, headers=None):
+        headers = dict(headers or {})
+
+        # like boto, guessed from the key when the caller does not set it
+        if not any(name.lower() == 'content-type' for name in headers):
+            headers['Content-Type'] = (mimetypes.guess_type(key)[0] or
+                                       'application/octet-stream')
+
+        headers['Content-MD5'] = base64.b64encode(
+            hashlib.md5(body).digest()).decode('ascii')
+        headers.setdefault('x-amz-acl', 'public-read')
+
+        status, headers, _ = await self.request('PUT', bucket, key,
+                                                headers=headers, body=body)
+        return headers.get('etag', '').strip('"')
+
+    async def list_page(self, bucket, prefix='', marker='', max_keys=1000):
+        query = urllib.parse.urlencode([('marker', marker),
+                                        ('max-keys', str(max_keys)),
+                                        ('prefix', prefix)])
+        status, headers, body = await self.request('GET', bucket,
+                                                   query=query)
+        root = ET.fromstring(body)
+        entries = []
+
+        for contents in iter_children(root, 'Contents'):
+            entries.append((child_text(contents, 'Key'),
+                            child_text(contents, 'ETag').strip('"'),
+                            int(child_text(contents, 'Size'))))
+
+        truncated = child_text(root, 'IsTruncated') == 'true'
+        return entries, truncated
+
+    async def list(self, bucket, prefix=''):
+        entries = []
+        marker = ''
+
+        while True:
+            page, truncated = await self.list_page(bucket, prefix, marker)
+            entries.extend(page)
+
+            if not truncated or not page:
+                return entries
+
+            marker = page[-1][0]
+
+    async def delete_keys(self, bucket, keys):
+        body = ('<?xml version="1.0" encoding="UTF-8"?><Delete>'
+                '<Quiet>false</Quiet>' +
+                ''.join('<Object><Key>' + escape(key) + '</Key></Object>'
+                        for key in keys) +
+                '</Delete>').encode('utf-8')
+        headers = {'Content-Type': 'application/xml',
+                   'Content-MD5': base64.b64encode(
+                       hashlib.md5(body).digest()).decode('ascii')}
+
+        status, _, response = await self.request(
+            'POST', bucket, query='delete', headers=headers, body=body)
+        root = ET.fromstring(response)
+
+        deleted = [child_text(element, 'Key')
+                   for element in iter_children(root, 'Deleted')]
+        errors = [(child_text(element, 'Key'), child_text(element, 'Code'),
+                   child_text(element, 'Message'))
+                  for element in iter_children(root, 'Error')]
+
+        return deleted, errors
+
+    async def request(self, method, bucket, key='', query='', headers=None,
+                      body=b'', expected=(200, 204)):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        headers = dict((name, value.decode('utf-8')
+                        if isinstance(value, bytes) else str(value))
+                       for name, value in (headers or {}).items())
+        headers['Date'] = email.utils.formatdate(usegmt=True)
+        resource = '/' + bucket + '/' + urllib.parse.quote(key)
+        subresources = [part for part in query.split('&')
+                        if part.split('=')[0] in SUBRESOURCES]
+
+        if subresources:
+            resource += '?' + '&'.join(sorted(subresources))
+
+        headers['Authorization'] = ('AWS ' + self.access_key + ':' +
+                                    sign(self.secret_key, method, resource,
+                                         headers))
+
+        if self.path_style:
+            host = self.host
+            path = resource.split('?')[0]
+        else:
+            host = bucket + '.' + self.host
+            path = '/' + urllib.parse.quote(key)
+
+        if query:
+            path += '?' + query
+
+        async with self._semaphore:
+            pool = self.pools.get(host)
+
+            if pool is None:
+                pool = self.pools[host] = AsyncConnectionPool(
+                    host, self.port, self.is_secure, self.concurrency)
+
+            response = await self.send(pool, method, host, path, headers,
+                                       body)
+
+        status, response_headers, response_body = response
+
+        if status not in expected:
+            code, message = str(status), ''
+
+            if response_body:
+                try:
+                    root = ET.fromstring(response_body)
+                    code = child_text(root, 'Code') or code
+                    message = child_text(root, 'Message') or ''
+                except ET.ParseError:
+                    pass
+
+            raise S3Error(status, code, message)
+
+        return response
+
+    async def send(self, pool, method, host, path, headers, body):
+        lines = [method + ' ' + path + ' HTTP/1.1', 'Host: ' + host,
+                 'Content-Length: ' + str(len(body))]
+        lines.extend(name + ': ' + str(value)
+                     for name, value in headers.items())
+        message = ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8') + body
+
+        while True:
+            # a server that stops answering fails the request like boto's
+            # socket timeout would, instead of holding its slot forever
+            reader, writer, reused = await asyncio.wait_for(pool.acquire(),
+                                                            self.timeout)
+
+            try:
+                response = await asyncio.wait_for(
+                    exchange(reader, writer, message, method), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+
+                # a kept-alive connection may have been closed by the server
+                # in the meantime, retried once on a new connection
+                if reused:
+                    continue
+
+                raise
+            except BaseException:
+                writer.close()
+                raise
+
+            status, response_headers, response_body, reusable = response
+            pool.release((reader, writer), reusable)
+            return status, response_headers, response_body
+
+    async def close(self):
+        for pool in self.pools.values():
+            pool.close()
+
+        self.pools.clear()
+
+
+async def exchange(reader, writer, message, method):
+    writer.write(message)
+    await writer.drain()
+    return await read_response(reader, method)
+
+
+async def read_response(reader, method):
+    status_line = await reader.readline()
+
+    if not status_line:
+        raise asyncio.IncompleteReadError(b'', None)
+
+    status = int(status_line.split()[1])
+    headers = {}
+
+    while True:
+        line = await reader.readline()
+
+        if line in (b'\r\n', b'\n', b''):
+            break
+
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    reusable = headers.get('connection', '').lower() != 'close'
+
+    if method == 'HEAD' or status in (204, 304):
+        body = b''
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+
+            if size == 0:
+                await reader.readline()
+                break
+
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+
+        body = b''.join(chunks)
+    else:
+        body = await reader.read()
+        reusable = False
+
+    return status, headers, body, reusable
+
+
+def iter_children(element, name):
+    return (child for child in element if child.tag.split('}')[-1] == name)
+
+
+def child_text(element, name):
+    for child in iter_children(element, name):
+        return child.text or ''
+
+    return ''
+
+
+class EventLoopThread(object):
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coroutine):
+        return self.submit(coroutine).result()
+
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+class AsyncS3Util(object):
+
+    # functions mirror the S3Util ones taking boto buckets, the requests
+    # are sent from a single event loop shared by every calling thread
+
+    _runner = None
+    _clients = {}
+    _lock = threading.Lock()
+
+    def client_for(bucket):
+        connection = bucket.connection
+        path_style = isinstance(connection.calling_format,
+                                boto.s3.connection.OrdinaryCallingFormat)
+        key = (connection.aws_access_key_id, connection.host,
+               connection.port, connection.is_secure, path_style)
+
+        with AsyncS3Util._lock:
+            if AsyncS3Util._runner is None:
+                AsyncS3Util._runner = EventLoopThread()
+
+            if key not in AsyncS3Util._clients:
+                AsyncS3Util._clients[key] = AsyncS3Client(
+                    connection.aws_access_key_id,
+                    connection.aws_secret_access_key,
+                    connection.host, connection.port, connection.is_secure,
+                    path_style, S3_CONCURRENCY, S3_TIMEOUT)
+
+            return AsyncS3Util._clients[key]
+
+    def run(coroutine):
+        return AsyncS3Util._runner.run(coroutine)
+
+    def file_exists_in_s3_bucket(path, bucket):
+        client = AsyncS3Util.client_for(bucket)
+        return AsyncS3Util.run(client.exists(bucket.name, path))
+
+    def get_etag(path, bucket):
+        client = AsyncS3Util.client_for(bucket)
+        return AsyncS3Util.run(client.etag(bucket.name, path))
+
+    def files_exist(paths_and_buckets):
+        paths_and_buckets = list(paths_and_buckets)
+
+        if not paths_and_buckets:
+            return []
+
+        async def exists(client, path, bucket, limiter, started):
+            # retried on its own, a transient failure does not send the
+            # other requests of the batch again
+            attempt = 1
+
+            while True:
+                try:
+                    with mymetrics.timer('exists'):
+                        result = await client.exists(bucket.name, path)
+                except Exception as e:
+                    limiter.release(started, 'exists',
+                                    mylimiter.is_throttling(e))
+
+                    if attempt >= S3_RETRIES or not myretry.is_transient(e):
+                        raise
+
+                    await asyncio.sleep(myretry.back_off('exists', attempt,
+                                                         e))
+                    started = await asyncio.get_event_loop().run_in_executor(
+                        None, limiter.acquire)
+                    attempt += 1
+                except BaseException:
+                    limiter.release(started, 'exists')
+                    raise
+                else:
+                    limiter.release(started, 'exists')
+                    return result
+
+        # each request holds a slot of its bucket's limit, taken in the
+        # calling thread so the event loop never waits for one
+        futures = []
+
+        for path, bucket in paths_and_buckets:
+            client = AsyncS3Util.client_for(bucket)
+            limiter = mylimiter.get(bucket)
+            started = limiter.acquire()
+            futures.append(AsyncS3Util._runner.submit(
+                exists(client, path, bucket, limiter, started)))
+
+        return [future.result() for future in futures]
+
+    def list_key_entries(bucket, prefix=''):
+        marker = ''
+
+        while True:
+            page, truncated = myretry.call(
+                'list', bucket, AsyncS3Util.get_listing_page, bucket, prefix,
+                marker)
+
+            for entry in page:
+                yield entry
+
+            if not truncated or not page:
+                return
+
+            marker = page[-1][0]
+
+    def get_listing_page(bucket, prefix, marker):
+        client = AsyncS3Util.client_for(bucket)
+        return AsyncS3Util.run(client.list_page(bucket.name, prefix, marker))
+
+    def list_keys(bucket, prefix=''):
+        return (key for key, etag, size
+                in AsyncS3Util.list_key_entries(bucket, prefix))
+
+    def delete_keys(bucket, paths):
+        client = AsyncS3Util.client_for(bucket)
+        deleted, errors = AsyncS3Util.run(client.delete_keys(bucket.name,
+                                                             paths))
+
+        result = boto.s3.multidelete.MultiDeleteResult(bucket)
+        result.deleted = [boto.s3.multidelete.Deleted(key=key)
+                          for key in deleted]
+        result.errors = [boto.s3.multidelete.Error(key=key, code=code,
+                                                   message=message)
+                         for key, code, message in errors]
+        return result
+
+    def put(bucket, path, data, headers):
+        client = AsyncS3Util.client_for(bucket)
+        return AsyncS3Util.run(client.put(bucket.name, path, data, headers))
+
+    def stats():
+        stats = {'opened': 0, 'reused': 0, 'idle': 0}
+
+        for client in list(AsyncS3Util._clients.values()):
+            for name, value in client.stats().items():
+                stats[name] += value
+
+        return stats
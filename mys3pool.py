@@ -0,0 +1,90 @@
+import contextlib
+import threading
+
+
+class ConnectionPool(object):
+
+    def __init__(self, factory, max_size):
+        # factory creates a new connection, called at most max_size times
+        self.factory = factory
+        self.max_size = max(max_size, 1)
+        self.opened = 0
+        self.reused = 0
+        self.prototype = None
+        self._idle = []
+        self._condition = threading.Condition()
+
+    def checkout(self):
+        with self._condition:
+            while not self._idle and self.opened >= self.max_size:
+                self._condition.wait()
+
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop()
+
+            self.opened += 1
+
+        try:
+            connection = self.factory()
+        except Exception:
+            with self._condition:
+                self.opened -= 1
+                self._condition.notify()
+            raise
+
+        if self.prototype is None:
+            self.prototype = connection
+
+        return connection
+
+    def checkin(self, connection):
+        with self._condition:
+            self._idle.append(connection)
+            self._condition.notify()
+
+    @contextlib.contextmanager
+    def connection(self):
+        connection = self.checkout()
+
+        try:
+            yield connection
+        finally:
+            self.checkin(connection)
+
+    def stats(self):
+        with self._condition:
+            return {'opened': self.opened, 'reused': self.reused,
+                    'idle': len(self._idle),
+                    'in_use': self.opened - len(self._idle)}
+
+    def summary(self):
+        stats = self.stats()
+        return ('Connections: ' + str(stats['opened']) + ' opened, ' +
+                str(stats['reused']) + ' reused, ' +
+                str(stats['idle']) + ' idle')
+
+
+class PooledBucket(object):
+
+    def __init__(self, pool, name):
+        self.pool = pool
+        self.name = name
+
+    @property
+    def connection(self):
+        # settings (credentials, host) shared by every pooled connection,
+        # not to be used to send requests
+        if self.pool.prototype is None:
+            with self.pool.connection():
+                pass
+
+        return self.pool.prototype
+
+    @contextlib.contextmanager
+    def checkout(self):
+        with self.pool.connection() as connection:
+            yield connection.get_bucket(self.name, validate=False)
+
+    def __repr__(self):
+        return '<PooledBucket: ' + self.name + '>'
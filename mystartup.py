@@ -0,0 +1,92 @@
+import contextlib
+import os
+import re
+import subprocess
+import sys
+import time
+
+from mymetrics import format_seconds
+
+IMPORT_TIME_LINE = re.compile(r'import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)')
+
+
+def get_import_times(module):
+    # -X importtime exists since python 3.7, a fresh interpreter is needed
+    # for every module to actually be imported
+    if sys.version_info < (3, 7):
+        return None
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             'import ' + module],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    return parse_import_times(result.stderr, module)
+
+
+def parse_import_times(output, module):
+    # children are printed before the module importing them, a module is
+    # listed under whichever module imported it first
+    children = []
+
+    for line in output.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+
+        if match is None:
+            continue
+
+        microseconds, indent, name = match.groups()
+        depth = len(indent) // 2
+
+        if depth == 1:
+            children.append((name, int(microseconds) / 1e6))
+
+        elif depth == 0:
+            if name == module:
+                children.sort(key=lambda child: child[1], reverse=True)
+                return int(microseconds) / 1e6, children
+
+            children = []
+
+    return None
+
+
+class StartupProfile(object):
+
+    def __init__(self, module, top=10):
+        self.module = module
+        self.top = top
+        self.phases = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def summary(self):
+        lines = []
+        imports = get_import_times(self.module)
+
+        if imports is None:
+            lines.append('Import breakdown needs python 3.7 or later')
+        else:
+            total, children = imports
+            lines.append('Imports of ' + self.module + ': ' +
+                         format_seconds(total) + ' s')
+
+            for name, seconds in children[:self.top]:
+                lines.append('  ' + name.ljust(24) + format_seconds(seconds) +
+                             ' s')
+
+        lines.append('Startup phases:')
+
+        for name, seconds in self.phases:
+            lines.append('  ' + name.ljust(24) + format_seconds(seconds) +
+                         ' s')
+
+        return '\n'.join(lines)
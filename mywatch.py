@@ -0,0 +1,130 @@
+import os
+import time
+
+import mydeploy
+import mymetrics
+
+from environment_config import WATCH_INTERVAL
+
+
+def watch_main(polls=None):
+    # files are always streamed, a watched working copy must be left as is
+    mydeploy.check_settings()
+    deployment = mydeploy.Deployment(mydeploy.connect_targets(),
+                                     streaming=True)
+
+    try:
+        # deployed is what the last deployment saw, state is only used to
+        # wait for changes to settle
+        file_objects, deployed = deploy_changes(deployment, {})
+        state = deployed
+        pending = False
+        count = 0
+
+        while polls is None or count < polls:
+            time.sleep(WATCH_INTERVAL)
+            count += 1
+
+            current = get_watched_state(file_objects)
+
+            # editors & checkouts write in bursts, deploy once they settle
+            if current != state:
+                state = current
+                pending = True
+                continue
+
+            if pending:
+                file_objects, deployed = deploy_changes(deployment,
+                                                        deployed[1])
+                state = deployed
+                pending = False
+    except KeyboardInterrupt:
+        print('\nStopped watching')
+    finally:
+        deployment.close()
+
+
+def deploy_changes(deployment, known):
+    xml_signature = get_signature(mydeploy.XML_PATH)
+    metrics = mymetrics.start('deploy')
+    start = time.perf_counter()
+
+    file_objects = list(mydeploy.iter_file_objects(
+        deployment.targets[0].connection_pools, mydeploy.XML_PATH,
+        validate=True))
+    entries = get_entries(file_objects)
+    changed = find_changes(known, file_objects, entries)
+
+    if changed:
+        deployment.load_manifests(changed)
+        failures = deployment.run(changed)
+
+        # failed entries are left out of the deployed ones, the next poll
+        # sees them as changed & retries them (all of them when a whole
+        # target could not be checked)
+        for item, stage, error in failures:
+            for failed in [item] if item is not None else changed:
+                entries.pop(get_entry_key(failed), None)
+
+        print('Deployed ' + str(len(changed)) + ' changed entries in ' +
+              mymetrics.format_seconds(time.perf_counter() - start) + ' s' +
+              (', failed ones are retried at the next poll'
+               if failures else ''))
+
+        deployment.print_pool_summary()
+        mydeploy.report_metrics(metrics)
+
+    print('Watching ' + mydeploy.XML_PATH + ' and ' +
+          str(len(file_objects)) + ' indexed files for changes')
+
+    return file_objects, (xml_signature, entries)
+
+
+def find_changes(known, file_objects, entries):
+    changed = []
+
+    for item in file_objects:
+        key = get_entry_key(item)
+        previous = known.get(key)
+
+        if previous == entries[key]:
+            continue
+
+        if previous is not None and previous[0] == item.version:
+            print('Changed ' + item.path_in_filesystem + ' keeps version ' +
+                  item.version + ', it is only uploaded if ' +
+                  item.versioned_path_in_bucket + ' is not deployed yet')
+
+        changed.append(item)
+
+    return changed
+
+
+def get_watched_state(file_objects):
+    return get_signature(mydeploy.XML_PATH), get_entries(file_objects)
+
+
+def get_entries(file_objects):
+    return dict((get_entry_key(item), (item.version, get_item_signature(item)))
+                for item in file_objects)
+
+
+def get_entry_key(item):
+    return item.type_, item.url
+
+
+def get_item_signature(item):
+    if isinstance(item, mydeploy.Bundle):
+        return tuple(get_signature(member.path_in_filesystem)
+                     for member in item.members)
+
+    return get_signature(item.path_in_filesystem)
+
+
+def get_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return stat.st_mtime_ns, stat.st_size
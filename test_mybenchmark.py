@@ -0,0 +1,132 @@
+import unittest
+
+from mybenchmark import (
+    compare_minifiers,
+    compare_with_baseline,
+    generate_workspace,
+    parse_mix,
+    run_benchmark,
+    )
+
+from mydeploy import XMLParser
+
+import os
+import shutil
+import tempfile
+
+
+class WorkspaceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def test_mix_should_be_parsed_as_css_js_image_weights(self):
+        self.assertEqual(parse_mix('1:2:3'), {'css': 1, 'js': 2, 'image': 3})
+
+        with self.assertRaises(ValueError):
+            parse_mix('1:2')
+
+    def test_generated_index_should_list_every_generated_file(self):
+        workspace = generate_workspace(self.folder, 30, parse_mix('1:1:1'))
+
+        entries = list(XMLParser.iter_entries(workspace['xml']))
+        sizes = sum(os.path.getsize(os.path.join(
+                        workspace['prefix'],
+                        {'css': 'css/', 'js': 'scripts/',
+                         'image': 'images/'}[type_] + url))
+                    for url, type_, version in entries)
+
+        self.assertEqual(len(entries), 30)
+        self.assertEqual(sizes, workspace['bytes'])
+        self.assertEqual(sum(workspace['types'].values()), 30)
+        self.assertEqual(set(version for url, type_, version in entries),
+                         {'000000000001'})
+
+    def test_same_seed_should_generate_same_workspace(self):
+        first = generate_workspace(os.path.join(self.folder, 'a'), 20, seed=7)
+        second = generate_workspace(os.path.join(self.folder, 'b'), 20, seed=7)
+
+        self.assertEqual(first['bytes'], second['bytes'])
+        self.assertEqual(first['types'], second['types'])
+
+    def test_mix_without_images_should_generate_no_images(self):
+        workspace = generate_workspace(self.folder, 10, parse_mix('1:1:0'))
+
+        self.assertNotIn('image', [type_ for type_, count
+                                   in workspace['types'].items() if count])
+
+
+class BaselineTest(unittest.TestCase):
+
+    baseline = {'deploy': {'files_per_sec': 100, 'bytes_per_sec': 1000},
+                'cleanup': {'files_per_sec': 500},
+                'peak_rss_kb': 1000}
+
+    def report(self, deploy_files_per_sec=100, peak_rss_kb=1000):
+        return {'deploy': {'files_per_sec': deploy_files_per_sec,
+                           'bytes_per_sec': 1000},
+                'cleanup': {'files_per_sec': 500},
+                'peak_rss_kb': peak_rss_kb}
+
+    def test_slowdown_within_tolerance_should_pass(self):
+        self.assertEqual(
+            compare_with_baseline(self.report(85), self.baseline, 0.2), [])
+
+    def test_slowdown_beyond_tolerance_should_be_reported(self):
+        regressions = compare_with_baseline(self.report(70), self.baseline, 0.2)
+
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('deploy files_per_sec', regressions[0])
+
+    def test_memory_growth_beyond_tolerance_should_be_reported(self):
+        regressions = compare_with_baseline(self.report(peak_rss_kb=1500),
+                                            self.baseline, 0.2)
+
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('peak_rss_kb', regressions[0])
+
+    def test_unavailable_measurement_should_be_ignored(self):
+        self.assertEqual(compare_with_baseline(self.report(peak_rss_kb=None),
+                                               self.baseline, 0.2), [])
+
+
+class RunBenchmarkTest(unittest.TestCase):
+
+    def test_benchmark_should_deploy_and_clean_up_every_file(self):
+        report = run_benchmark(files=12, seed=3)
+
+        self.assertEqual(report['files'], 12)
+        self.assertEqual(report['deploy']['failed'], 0)
+        self.assertEqual(report['cleanup']['deleted'], 12)
+        self.assertEqual(report['deploy']['stages']['upload']['calls'], 12)
+        self.assertGreater(report['deploy']['files_per_sec'], 0)
+        self.assertIn('PUT', report['requests'])
+
+    def test_benchmark_should_run_with_asyncio_backend(self):
+        report = run_benchmark(files=12, seed=3, backend='asyncio')
+
+        self.assertEqual(report['deploy']['failed'], 0)
+        self.assertEqual(report['cleanup']['deleted'], 12)
+
+    def test_benchmark_should_run_with_python_minifier(self):
+        report = run_benchmark(files=12, seed=3, minifier='python')
+
+        self.assertEqual(report['deploy']['failed'], 0)
+        self.assertEqual(report['deploy']['stages']['minify']['calls'],
+                         report['types']['css'] + report['types']['js'])
+
+
+class CompareMinifiersTest(unittest.TestCase):
+
+    def test_comparison_should_report_speed_and_size_per_backend_and_type(self):
+        results = compare_minifiers(files=10, seed=1, backends=('python',))
+
+        self.assertEqual(sorted(results['python']), ['css', 'js'])
+
+        for result in results['python'].values():
+            self.assertEqual(result['failed'], 0)
+            self.assertGreater(result['files_per_sec'], 0)
+            self.assertLess(result['ratio'], 1)
+
+        self.assertEqual(sum(result['files'] for result in results['python'].values()), 10)
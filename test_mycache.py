@@ -0,0 +1,98 @@
+import unittest
+
+from mycache import (
+    ArtifactCache,
+    get_file_digest,
+    )
+
+import os
+import shutil
+import tempfile
+
+
+class FileDigestTest(unittest.TestCase):
+
+    def test_same_content_should_give_same_digest(self):
+        self.assertEqual(get_file_digest('fixtures/styles.css'),
+                         get_file_digest('fixtures/styles.css', chunk_size=7))
+
+    def test_different_content_should_give_different_digest(self):
+        self.assertNotEqual(get_file_digest('fixtures/styles.css'),
+                            get_file_digest('fixtures/cells.js'))
+
+
+class ArtifactCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.cache_path = os.path.join(self.folder, 'cache')
+
+    def artifact(self, name, size):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return path
+
+    def test_key_should_depend_on_every_part(self):
+        self.assertEqual(ArtifactCache.make_key('a', 'b'), ArtifactCache.make_key('a', 'b'))
+        self.assertNotEqual(ArtifactCache.make_key('a', 'b'), ArtifactCache.make_key('a', 'c'))
+        self.assertNotEqual(ArtifactCache.make_key('ab', ''), ArtifactCache.make_key('a', 'b'))
+
+    def test_get_should_count_hits_and_misses(self):
+        cache = ArtifactCache(self.cache_path, 100)
+        cache.put('k1', self.artifact('a', 10))
+
+        self.assertIsNone(cache.open('k2'))
+
+        with cache.open('k1') as f:
+            self.assertEqual(f.read(), b'x' * 10)
+
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertIn('1 hits, 1 misses', cache.summary())
+
+    def test_least_recently_used_entry_should_be_evicted_over_size_cap(self):
+        cache = ArtifactCache(self.cache_path, 25)
+        cache.put('k1', self.artifact('a', 10))
+        cache.put('k2', self.artifact('b', 10))
+        cache.open('k1').close()
+        cache.put('k3', self.artifact('c', 10))
+
+        self.assertTrue(cache.contains('k1'))
+        self.assertFalse(cache.contains('k2'))
+        self.assertTrue(cache.contains('k3'))
+        self.assertEqual(cache.evictions, 1)
+        self.assertFalse(os.path.exists(os.path.join(self.cache_path, 'k2')))
+
+    def test_artifact_bigger_than_size_cap_should_not_be_stored(self):
+        cache = ArtifactCache(self.cache_path, 5)
+        cache.put('k1', self.artifact('a', 10))
+
+        self.assertFalse(cache.contains('k1'))
+
+    def test_entries_should_persist_across_runs(self):
+        ArtifactCache(self.cache_path, 100).put('k1', self.artifact('a', 10))
+
+        cache = ArtifactCache(self.cache_path, 100)
+
+        with cache.open('k1') as f:
+            self.assertEqual(f.read(), b'x' * 10)
+
+    def test_opened_entry_should_stay_readable_after_being_evicted(self):
+        cache = ArtifactCache(self.cache_path, 15)
+        cache.put('k1', self.artifact('a', 10))
+
+        with cache.open('k1') as f:
+            cache.put('k2', self.artifact('b', 10))
+
+            self.assertFalse(cache.contains('k1'))
+            self.assertEqual(f.read(), b'x' * 10)
+
+    def test_entry_removed_from_outside_should_be_a_miss(self):
+        cache = ArtifactCache(self.cache_path, 100)
+        cache.put('k1', self.artifact('a', 10))
+        os.remove(os.path.join(self.cache_path, 'k1'))
+
+        self.assertIsNone(cache.open('k1'))
+        self.assertFalse(cache.contains('k1'))
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
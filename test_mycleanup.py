@@ -1,18 +1,27 @@
 import unittest
+from unittest import mock
 
 from mycleanup import (
+    delete_keys_in_batches,
     get_all_matching_keys,
+    iter_batches,
     is_matching_versioned_pattern,
     )
 
 import mycleanup
 
-from mydeploy import S3Util
+from mydeploy import (
+    Manifest,
+    S3Util,
+    )
 
 import boto
 from contextlib import redirect_stdout
 import io
 import moto
+import os
+import shutil
+import tempfile
 
 
 exists = S3Util.file_exists_in_s3_bucket
@@ -81,6 +90,90 @@ class GetMatchingKeysIntegrationTest(unittest.TestCase):
         self.assertIn('prefix3/d/file6-' + VALID_VERSION + '.png', result3[0].key)
 
 
+class BatchesTest(unittest.TestCase):
+
+    def test_batches_should_split_any_iterable_in_order(self):
+        self.assertEqual(list(iter_batches(iter('abcde'), 2)), [['a', 'b'], ['c', 'd'], ['e']])
+
+    def test_empty_iterable_should_give_no_batch(self):
+        self.assertEqual(list(iter_batches([], 2)), [])
+
+
+class BatchedDeleteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(setattr, mycleanup, 'DELETE_BATCH_SIZE', mycleanup.DELETE_BATCH_SIZE)
+        mycleanup.DELETE_BATCH_SIZE = 2
+        self.bucket = boto.s3.bucket.Bucket(name='mybucket567')
+
+    def result(self, deleted=(), errors=()):
+        result = boto.s3.multidelete.MultiDeleteResult()
+        result.deleted = [boto.s3.multidelete.Deleted(key=key) for key in deleted]
+        result.errors = [boto.s3.multidelete.Error(key=key, code='AccessDenied', message='Access Denied')
+                         for key in errors]
+        return result
+
+    def execute(self, keys, manifest=None):
+        out = io.StringIO()
+
+        with redirect_stdout(out):
+            delete_keys_in_batches(self.bucket, keys, manifest)
+
+        return out.getvalue()
+
+    @mock.patch('mycleanup.S3Util.delete_keys')
+    def test_keys_should_be_deleted_in_batches_of_configured_size(self, mock_delete):
+        mock_delete.side_effect = lambda bucket, batch: self.result(deleted=batch)
+
+        output = self.execute(['a', 'b', 'c', 'd', 'e'])
+
+        self.assertEqual(sorted(call[0][1] for call in mock_delete.call_args_list),
+                         [['a', 'b'], ['c', 'd'], ['e']])
+
+        for key in ['a', 'b', 'c', 'd', 'e']:
+            self.assertIn('Deleted http://mybucket567.s3.amazonaws.com/' + key, output)
+
+    @mock.patch('mycleanup.S3Util.delete_keys')
+    def test_per_key_errors_should_be_reported_and_kept_in_manifest(self, mock_delete):
+        mock_delete.return_value = self.result(deleted=['a'], errors=['b'])
+
+        manifest = Manifest(self.bucket, 'manifest.json')
+        manifest.entries = {'a': {}, 'b': {}}
+
+        output = self.execute(['a', 'b'], manifest)
+
+        self.assertIn('Deleted http://mybucket567.s3.amazonaws.com/a', output)
+        self.assertIn('Failed deletion of http://mybucket567.s3.amazonaws.com/b: AccessDenied Access Denied', output)
+        self.assertEqual(manifest.entries, {'b': {}})
+
+    @mock.patch('mycleanup.S3Util.delete_keys')
+    def test_keys_should_be_consumed_lazily_with_bounded_batches_in_flight(self, mock_delete):
+        self.addCleanup(setattr, mycleanup, 'DELETE_CONCURRENCY', mycleanup.DELETE_CONCURRENCY)
+        mycleanup.DELETE_CONCURRENCY = 1
+        consumed = []
+
+        def keys():
+            for index in range(10):
+                consumed.append(index)
+                yield str(index)
+
+        def check_in_flight(bucket, batch):
+            sent = mycleanup.DELETE_BATCH_SIZE * mock_delete.call_count
+            ahead = mycleanup.DELETE_BATCH_SIZE * (mycleanup.DELETE_CONCURRENCY + 1)
+            self.assertLessEqual(len(consumed) - sent, ahead)
+            return self.result(deleted=batch)
+
+        mock_delete.side_effect = check_in_flight
+        self.execute(keys())
+
+        self.assertEqual(mock_delete.call_count, 5)
+
+    @mock.patch('mycleanup.S3Util.delete_keys')
+    def test_no_keys_should_send_no_request(self, mock_delete):
+        self.execute([])
+        self.assertFalse(mock_delete.called)
+
+
 class CleanupMainIntegrationTest(unittest.TestCase):
 
     def setUp(self):
@@ -101,11 +194,11 @@ class CleanupMainIntegrationTest(unittest.TestCase):
         self.bucket_js = connection.create_bucket(mycleanup.JS_BUCKET)
         self.bucket_image = connection.create_bucket(mycleanup.IMAGE_BUCKET)
 
-    def execute(self):
+    def execute(self, dry_run_path=None):
         out = io.StringIO()
 
         with redirect_stdout(out):
-            mycleanup.cleanup_main()
+            mycleanup.cleanup_main(dry_run_path)
 
         return out.getvalue()
 
@@ -175,3 +268,100 @@ class CleanupMainIntegrationTest(unittest.TestCase):
             self.assertIn(line, output)
 
         self.assertTrue(exists('css/to_persist_cleanup-' + VALID_VERSION + '.css', self.bucket_css))
+
+    @moto.mock_s3
+    def test_end_to_end_cleanup_should_keep_brotli_variants_of_files_indexed_in_xml(self):
+
+        self.initialise_buckets()
+
+        upload('fixtures/end_to_end/css/to_persist_cleanup.css', 'css/to_persist_cleanup-' + VALID_VERSION + '.css.br', 'css', self.bucket_css, 'br')
+        upload('fixtures/end_to_end/css/common.css', 'css/common-' + VALID_VERSION + '.css.br', 'css', self.bucket_css, 'br')
+
+        self.execute()
+
+        self.assertTrue(exists('css/to_persist_cleanup-' + VALID_VERSION + '.css.br', self.bucket_css))
+        self.assertFalse(exists('css/common-' + VALID_VERSION + '.css.br', self.bucket_css))
+
+    @moto.mock_s3
+    def test_end_to_end_cleanup_with_manifest_of_indexed_folders_should_list_the_other_folders_once(self):
+
+        self.initialise_buckets()
+        mycleanup.MANIFEST_KEY = 'deploy-manifest.json'
+        self.addCleanup(setattr, mycleanup, 'MANIFEST_KEY', '')
+
+        upload('fixtures/end_to_end/css/common.css', 'css/shop/common-' + VALID_VERSION + '.css', 'css', self.bucket_css)
+        upload('fixtures/end_to_end/css/common.css', 'css/legacy/old-' + VALID_VERSION + '.css', 'css', self.bucket_css)
+
+        manifest = Manifest(self.bucket_css, 'deploy-manifest.json')
+        with redirect_stdout(io.StringIO()):
+            manifest.bootstrap(['css/shop/'])
+            manifest.save()
+
+        output = self.execute()
+
+        self.assertIn('Deleted http://myrandombucket-0001.s3.amazonaws.com/css/legacy/old-' + VALID_VERSION + '.css', output)
+        self.assertFalse(exists('css/legacy/old-' + VALID_VERSION + '.css', self.bucket_css))
+
+        with redirect_stdout(io.StringIO()):
+            manifest.load()
+        self.assertTrue(manifest.covers('css/'))
+
+        with mock.patch('mycleanup.S3Util.list_key_entries', return_value=iter([])) as mock_list:
+            self.execute()
+
+        listed = [args[0].name for args, _ in mock_list.call_args_list]
+        self.assertNotIn(mycleanup.CSS_BUCKET, listed)
+
+    @moto.mock_s3
+    def test_end_to_end_dry_run_should_write_plan_without_deleting(self):
+
+        self.initialise_buckets()
+
+        upload('fixtures/end_to_end/css/common.css', 'css/common-' + VALID_VERSION + '.css', 'css', self.bucket_css)
+        upload('fixtures/end_to_end/css/to_persist_cleanup.css', 'css/to_persist_cleanup-' + VALID_VERSION + '.css', 'css', self.bucket_css)
+        upload('fixtures/end_to_end/images/image001.png', 'images/image001-' + VALID_VERSION + '.png', 'image', self.bucket_image)
+
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        plan_path = os.path.join(folder, 'plan.txt')
+
+        output = self.execute(dry_run_path=plan_path)
+
+        with open(plan_path) as f:
+            self.assertEqual(f.read().splitlines(), [
+                'http://myrandombucket-0001.s3.amazonaws.com/css/common-' + VALID_VERSION + '.css',
+                'http://myrandombucket-0003.s3.amazonaws.com/images/image001-' + VALID_VERSION + '.png'])
+
+        self.assertNotIn('Deleted', output)
+        self.assertTrue(exists('css/common-' + VALID_VERSION + '.css', self.bucket_css))
+        self.assertTrue(exists('images/image001-' + VALID_VERSION + '.png', self.bucket_image))
+
+    @moto.mock_s3
+    def test_end_to_end_cleanup_with_manifest_should_delete_manifest_keys_and_update_it(self):
+
+        self.initialise_buckets()
+        mycleanup.MANIFEST_KEY = 'deploy-manifest.json'
+        self.addCleanup(setattr, mycleanup, 'MANIFEST_KEY', '')
+
+        upload('fixtures/end_to_end/css/common.css', 'css/common-' + VALID_VERSION + '.css', 'css', self.bucket_css)
+        upload('fixtures/end_to_end/css/common.css', 'css/unlisted-' + VALID_VERSION + '.css', 'css', self.bucket_css)
+        upload('fixtures/end_to_end/css/to_persist_cleanup.css', 'css/to_persist_cleanup-' + VALID_VERSION + '.css', 'css', self.bucket_css)
+
+        manifest = Manifest(self.bucket_css, 'deploy-manifest.json')
+        manifest.entries = {}
+        manifest.prefixes = ['']
+        manifest.add('css/common-' + VALID_VERSION + '.css', None, 1)
+        manifest.add('css/to_persist_cleanup-' + VALID_VERSION + '.css', None, 1)
+        with redirect_stdout(io.StringIO()):
+            manifest.save()
+
+        output = self.execute()
+
+        self.assertIn('Deleted http://myrandombucket-0001.s3.amazonaws.com/css/common-' + VALID_VERSION + '.css', output)
+        self.assertFalse(exists('css/common-' + VALID_VERSION + '.css', self.bucket_css))
+        self.assertTrue(exists('css/unlisted-' + VALID_VERSION + '.css', self.bucket_css))
+        self.assertTrue(exists('css/to_persist_cleanup-' + VALID_VERSION + '.css', self.bucket_css))
+
+        with redirect_stdout(io.StringIO()):
+            manifest.load()
+        self.assertEqual(list(manifest.entries), ['css/to_persist_cleanup-' + VALID_VERSION + '.css'])
@@ -1,20 +1,39 @@
 import unittest
 from unittest import mock
 
+from mycache import ArtifactCache
+
 from mydeploy import (
+    ContentIndex,
+    get_listing_prefixes,
+    KeyIndex,
+    Manifest,
     Minifier,
+    MinifierBatch,
     S3Util,
     StaticFile,
     XMLParser,
     )
 
+import environment_config
 import mydeploy
 
 import boto
 from contextlib import redirect_stdout
 import io
+import json
+import gzip
 import moto
 import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 exists = S3Util.file_exists_in_s3_bucket
 upload = S3Util.upload_gzipped_file_to_bucket
@@ -35,6 +54,246 @@ class XMLTest(unittest.TestCase):
             expected_list)
 
 
+    def test_iter_entries_should_yield_entries_lazily(self):
+        entries = XMLParser.iter_entries('fixtures/fileVersion.xml')
+        self.assertEqual(next(entries), ('common.css', 'css', '1423532041'))
+        self.assertEqual(len(list(entries)), 3)
+
+    def test_iter_entries_should_release_processed_elements(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        path = os.path.join(folder, 'big.xml')
+
+        with open(path, 'w') as f:
+            f.write('<staticFiles>')
+            for index in range(5000):
+                f.write('<file url="f' + str(index) + '.css"><fileType>css</fileType>'
+                        '<fileVersion>' + VALID_VERSION + '</fileVersion></file>')
+            f.write('</staticFiles>')
+
+        roots = []
+        original = mydeploy.ET.iterparse
+
+        def iterparse(*args, **kwargs):
+            for event, element in original(*args, **kwargs):
+                if not roots:
+                    roots.append(element)
+                yield event, element
+
+        with mock.patch('mydeploy.ET.iterparse', side_effect=iterparse):
+            for count, entry in enumerate(XMLParser.iter_entries(path), 1):
+                # only the elements of the chunk being parsed are held
+                self.assertLess(len(roots[0]), 1000)
+
+        self.assertEqual(count, 5000)
+
+
+class IndexValidationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.path = os.path.join(self.folder, 'index.xml')
+
+        with open(self.path, 'w') as f:
+            f.write('<staticFiles>'
+                    '<file url="valid.css"><fileType>css</fileType><fileVersion>' + VALID_VERSION + '</fileVersion></file>'
+                    '<file url="short.js"><fileType>js</fileType><fileVersion>1234</fileVersion></file>'
+                    '<file url="font.woff"><fileType>font</fileType><fileVersion>' + VALID_VERSION + '</fileVersion></file>'
+                    '<file url="doc.pdf"><fileType>image</fileType><fileVersion>' + VALID_VERSION + '</fileVersion></file>'
+                    '</staticFiles>')
+
+        self.connection_pools = {'css_bucket': '', 'js_bucket': '', 'image_bucket': ''}
+
+    def execute(self, validate):
+        out = io.StringIO()
+
+        with redirect_stdout(out):
+            items = list(mydeploy.iter_file_objects(self.connection_pools, self.path, validate))
+
+        return [item.url for item in items], out.getvalue()
+
+    def test_unknown_types_and_extensions_should_be_skipped(self):
+        urls, output = self.execute(validate=False)
+
+        self.assertEqual(urls, ['valid.css', 'short.js'])
+        self.assertIn('Skipping processing of font.woff, unknown file type font', output)
+        self.assertIn('Skipping processing of doc.pdf, unsupported file extension', output)
+
+    def test_validation_should_skip_versions_not_equal_to_twelve_digits(self):
+        urls, output = self.execute(validate=True)
+
+        self.assertEqual(urls, ['valid.css'])
+        self.assertIn('Skipping processing of scripts/short-1234.js, version does not equal 12 digits', output)
+
+
+def write_bundle_index(folder, versions, bundles):
+    path = os.path.join(folder, 'index.xml')
+
+    with open(path, 'w') as f:
+        f.write('<staticFiles>')
+
+        for url, version in versions:
+            type_ = 'css' if url.endswith('.css') else 'js'
+            f.write('<file url="' + url + '"><fileType>' + type_ + '</fileType>'
+                    '<fileVersion>' + version + '</fileVersion></file>')
+
+        for url, type_, members in bundles:
+            f.write('<bundle url="' + url + '"><fileType>' + type_ + '</fileType>' +
+                    ''.join('<member url="' + member + '"/>' for member in members) +
+                    '</bundle>')
+
+        f.write('</staticFiles>')
+
+    return path
+
+
+@mock.patch('mydeploy.JS_MINIFIER', 'python')
+@mock.patch('mydeploy.CSS_MINIFIER', 'python')
+class BundleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.connection_pools = {'css_bucket': '', 'js_bucket': '', 'image_bucket': ''}
+
+        for path, content in [('scripts/a.js', 'var a = 1\n'), ('scripts/lib/b.js', '(function () {})()\n'),
+                              ('css/c.css', '.c { top: 0; }\n')]:
+            os.makedirs(os.path.join(self.folder, os.path.dirname(path)), exist_ok=True)
+
+            with open(os.path.join(self.folder, path), 'w') as f:
+                f.write(content)
+
+    def parse(self, versions, bundles):
+        path = write_bundle_index(self.folder, versions, bundles)
+        out = io.StringIO()
+
+        with mock.patch('mydeploy.PREFIX_PATH', self.folder + '/'):
+            with redirect_stdout(out):
+                items = list(mydeploy.iter_file_objects(self.connection_pools, path, validate=True))
+
+        return items, out.getvalue()
+
+    def test_bundle_should_follow_indexed_files_with_members_in_order(self):
+        items, _ = self.parse([('a.js', VALID_VERSION), ('lib/b.js', VALID_VERSION)],
+                              [('all.js', 'js', ['lib/b.js', 'a.js'])])
+        bundle = items[-1]
+
+        self.assertEqual(len(items), 3)
+        self.assertIsInstance(bundle, mydeploy.Bundle)
+        self.assertEqual([member.url for member in bundle.members], ['lib/b.js', 'a.js'])
+        self.assertEqual(len(bundle.version), 12)
+        self.assertEqual(bundle.versioned_path_in_bucket, 'scripts/all-' + bundle.version + '.js')
+
+    def test_bundle_version_should_change_with_member_versions_and_order(self):
+        def version(versions, members):
+            return self.parse(versions, [('all.js', 'js', members)])[0][-1].version
+
+        first = version([('a.js', VALID_VERSION), ('lib/b.js', VALID_VERSION)], ['a.js', 'lib/b.js'])
+
+        self.assertEqual(version([('a.js', VALID_VERSION), ('lib/b.js', VALID_VERSION)], ['a.js', 'lib/b.js']), first)
+        self.assertNotEqual(version([('a.js', '000000000013'), ('lib/b.js', VALID_VERSION)], ['a.js', 'lib/b.js']), first)
+        self.assertNotEqual(version([('a.js', VALID_VERSION), ('lib/b.js', VALID_VERSION)], ['lib/b.js', 'a.js']), first)
+
+    def test_invalid_bundles_should_be_skipped(self):
+        items, output = self.parse([('a.js', VALID_VERSION), ('lib/b.js', '1234'), ('c.css', VALID_VERSION)],
+                                   [('x.js', 'js', ['a.js', 'lib/b.js']), ('y.js', 'js', ['c.css']),
+                                    ('a.js', 'js', ['a.js']), ('z.png', 'image', ['a.js'])])
+
+        self.assertFalse(any(isinstance(item, mydeploy.Bundle) for item in items))
+        self.assertIn('Skipping bundle x.js, member lib/b.js is not a valid indexed js file', output)
+        self.assertIn('Skipping bundle y.js, member c.css is not a valid indexed js file', output)
+        self.assertIn('Skipping bundle a.js, an indexed file has the same url', output)
+        self.assertIn('Skipping bundle z.png, only css & js files can be bundled', output)
+
+    def test_bundles_should_be_built_outside_the_working_copy_and_not_over_each_other(self):
+        with open(os.path.join(self.folder, 'scripts', 'all.js'), 'w') as f:
+            f.write('var kept = 1\n')
+
+        items, output = self.parse([('a.js', VALID_VERSION), ('lib/b.js', VALID_VERSION)],
+                                   [('all.js', 'js', ['a.js']), ('twice.js', 'js', ['a.js']),
+                                    ('twice.js', 'js', ['lib/b.js'])])
+
+        self.assertEqual([item.url for item in items if isinstance(item, mydeploy.Bundle)],
+                         ['all.js', 'twice.js'])
+        self.assertIn('Skipping bundle twice.js, another bundle has the same url', output)
+
+        bundle = items[2]
+
+        with redirect_stdout(io.StringIO()):
+            bundle.build()
+
+        with gzip.open(bundle.versioned_path_in_filesystem, 'rb') as f:
+            self.assertEqual(f.read(), b'var a=1')
+
+        self.assertFalse(bundle.versioned_path_in_filesystem.startswith(self.folder))
+
+        with open(os.path.join(self.folder, 'scripts', 'all.js')) as f:
+            self.assertEqual(f.read(), 'var kept = 1\n')
+
+        bundle.close_artifacts()
+
+        self.assertFalse(os.path.exists(bundle.prefix_path))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.folder, 'scripts'))), ['a.js', 'all.js', 'lib'])
+
+    def test_build_should_minify_concatenated_members_once_and_remove_concatenation(self):
+        items, _ = self.parse([('a.js', VALID_VERSION), ('lib/b.js', VALID_VERSION)],
+                              [('bundles/all.js', 'js', ['a.js', 'lib/b.js'])])
+        bundle = items[-1]
+
+        with redirect_stdout(io.StringIO()):
+            bundle.build()
+
+        with gzip.open(bundle.versioned_path_in_filesystem, 'rb') as f:
+            self.assertEqual(f.read(), b'var a=1;(function(){})()')
+
+        self.assertFalse(os.path.exists(bundle.path_in_filesystem))
+
+    @moto.mock_s3
+    def test_deployed_bundle_should_be_uploaded_once_and_skipped_afterwards(self):
+        connection = boto.connect_s3('key', 'secret')
+
+        for name in ('bundle-css', 'bundle-js', 'bundle-image'):
+            connection.create_bucket(name)
+
+        path = write_bundle_index(self.folder, [('a.js', VALID_VERSION), ('lib/b.js', VALID_VERSION)],
+                                  [('all.js', 'js', ['a.js', 'lib/b.js'])])
+        outputs = []
+
+        with mock.patch.multiple('mydeploy', AWS_CONFIG_PATH='fixtures/end_to_end/boto2.cfg',
+                                 AWS_PROFILE='dev', CSS_BUCKET='bundle-css', JS_BUCKET='bundle-js',
+                                 IMAGE_BUCKET='bundle-image', PREFIX_PATH=self.folder + '/',
+                                 XML_PATH=path, UPLOAD_WORKERS=1):
+            for _ in range(2):
+                out = io.StringIO()
+
+                with redirect_stdout(out):
+                    mydeploy.deploy_main()
+
+                outputs.append(out.getvalue())
+
+        self.assertIn('Processed 3 files, 0 failed', outputs[0])
+        self.assertIn('Processed 0 files, 0 failed', outputs[1])
+
+        keys = [key.key for key in connection.get_bucket('bundle-js').list()]
+        bundle_key = [key for key in keys if key.startswith('scripts/all-')][0]
+        content = connection.get_bucket('bundle-js').get_key(bundle_key).get_contents_as_string()
+
+        self.assertEqual(gzip.decompress(content), b'var a=1;(function(){})()')
+
+
+class CompactStaticFileTest(unittest.TestCase):
+
+    def test_static_file_should_not_carry_an_instance_dict(self):
+        connection_pools = {'css_bucket': 'css bucket', 'js_bucket': '', 'image_bucket': ''}
+        item = StaticFile('prefix/', 'a.css', 'css', VALID_VERSION, connection_pools)
+
+        self.assertFalse(hasattr(item, '__dict__'))
+        self.assertEqual(item.path_in_filesystem, 'prefix/css/a.css')
+        self.assertEqual(item.versioned_path_in_bucket, 'css/a-' + VALID_VERSION + '.css')
+        self.assertEqual(item.associated_bucket, 'css bucket')
+
+
 class YUICompressorTest(unittest.TestCase):
 
     @mock.patch('subprocess.call')
@@ -56,6 +315,199 @@ class YUICompressorTest(unittest.TestCase):
         self.assertEqual(return_code, 1)
 
 
+class YUICompressorBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def factory(self, path, type_='css'):
+        connection_pools = {'css_bucket': '', 'js_bucket': '', 'image_bucket': ''}
+        item = StaticFile(self.folder + '/', path, type_, VALID_VERSION, connection_pools)
+        os.makedirs(os.path.dirname(item.path_in_filesystem), exist_ok=True)
+        with open(item.path_in_filesystem, 'w') as f:
+            f.write('a { color: red; }')
+        return item
+
+    @mock.patch('subprocess.call')
+    def test_compress_css_batch_should_call_yuicompressor_once_with_output_pattern(self, mock_subprocess):
+        Minifier.compress_css_batch(['a.css', 'b.css'], '.temp')
+        mock_subprocess.assert_called_once_with(
+            ['java', '-jar', 'yuicompressor-2.4.8.jar', 'a.css', 'b.css', '-o', '$:.temp'])
+
+    def test_assign_should_group_css_files_only_and_leave_single_files_alone(self):
+        items = [self.factory('1.css'), self.factory('2.js', 'js'), self.factory('3.css'),
+                 self.factory('4.css'), self.factory('5.css'), self.factory('6.css')]
+
+        batches = MinifierBatch.assign(items, 2)
+
+        self.assertEqual([batch.items for batch in batches],
+                         [[items[0], items[2]], [items[3], items[4]]])
+        self.assertIsNone(items[1].minifier_batch)
+        self.assertIsNone(items[5].minifier_batch)
+
+    @mock.patch('mydeploy.Minifier.compress_css')
+    @mock.patch('mydeploy.Minifier.compress_css_batch')
+    def test_batch_should_run_java_once_and_retry_missing_outputs_per_file(self, mock_batch, mock_single):
+
+        def compress_first_only(inputs, suffix):
+            shutil.copyfile(inputs[0], inputs[0] + suffix)
+
+        mock_batch.side_effect = compress_first_only
+
+        items = [self.factory('1.css'), self.factory('2.css')]
+        MinifierBatch.assign(items, 10)
+
+        out = io.StringIO()
+        with redirect_stdout(out):
+            for item in items:
+                item.minify()
+
+        mock_batch.assert_called_once_with([item.path_in_filesystem for item in items], '.temp')
+        mock_single.assert_called_once_with(items[1].path_in_filesystem, items[1].minified_path)
+
+
+class BuildCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.cache = ArtifactCache(os.path.join(self.folder, 'cache'), 1024 * 1024)
+
+        connection_pools = {'css_bucket': '', 'js_bucket': '', 'image_bucket': ''}
+        self.item = StaticFile(self.folder + '/', 'styles.css', 'css', VALID_VERSION, connection_pools)
+        os.makedirs(os.path.dirname(self.item.path_in_filesystem))
+        shutil.copyfile('fixtures/styles.css', self.item.path_in_filesystem)
+
+    def fake_minify(self, item):
+        item.minified_path = item.path_in_filesystem + '.temp'
+        shutil.copyfile(item.path_in_filesystem, item.minified_path)
+
+    def build(self):
+        with redirect_stdout(io.StringIO()):
+            self.item.build(self.cache)
+
+        with open(self.item.versioned_path_in_filesystem, 'rb') as f:
+            content = f.read()
+
+        os.remove(self.item.versioned_path_in_filesystem)
+        return content
+
+    def test_second_build_of_unchanged_file_should_skip_minify_and_gzip(self):
+        with mock.patch.object(StaticFile, 'minify', autospec=True, side_effect=self.fake_minify) as mock_minify:
+            first = self.build()
+            self.assertEqual(mock_minify.call_count, 1)
+
+            self.item.cache_key = None
+            second = self.build()
+            self.assertEqual(mock_minify.call_count, 1)
+
+        self.assertEqual(first, second)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_changed_source_should_miss_the_cache(self):
+        with mock.patch.object(StaticFile, 'minify', autospec=True, side_effect=self.fake_minify) as mock_minify:
+            self.build()
+
+            with open(self.item.path_in_filesystem, 'a') as f:
+                f.write('b { color: blue; }')
+
+            self.item.cache_key = None
+            self.build()
+            self.assertEqual(mock_minify.call_count, 2)
+
+
+def copy_to_stdout(input_):
+    return subprocess.Popen([sys.executable, '-c',
+                             'import shutil, sys; shutil.copyfileobj(open(sys.argv[1], "rb"), sys.stdout.buffer)',
+                             input_], stdout=subprocess.PIPE)
+
+
+class StreamingBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def factory(self, path, type_, source):
+        connection_pools = {'css_bucket': '', 'js_bucket': '', 'image_bucket': ''}
+        item = StaticFile(self.folder + '/', path, type_, VALID_VERSION, connection_pools)
+        os.makedirs(os.path.dirname(item.path_in_filesystem))
+        shutil.copyfile(source, item.path_in_filesystem)
+        return item
+
+    def build(self, item, cache=None):
+        with redirect_stdout(io.StringIO()):
+            item.build(cache, streaming=True)
+
+    @mock.patch('mydeploy.Minifier.open_css_stream', side_effect=copy_to_stdout)
+    def test_streaming_build_should_gzip_minifier_output_in_memory(self, mock_minifier):
+        item = self.factory('styles.css', 'css', 'fixtures/styles.css')
+        self.build(item)
+
+        item.artifact.seek(0)
+        with open('fixtures/styles.css', 'rb') as f:
+            self.assertEqual(gzip.GzipFile(fileobj=item.artifact, mode='rb').read(), f.read())
+
+        self.assertEqual(os.listdir(os.path.dirname(item.path_in_filesystem)), ['styles.css'])
+
+    @mock.patch('mydeploy.Minifier.open_js_stream', side_effect=copy_to_stdout)
+    def test_streaming_build_should_store_and_restore_from_cache(self, mock_minifier):
+        cache = ArtifactCache(os.path.join(self.folder, 'cache'), 1024 * 1024)
+        item = self.factory('cells.js', 'js', 'fixtures/cells.js')
+
+        self.build(item, cache)
+        item.artifact.seek(0)
+        first = item.artifact.read()
+        item.artifact.close()
+
+        self.build(item, cache)
+        self.assertEqual(item.artifact.read(), first)
+        item.artifact.close()
+
+        self.assertEqual(mock_minifier.call_count, 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    @unittest.skipIf(brotli is None, 'brotli is not installed')
+    @mock.patch('mydeploy.BROTLI', True)
+    @mock.patch('mydeploy.Minifier.open_css_stream', side_effect=copy_to_stdout)
+    def test_streaming_build_with_brotli_should_produce_both_variants_and_cache_them(self, mock_minifier):
+        cache = ArtifactCache(os.path.join(self.folder, 'cache'), 1024 * 1024)
+        item = self.factory('styles.css', 'css', 'fixtures/styles.css')
+
+        with open('fixtures/styles.css', 'rb') as f:
+            original = f.read()
+
+        for _ in range(2):
+            self.build(item, cache)
+            item.artifact.seek(0)
+            item.brotli_artifact.seek(0)
+            self.assertEqual(gzip.GzipFile(fileobj=item.artifact, mode='rb').read(), original)
+            self.assertEqual(brotli.decompress(item.brotli_artifact.read()), original)
+            item.close_artifacts()
+
+        self.assertEqual(mock_minifier.call_count, 1)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+    def test_failing_minifier_should_raise(self):
+        item = self.factory('styles.css', 'css', 'fixtures/styles.css')
+        failing = subprocess.Popen([sys.executable, '-c', 'import sys; sys.exit(2)'], stdout=subprocess.PIPE)
+
+        with mock.patch('mydeploy.Minifier.open_css_stream', return_value=failing):
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.build(item)
+
+        self.assertIsNone(item.artifact)
+
+    def test_streaming_build_of_image_should_leave_source_in_place(self):
+        item = self.factory('logo.png', 'image', 'fixtures/logo.png')
+        self.build(item)
+        item.artifact.close()
+
+        self.assertTrue(os.path.exists(item.path_in_filesystem))
+        self.assertFalse(os.path.exists(item.versioned_path_in_filesystem))
+
+
 class ClosureCompilerTest(unittest.TestCase):
 
     @mock.patch('subprocess.call')
@@ -77,6 +529,91 @@ class ClosureCompilerTest(unittest.TestCase):
         self.assertEqual(return_code, 1)
 
 
+class MinifierBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    @mock.patch('mydeploy.CSS_MINIFIER', 'python')
+    @mock.patch('subprocess.call')
+    def test_python_backend_should_minify_css_without_java(self, mock_subprocess):
+        output = os.path.join(self.folder, 'styles.css')
+
+        Minifier.minify_file('css', 'fixtures/styles.css', output)
+
+        self.assertFalse(mock_subprocess.called)
+        self.assertLess(os.path.getsize(output), os.path.getsize('fixtures/styles.css'))
+
+    @mock.patch('mydeploy.CSS_MINIFIER', 'python')
+    @mock.patch('subprocess.call')
+    def test_backend_should_be_selected_per_file_type(self, mock_subprocess):
+        Minifier.minify_file('js', 'fixtures/cells.js', 'output')
+
+        mock_subprocess.assert_called_with(
+            ['java', '-jar', 'compiler.jar', '--js', 'fixtures/cells.js', '--js_output_file', 'output'])
+
+    @mock.patch('mydeploy.JS_MINIFIER', 'python')
+    @mock.patch('subprocess.Popen')
+    def test_python_backend_should_stream_without_java(self, mock_popen):
+        artifact = io.BytesIO()
+
+        Minifier.minify_and_gzip_stream('fixtures/cells.js', 'js', artifact)
+
+        self.assertFalse(mock_popen.called)
+        artifact.seek(0)
+        self.assertIn(b'function', gzip.GzipFile(fileobj=artifact, mode='rb').read())
+
+    def test_backend_should_be_part_of_cache_identity(self):
+        java = Minifier.identity('css')
+
+        with mock.patch('mydeploy.CSS_MINIFIER', 'python'):
+            self.assertNotEqual(Minifier.identity('css'), java)
+
+    @mock.patch('mydeploy.CSS_MINIFIER', 'python')
+    def test_python_css_backend_should_not_batch_java_runs(self):
+        connection_pools = {'css_bucket': '', 'js_bucket': '', 'image_bucket': ''}
+        items = [StaticFile('prefix/', str(number) + '.css', 'css', VALID_VERSION, connection_pools)
+                 for number in range(3)]
+
+        self.assertEqual(MinifierBatch.assign(items, 50), [])
+        self.assertIsNone(items[0].minifier_batch)
+
+    @mock.patch('mydeploy.JS_MINIFIER', 'uglify')
+    def test_unknown_backend_should_raise(self):
+        with self.assertRaises(ValueError):
+            Minifier.backend('js')
+
+    @mock.patch('mydeploy.JS_MINIFIER', 'copy')
+    @mock.patch('subprocess.Popen')
+    def test_copy_backend_should_gzip_the_file_unminified(self, mock_popen):
+        artifact = io.BytesIO()
+
+        Minifier.minify_and_gzip_stream('fixtures/cells.js', 'js', artifact)
+
+        self.assertFalse(mock_popen.called)
+        artifact.seek(0)
+
+        with open('fixtures/cells.js', 'rb') as f:
+            self.assertEqual(gzip.GzipFile(fileobj=artifact, mode='rb').read(), f.read())
+
+
+class ConfiguredTest(unittest.TestCase):
+
+    def test_settings_should_apply_for_the_run_only(self):
+        with mydeploy.configured({'XML_PATH': 'other.xml', 'JS_MINIFIER': 'copy'}, mydeploy):
+            self.assertEqual(mydeploy.XML_PATH, 'other.xml')
+            self.assertEqual(Minifier.backend('js'), 'copy')
+
+        self.assertEqual(mydeploy.XML_PATH, environment_config.XML_PATH)
+        self.assertEqual(mydeploy.JS_MINIFIER, environment_config.JS_MINIFIER)
+
+    def test_unknown_setting_should_raise(self):
+        with self.assertRaises(ValueError):
+            with mydeploy.configured({'XML_PAHT': 'other.xml'}, mydeploy):
+                pass
+
+
 class GZipTest(unittest.TestCase):
 
     def test_gzip_file_should_produce_smaller_file_than_original(self):
@@ -95,6 +632,50 @@ class GZipTest(unittest.TestCase):
         os.remove(output_path)
         self.assertFalse(os.path.exists(output_path))
 
+    @unittest.skipIf(brotli is None, 'brotli is not installed')
+    def test_gzip_file_with_brotli_output_should_write_both_variants_in_one_pass(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        gzip_path = os.path.join(folder, 'styles.css.gz')
+        brotli_path = os.path.join(folder, 'styles.css.br')
+
+        Minifier.gzip_file('fixtures/styles.css', gzip_path, brotli_path)
+
+        with open('fixtures/styles.css', 'rb') as f:
+            original = f.read()
+
+        with gzip.open(gzip_path, 'rb') as f:
+            self.assertEqual(f.read(), original)
+
+        with open(brotli_path, 'rb') as f:
+            self.assertEqual(brotli.decompress(f.read()), original)
+
+
+    def test_gzip_file_should_be_byte_reproducible_without_name_or_mtime(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        first_path = os.path.join(folder, 'first.gz')
+        second_path = os.path.join(folder, 'second.gz')
+
+        Minifier.gzip_file('fixtures/styles.css', first_path)
+
+        with mock.patch('time.time', return_value=2000000000.0):
+            with mock.patch('mydeploy.GZIP_CHUNK_SIZE', 7):
+                Minifier.gzip_file('fixtures/styles.css', second_path)
+
+        with open(first_path, 'rb') as first, open(second_path, 'rb') as second:
+            content = first.read()
+            self.assertEqual(content, second.read())
+
+        # no FNAME flag, zero MTIME
+        self.assertEqual(content[3], 0)
+        self.assertEqual(content[4:8], b'\x00' * 4)
+        # cached entries gzipped with a name & mtime are not served
+        self.assertIn('mtime=0', Minifier.identity('css'))
+
+        with gzip.open(second_path, 'rb') as f, open('fixtures/styles.css', 'rb') as original:
+            self.assertEqual(f.read(), original.read())
+
 
 class VersionedPathTest(unittest.TestCase):
 
@@ -167,6 +748,39 @@ class ConnectToS3BucketTest(MotoBucketBaseTestClass):
         self.assertIsInstance(bucket_reconnect, boto.s3.bucket.Bucket)
         self.assertEqual(bucket_reconnect.name, 'mybucket567')
 
+    def test_buckets_should_share_one_connection_pool(self):
+        connection = boto.connect_s3('key', 'secret')
+        connection.create_bucket('mybucket568')
+        connection.create_bucket('mybucket569')
+
+        buckets = S3Util.create_connection_pools('fixtures/boto.cfg', 'testing',
+                                                 'mybucket567', 'mybucket568', 'mybucket569')
+        pool = buckets['css_bucket'].pool
+
+        self.assertIs(buckets['js_bucket'].pool, pool)
+        self.assertIs(buckets['image_bucket'].pool, pool)
+        self.assertEqual(buckets['image_bucket'].name, 'mybucket569')
+        self.assertEqual(pool.stats(), {'opened': 0, 'reused': 0, 'idle': 0, 'in_use': 0})
+
+        k = boto.s3.key.Key(self.bucket)
+        k.key = 'exists.txt'
+        k.set_contents_from_string('teststring')
+
+        self.assertTrue(S3Util.file_exists_in_s3_bucket('exists.txt', buckets['css_bucket']))
+        self.assertEqual(list(S3Util.list_keys(buckets['css_bucket'])), ['exists.txt'])
+        self.assertEqual(pool.stats()['opened'], 1)
+
+    def test_buckets_should_not_be_validated_before_first_use(self):
+        with mock.patch('boto.s3.connection.S3Connection.get_bucket') as mock_get_bucket:
+            buckets = S3Util.create_connection_pools('fixtures/boto.cfg', 'testing',
+                                                     'missing-css', 'missing-js', 'missing-image')
+
+        self.assertFalse(mock_get_bucket.called)
+        self.assertEqual(buckets['css_bucket'].name, 'missing-css')
+
+        with self.assertRaises(boto.exception.S3ResponseError):
+            list(S3Util.list_keys(buckets['css_bucket']))
+
 
 class S3FileCheckerTest(MotoBucketBaseTestClass):
 
@@ -191,6 +805,19 @@ class UploadFileToS3Test(MotoBucketBaseTestClass):
         result = exists('styles.css', self.bucket)
         self.assertTrue(result)
 
+    def test_upload_checking_remote_should_skip_content_already_deployed(self):
+        upload('fixtures/styles_gzipped.css', 'styles.css', 'css', self.bucket)
+
+        with mock.patch('mydeploy.S3Util.put_file') as mock_put_file:
+            with redirect_stdout(io.StringIO()) as out:
+                upload('fixtures/styles_gzipped.css', 'styles.css', 'css', self.bucket, check_remote=True)
+                upload('fixtures/cells_gzipped.js', 'styles.css', 'css', self.bucket, check_remote=True)
+                upload('fixtures/cells_gzipped.js', 'cells.js', 'js', self.bucket, check_remote=True)
+
+        self.assertEqual(out.getvalue().count('skipped'), 1)
+        self.assertIn('skipped styles.css, ', out.getvalue())
+        self.assertEqual(mock_put_file.call_count, 2)
+
     def test_upload_css_to_s3_should_append_correct_headers(self):
         upload('fixtures/styles_gzipped.css', 'styles.css', 'css', self.bucket)
 
@@ -213,6 +840,39 @@ class UploadFileToS3Test(MotoBucketBaseTestClass):
         k = self.bucket.get_key('logo.png')
         self.assertEqual(k.cache_control, "max-age=31536000, no transform, public")
 
+    def test_upload_stream_to_s3_should_upload_from_current_content(self):
+        with open('fixtures/styles_gzipped.css', 'rb') as f:
+            expected = f.read()
+            f.read()
+            S3Util.upload_gzipped_stream_to_bucket(f, 'styles.css', 'css', self.bucket)
+
+        k = self.bucket.get_key('styles.css')
+        self.assertEqual(k.get_contents_as_string(), expected)
+        self.assertEqual(k.content_encoding, 'gzip')
+
+    @mock.patch('myretry.time.sleep')
+    def test_upload_throttled_by_s3_should_be_retried_from_the_start(self, mock_sleep):
+        original = boto.s3.key.Key.set_contents_from_file
+        calls = []
+
+        def throttle_once(key, fp, **kwargs):
+            calls.append(key.key)
+            if len(calls) == 1:
+                fp.read(10)
+                raise boto.exception.S3ResponseError(503, 'Slow Down')
+            return original(key, fp, **kwargs)
+
+        with mock.patch('boto.s3.key.Key.set_contents_from_file', autospec=True,
+                        side_effect=throttle_once):
+            with redirect_stdout(io.StringIO()):
+                upload('fixtures/styles_gzipped.css', 'styles.css', 'css', self.bucket)
+
+        with open('fixtures/styles_gzipped.css', 'rb') as f:
+            self.assertEqual(self.bucket.get_key('styles.css').get_contents_as_string(), f.read())
+
+        self.assertEqual(calls, ['styles.css', 'styles.css'])
+        self.assertEqual(mock_sleep.call_count, 1)
+
     @unittest.skip('acl not implemented in moto yet, exception if executed')
     def test_upload_to_s3_should_set_public_read_acl(self):
         upload('fixtures/cells_gzipped.js', 'cells.js', 'js', self.bucket)
@@ -223,6 +883,253 @@ class UploadFileToS3Test(MotoBucketBaseTestClass):
         self.assertEqual(policy.acl.grants[1].permission, 'READ')
 
 
+class ListingPrefixesTest(unittest.TestCase):
+
+    def test_prefixes_should_be_the_folders_of_the_paths(self):
+        paths = ['css/a-1.css', 'scripts/b-1.js']
+        self.assertEqual(get_listing_prefixes(paths), ['css/', 'scripts/'])
+
+    def test_nested_folders_should_be_covered_by_their_parent_folder(self):
+        paths = ['css/a-1.css', 'css/path/to/b-1.css', 'css2/c-1.css']
+        self.assertEqual(get_listing_prefixes(paths), ['css/', 'css2/'])
+
+    def test_path_at_bucket_root_should_list_the_whole_bucket(self):
+        paths = ['css/a-1.css', 'b-1.css']
+        self.assertEqual(get_listing_prefixes(paths), [''])
+
+
+def upload_with_index(bucket, path, content_index):
+    with redirect_stdout(io.StringIO()) as out:
+        uploaded = upload('fixtures/styles_gzipped.css', path, 'css', bucket, content_index=content_index)
+
+    return uploaded, out.getvalue()
+
+
+class DeduplicationTest(MotoBucketBaseTestClass):
+
+    def test_identical_content_should_be_copied_instead_of_uploaded(self):
+        content_index = ContentIndex()
+        first, _ = upload_with_index(self.bucket, 'css/a-000000000011.css', content_index)
+
+        with mock.patch('boto.s3.key.Key.set_contents_from_file') as mock_upload:
+            second, output = upload_with_index(self.bucket, 'css/b-' + VALID_VERSION + '.css', content_index)
+
+        self.assertFalse(mock_upload.called)
+        self.assertEqual(first, second)
+        self.assertIn('copied css/a-000000000011.css -> css/b-' + VALID_VERSION + '.css', output)
+
+        k = self.bucket.get_key('css/b-' + VALID_VERSION + '.css')
+        self.assertEqual(k.content_encoding, 'gzip')
+        self.assertEqual(k.cache_control, 'max-age=31536000')
+
+        with open('fixtures/styles_gzipped.css', 'rb') as f:
+            self.assertEqual(k.get_contents_as_string(), f.read())
+
+    def test_missing_identical_object_should_fall_back_to_upload(self):
+        content_index = ContentIndex()
+        (md5, _), _ = upload_with_index(self.bucket, 'css/a-000000000011.css', content_index)
+        self.bucket.delete_key('css/a-000000000011.css')
+
+        _, output = upload_with_index(self.bucket, 'css/b-' + VALID_VERSION + '.css', content_index)
+
+        self.assertIn('no longer exists', output)
+        self.assertTrue(exists('css/b-' + VALID_VERSION + '.css', self.bucket))
+        self.assertEqual(content_index.find(self.bucket.name, md5), 'css/b-' + VALID_VERSION + '.css')
+
+    def test_index_should_only_map_versioned_keys_with_content_md5(self):
+        manifest = Manifest(self.bucket, 'deploy-manifest.json')
+        manifest.entries = {'css/a-' + VALID_VERSION + '.css': {'md5': 'aaa', 'size': 1},
+                            'css/big-' + VALID_VERSION + '.css': {'md5': None, 'size': 1}}
+
+        content_index = ContentIndex({self.bucket.name: manifest})
+        content_index.add(self.bucket.name, 'bbb-2', 'css/multipart-' + VALID_VERSION + '.css')
+        content_index.add(self.bucket.name, 'ccc', 'deploy-manifest.json')
+
+        self.assertEqual(content_index.keys, {(self.bucket.name, 'aaa'): 'css/a-' + VALID_VERSION + '.css'})
+
+
+class KeyIndexTest(MotoBucketBaseTestClass):
+
+    def factory(self, path):
+        connection_pools = {'css_bucket': self.bucket, 'js_bucket': self.bucket, 'image_bucket': self.bucket}
+        return StaticFile('', path, 'css', VALID_VERSION, connection_pools)
+
+    def test_bulk_index_should_answer_existence_without_per_file_requests(self):
+        upload('fixtures/styles_gzipped.css', 'css/exists-' + VALID_VERSION + '.css', 'css', self.bucket)
+        upload('fixtures/styles_gzipped.css', 'logs/other-' + VALID_VERSION + '.css', 'css', self.bucket)
+
+        items = [self.factory('exists.css'), self.factory('missing.css')]
+        key_index = KeyIndex(items, threshold=1)
+
+        self.assertEqual(key_index.keys[self.bucket.name], {'css/exists-' + VALID_VERSION + '.css'})
+
+        with mock.patch('mydeploy.S3Util.file_exists_in_s3_bucket') as mock_exists:
+            self.assertTrue(items[0].exists_in_bucket(key_index))
+            self.assertFalse(items[1].exists_in_bucket(key_index))
+            self.assertFalse(mock_exists.called)
+
+    def test_bulk_index_should_map_listed_content_for_deduplication(self):
+        md5, _ = upload('fixtures/styles_gzipped.css', 'css/exists-' + VALID_VERSION + '.css', 'css', self.bucket)
+        content_index = ContentIndex()
+
+        with redirect_stdout(io.StringIO()):
+            KeyIndex([self.factory('exists.css')], threshold=1, content_index=content_index)
+
+        self.assertEqual(content_index.find(self.bucket.name, md5), 'css/exists-' + VALID_VERSION + '.css')
+
+    def test_small_index_should_fall_back_to_per_file_requests(self):
+        upload('fixtures/styles_gzipped.css', 'css/exists-' + VALID_VERSION + '.css', 'css', self.bucket)
+
+        items = [self.factory('exists.css'), self.factory('missing.css')]
+        key_index = KeyIndex(items, threshold=3)
+
+        self.assertEqual(key_index.keys, {})
+        self.assertIsNone(key_index.contains(items[0]))
+
+        self.assertTrue(items[0].exists_in_bucket(key_index))
+        self.assertFalse(items[1].exists_in_bucket(key_index))
+
+
+class MultipartUploadTest(MotoBucketBaseTestClass):
+
+    def setUp(self):
+        super().setUp()
+
+        for name, value in [('MULTIPART_THRESHOLD', 6 * 1024 * 1024),
+                            ('MULTIPART_PART_SIZE', 5 * 1024 * 1024),
+                            ('MULTIPART_CONCURRENCY', 1),
+                            ('MULTIPART_RETRIES', 2)]:
+            self.addCleanup(setattr, mydeploy, name, getattr(mydeploy, name))
+            setattr(mydeploy, name, value)
+
+        self.content = os.urandom(256) * (48 * 1024)
+        self.source = io.BytesIO(self.content)
+
+    def upload(self):
+        with redirect_stdout(io.StringIO()):
+            S3Util.upload_gzipped_stream_to_bucket(self.source, 'big.js', 'js', self.bucket)
+
+    def test_file_above_threshold_should_be_uploaded_in_parts(self):
+        with mock.patch('boto.s3.multipart.MultiPartUpload.upload_part_from_file',
+                        autospec=True,
+                        side_effect=boto.s3.multipart.MultiPartUpload.upload_part_from_file) as mock_part:
+            self.upload()
+
+        self.assertEqual(mock_part.call_count, 3)
+
+        k = self.bucket.get_key('big.js')
+        self.assertEqual(k.get_contents_as_string(), self.content)
+        self.assertEqual(k.content_encoding, 'gzip')
+
+    def test_parts_to_pooled_bucket_should_each_check_out_a_connection(self):
+        pooled = S3Util.create_connection_pools('fixtures/boto.cfg', 'testing',
+                                                'mybucket567', 'mybucket567', 'mybucket567')['js_bucket']
+
+        with mock.patch.object(pooled.pool, 'checkout', wraps=pooled.pool.checkout) as mock_checkout:
+            with redirect_stdout(io.StringIO()):
+                S3Util.upload_gzipped_stream_to_bucket(self.source, 'big.js', 'js', pooled)
+
+        # initiate, 3 parts & complete
+        self.assertEqual(mock_checkout.call_count, 5)
+        self.assertEqual(pooled.pool.stats()['in_use'], 0)
+        self.assertEqual(self.bucket.get_key('big.js').get_contents_as_string(), self.content)
+
+    def test_failed_part_should_be_retried(self):
+        original = boto.s3.multipart.MultiPartUpload.upload_part_from_file
+        calls = []
+
+        def fail_once(upload, fp, part_num):
+            calls.append(part_num)
+            if calls.count(part_num) == 1 and part_num == 2:
+                raise IOError('connection reset')
+            return original(upload, fp, part_num)
+
+        with mock.patch('boto.s3.multipart.MultiPartUpload.upload_part_from_file',
+                        autospec=True, side_effect=fail_once):
+            self.upload()
+
+        self.assertEqual(calls, [1, 2, 2, 3])
+        self.assertEqual(self.bucket.get_key('big.js').get_contents_as_string(), self.content)
+
+    def test_upload_should_be_aborted_when_part_keeps_failing(self):
+        with mock.patch('boto.s3.multipart.MultiPartUpload.upload_part_from_file',
+                        side_effect=IOError('connection reset')):
+            with mock.patch('boto.s3.multipart.MultiPartUpload.cancel_upload') as mock_cancel:
+                with self.assertRaises(IOError):
+                    self.upload()
+
+        self.assertTrue(mock_cancel.called)
+        self.assertIsNone(self.bucket.get_key('big.js'))
+
+    def test_failed_initiate_and_complete_should_be_retried(self):
+        for name in ('initiate_multipart_upload', 'complete_multipart_upload'):
+            original = getattr(boto.s3.bucket.Bucket, name)
+            failures = [ConnectionResetError()]
+
+            def fail_once(*args, **kwargs):
+                if failures:
+                    raise failures.pop()
+                return original(*args, **kwargs)
+
+            with mock.patch.object(boto.s3.bucket.Bucket, name, autospec=True, side_effect=fail_once), \
+                    mock.patch('myretry.get_delay', return_value=0):
+                self.upload()
+
+            self.assertEqual(failures, [])
+            self.assertEqual(self.bucket.get_key('big.js').get_contents_as_string(), self.content)
+
+    @mock.patch('mydeploy.MULTIPART_PART_SIZE', 1024 * 1024)
+    def test_part_size_below_the_s3_minimum_should_be_rejected_at_startup(self):
+        with self.assertRaises(ValueError):
+            mydeploy.check_settings()
+
+
+class ManifestTest(MotoBucketBaseTestClass):
+
+    def test_load_of_missing_manifest_should_return_false(self):
+        manifest = Manifest(self.bucket, 'manifest.json')
+        self.assertFalse(manifest.load())
+        self.assertIsNone(manifest.entries)
+
+    def test_saved_manifest_should_load_back(self):
+        manifest = Manifest(self.bucket, 'manifest.json')
+        manifest.entries = {}
+        manifest.add('css/a-' + VALID_VERSION + '.css', 'abc', 10)
+
+        with redirect_stdout(io.StringIO()):
+            manifest.save()
+            reloaded = Manifest(self.bucket, 'manifest.json')
+            self.assertTrue(reloaded.load())
+
+        self.assertEqual(reloaded.entries, {'css/a-' + VALID_VERSION + '.css': {'md5': 'abc', 'size': 10}})
+
+    def test_bootstrap_should_record_versioned_keys_from_listing(self):
+        upload('fixtures/styles_gzipped.css', 'css/a-' + VALID_VERSION + '.css', 'css', self.bucket)
+        upload('fixtures/styles_gzipped.css', 'css/not-versioned.css', 'css', self.bucket)
+        upload('fixtures/styles_gzipped.css', 'other/b-' + VALID_VERSION + '.css', 'css', self.bucket)
+
+        manifest = Manifest(self.bucket, 'manifest.json')
+
+        with redirect_stdout(io.StringIO()):
+            manifest.bootstrap(['css/'])
+
+        entry = manifest.entries['css/a-' + VALID_VERSION + '.css']
+        self.assertEqual(list(manifest.entries), ['css/a-' + VALID_VERSION + '.css'])
+        self.assertEqual(entry['size'], os.path.getsize('fixtures/styles_gzipped.css'))
+        self.assertTrue(manifest.changed)
+
+    def test_remove_should_only_mark_changed_for_known_keys(self):
+        manifest = Manifest(self.bucket, 'manifest.json')
+        manifest.entries = {'a': {'md5': None, 'size': 1}}
+
+        manifest.remove('b')
+        self.assertFalse(manifest.changed)
+
+        manifest.remove('a')
+        self.assertTrue(manifest.changed)
+        self.assertEqual(manifest.entries, {})
+
+
 class StaticFileWrapperMethodsTest(unittest.TestCase):
 
     def factory(self, path='mypath', type_='css'):
@@ -287,15 +1194,21 @@ class DeploymentMainTest(unittest.TestCase):
         mydeploy.PREFIX_PATH = 'fixtures/end_to_end/'
         mydeploy.XML_PATH = 'fixtures/end_to_end/config/mydeploy.xml'
 
+        # moto's mocked sockets are not thread-safe, keep S3 calls serial
+        mydeploy.UPLOAD_WORKERS = 1
+        mydeploy.TARGET_CONCURRENCY = 1
+
     def tearDown(self):
 
         paths_to_cleanup = [
             'fixtures/end_to_end/css/common.css.temp',
             'fixtures/end_to_end/css/common.css.temp.gz',
             'fixtures/end_to_end/css/common-' + VALID_VERSION + '.css',
+            'fixtures/end_to_end/css/common-' + VALID_VERSION + '.css.br',
             'fixtures/end_to_end/scripts/apply.js.temp',
             'fixtures/end_to_end/scripts/apply.js.temp.gz',
             'fixtures/end_to_end/scripts/apply-' + VALID_VERSION + '.js',
+            'fixtures/end_to_end/scripts/apply-' + VALID_VERSION + '.js.br',
             'fixtures/end_to_end/scripts/notprocessed.js.temp',
             'fixtures/end_to_end/scripts/notprocessed.js.temp.gz',
             'fixtures/end_to_end/scripts/notprocessed-mispattern.js',
@@ -331,6 +1244,23 @@ class DeploymentMainTest(unittest.TestCase):
 
         return out.getvalue()
 
+    @moto.mock_s3
+    def test_end_to_end_deploy_should_parse_the_index_once_and_stream_files_in_batches(self):
+
+        self.initialise_buckets()
+
+        with mock.patch('mydeploy.CHECK_BATCH_SIZE', 1):
+            with mock.patch('mydeploy.XMLParser.iter_elements', wraps=mydeploy.XMLParser.iter_elements) as mock_parse:
+                with mock.patch('mydeploy.remove_existing', wraps=mydeploy.remove_existing) as mock_check:
+                    output = self.execute()
+
+        self.assertEqual(mock_parse.call_count, 1)
+        self.assertEqual([len(call[0][0]) for call in mock_check.call_args_list], [1, 1, 1])
+        self.assertIn('Processed 3 files, 0 failed', output)
+        self.assertTrue(exists('css/common-' + VALID_VERSION + '.css', self.bucket_css))
+        self.assertTrue(exists('scripts/apply-' + VALID_VERSION + '.js', self.bucket_js))
+        self.assertTrue(exists('images/image001-' + VALID_VERSION + '.png', self.bucket_image))
+
     @moto.mock_s3
     def test_end_to_end_deploy_should_process_and_upload_files_in_xml(self):
 
@@ -392,4 +1322,257 @@ class DeploymentMainTest(unittest.TestCase):
 
         self.assertFalse(exists('scripts/notprocessed-mispattern.js', self.bucket_js))
 
+    @moto.mock_s3
+    def test_end_to_end_with_manifest_should_skip_deployed_files_without_probing_bucket(self):
+
+        self.initialise_buckets()
+        mydeploy.MANIFEST_KEY = 'deploy-manifest.json'
+        self.addCleanup(setattr, mydeploy, 'MANIFEST_KEY', '')
+
+        upload('fixtures/end_to_end/css/common.css', 'css/common-' + VALID_VERSION + '.css', 'css', self.bucket_css)
+
+        output = self.execute()
+
+        self.assertNotIn('uploaded css/common-' + VALID_VERSION + '.css', output)
+        self.assertIn('uploaded scripts/apply-' + VALID_VERSION + '.js', output)
+
+        manifest = Manifest(self.bucket_js, 'deploy-manifest.json')
+        with redirect_stdout(io.StringIO()):
+            self.assertTrue(manifest.load())
+        self.assertIn('scripts/apply-' + VALID_VERSION + '.js', manifest.entries)
+
+        with mock.patch('mydeploy.S3Util.file_exists_in_s3_bucket') as mock_exists:
+            output = self.execute()
+
+        self.assertFalse(mock_exists.called)
+        self.assertIn('Processed 0 files, 0 failed', output)
+
+    @moto.mock_s3
+    def test_end_to_end_with_journal_should_resume_failed_deploy_without_probing_bucket(self):
+
+        self.initialise_buckets()
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        mydeploy.JOURNAL_PATH = os.path.join(folder, 'deploy.journal')
+        self.addCleanup(setattr, mydeploy, 'JOURNAL_PATH', '')
+
+        put_file = S3Util.put_file
+
+        def fail_scripts(source_file, md5, path, headers, bucket):
+            if path.startswith('scripts/'):
+                raise IOError('disk unplugged')
+            return put_file(source_file, md5, path, headers, bucket)
+
+        with mock.patch('mydeploy.S3Util.put_file', side_effect=fail_scripts):
+            output = self.execute()
+
+        self.assertIn('Processed 2 files, 1 failed', output)
+        self.assertTrue(os.path.exists(mydeploy.JOURNAL_PATH))
+
+        probed = []
+
+        def probe(path, bucket):
+            probed.append(path)
+            return exists(path, bucket)
+
+        with mock.patch('mydeploy.S3Util.file_exists_in_s3_bucket', side_effect=probe):
+            with mock.patch('mydeploy.Minifier') as mock_minifier:
+                output = self.execute()
+
+        self.assertIn('2 files already uploaded, 1 already built', output)
+        self.assertIn('Processed 1 files, 0 failed', output)
+        self.assertNotIn('uploaded css/common-' + VALID_VERSION + '.css', output)
+        self.assertEqual(probed, ['scripts/apply-' + VALID_VERSION + '.js'])
+        self.assertFalse(mock_minifier.minify_file.called)
+        self.assertTrue(exists('scripts/apply-' + VALID_VERSION + '.js', self.bucket_js))
+        self.assertFalse(os.path.exists(mydeploy.JOURNAL_PATH))
+
+    @moto.mock_s3
+    def test_end_to_end_should_report_stage_metrics(self):
+
+        self.initialise_buckets()
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        mydeploy.METRICS_PATH = folder
+        self.addCleanup(setattr, mydeploy, 'METRICS_PATH', '')
+
+        output = self.execute()
+
+        self.assertIn('Stage timings in seconds (p50 / p95 / p99)', output)
+        self.assertIn('Request limits per bucket', output)
+
+        with open(os.path.join(folder, 'mydeploy.json')) as f:
+            stages = json.load(f)['stages']
+
+        self.assertEqual(stages['upload']['calls'], 3)
+        self.assertEqual(stages['exists']['calls'], 3)
+        self.assertEqual(stages['gzip']['calls'], 2)
+        self.assertLess(stages['gzip']['ratio'], 1)
+
+    @moto.mock_s3
+    def test_end_to_end_with_image_optimisation_should_upload_smaller_image(self):
+
+        self.initialise_buckets()
+        mydeploy.IMAGE_OPTIMISATION = True
+        self.addCleanup(setattr, mydeploy, 'IMAGE_OPTIMISATION', False)
+        source = 'fixtures/end_to_end/images/image001.png'
+        versioned = 'fixtures/end_to_end/images/image001-' + VALID_VERSION + '.png'
+
+        try:
+            output = self.execute()
+        finally:
+            # the optimised copy is versioned, the source stays in place
+            if os.path.exists(source) and os.path.exists(versioned):
+                os.remove(versioned)
+
+        key = self.bucket_image.get_key('images/image001-' + VALID_VERSION + '.png')
+
+        self.assertLess(key.size, os.path.getsize(source))
+        self.assertIn('optimised ' + source + ': ' + str(os.path.getsize(source)) + ' -> ' + str(key.size), output)
+        self.assertIn('Images: 1 optimised, ', output)
+
+    @unittest.skipIf(brotli is None, 'brotli is not installed')
+    @moto.mock_s3
+    def test_end_to_end_with_brotli_should_upload_brotli_variants_of_css_and_js(self):
+
+        self.initialise_buckets()
+        mydeploy.BROTLI = True
+        mydeploy.MANIFEST_KEY = 'deploy-manifest.json'
+        self.addCleanup(setattr, mydeploy, 'BROTLI', False)
+        self.addCleanup(setattr, mydeploy, 'MANIFEST_KEY', '')
+
+        output = self.execute()
+
+        self.assertIn('% smaller than gzip', output)
+
+        key = self.bucket_css.get_key('css/common-' + VALID_VERSION + '.css.br')
+        self.assertEqual(key.content_encoding, 'br')
+        self.assertEqual(key.content_type, 'text/css')
+
+        with open('fixtures/end_to_end/css/common.css', 'rb') as f:
+            self.assertEqual(brotli.decompress(key.get_contents_as_string()), f.read())
+
+        self.assertTrue(exists('scripts/apply-' + VALID_VERSION + '.js.br', self.bucket_js))
+        self.assertFalse(exists('images/image001-' + VALID_VERSION + '.png.br', self.bucket_image))
+
+        manifest = Manifest(self.bucket_js, 'deploy-manifest.json')
+        with redirect_stdout(io.StringIO()):
+            manifest.load()
+        self.assertIn('scripts/apply-' + VALID_VERSION + '.js.br', manifest.entries)
+
+    @mock.patch.dict('sys.modules', {'brotli': None})
+    @mock.patch('mydeploy.BROTLI', True)
+    def test_brotli_without_brotli_package_should_fail_before_deploying(self):
+        with mock.patch('mydeploy.S3Util.create_connection_pools') as mock_connect:
+            with self.assertRaises(ImportError):
+                self.execute()
+
+        self.assertFalse(mock_connect.called)
+        # only imported by runs uploading brotli variants
+        self.assertFalse(hasattr(mydeploy, 'brotli'))
+
+    @moto.mock_s3
+    def test_end_to_end_streaming_should_upload_without_leaving_files_in_workspace(self):
+
+        self.initialise_buckets()
+        mydeploy.STREAMING = True
+        self.addCleanup(setattr, mydeploy, 'STREAMING', False)
+
+        self.execute()
+
+        self.assertTrue(exists('css/common-' + VALID_VERSION + '.css', self.bucket_css))
+        self.assertTrue(exists('scripts/apply-' + VALID_VERSION + '.js', self.bucket_js))
+        self.assertTrue(exists('images/image001-' + VALID_VERSION + '.png', self.bucket_image))
+
+        self.assertEqual(sorted(os.listdir('fixtures/end_to_end/css')), ['common.css', 'to_persist_cleanup.css'])
+        self.assertEqual(os.listdir('fixtures/end_to_end/scripts'), ['apply.js'])
+        self.assertEqual(os.listdir('fixtures/end_to_end/images'), ['image001.png'])
+
         self.assertFalse(os.path.exists('fixtures/end_to_end/scripts/notprocessed-mispattern.js'))
+
+    def initialise_target(self, name):
+        connection = boto.connect_s3('key', 'secret')
+
+        return [connection.create_bucket(name + '-' + type_) for type_ in ('css', 'js', 'image')]
+
+    @moto.mock_s3
+    def test_end_to_end_with_targets_should_build_once_and_upload_to_each_target_missing_files(self):
+
+        self.initialise_buckets()
+        eu_css, eu_js, eu_image = self.initialise_target('eu')
+        upload('fixtures/end_to_end/css/common.css', 'css/common-' + VALID_VERSION + '.css', 'css', eu_css)
+
+        targets = [{'name': 'us'},
+                   {'name': 'eu', 'css_bucket': 'eu-css', 'js_bucket': 'eu-js', 'image_bucket': 'eu-image'}]
+
+        with mock.patch('mydeploy.TARGETS', targets):
+            with mock.patch('mydeploy.Minifier.gzip_file', wraps=mydeploy.Minifier.gzip_file) as mock_gzip:
+                output = self.execute()
+
+        self.assertEqual(mock_gzip.call_count, 2)
+        self.assertEqual(output.count('uploaded css/common-' + VALID_VERSION + '.css'), 1)
+        self.assertIn('Target us: 3 uploaded, 0 failed', output)
+        self.assertIn('Target eu: 2 uploaded, 0 failed', output)
+
+        for bucket in (self.bucket_js, eu_js):
+            self.assertTrue(exists('scripts/apply-' + VALID_VERSION + '.js', bucket))
+
+        for bucket in (self.bucket_image, eu_image):
+            self.assertTrue(exists('images/image001-' + VALID_VERSION + '.png', bucket))
+
+    @moto.mock_s3
+    def test_end_to_end_with_targets_should_still_deploy_the_others_when_one_cannot_be_checked(self):
+
+        self.initialise_buckets()
+        eu_css, eu_js, eu_image = self.initialise_target('eu')
+
+        targets = [{'name': 'us'},
+                   {'name': 'eu', 'css_bucket': 'eu-css', 'js_bucket': 'eu-js', 'image_bucket': 'nope'}]
+
+        with mock.patch.multiple('mydeploy', TARGETS=targets, BULK_EXISTENCE_THRESHOLD=1):
+            out = io.StringIO()
+
+            with redirect_stdout(out):
+                failures = mydeploy.deploy_main()
+
+        output = out.getvalue()
+
+        self.assertTrue(failures)
+        self.assertIn('Failed checking target eu: ', output)
+        self.assertIn('Target us: 3 uploaded, 0 failed', output)
+        self.assertIn('Target eu: 0 uploaded, 1 failed', output)
+        self.assertTrue(exists('scripts/apply-' + VALID_VERSION + '.js', self.bucket_js))
+        self.assertFalse(exists('scripts/apply-' + VALID_VERSION + '.js', eu_js))
+
+    @moto.mock_s3
+    def test_end_to_end_streaming_with_targets_should_report_failures_per_target(self):
+
+        self.initialise_buckets()
+        eu_css, eu_js, eu_image = self.initialise_target('eu')
+        mydeploy.STREAMING = True
+        self.addCleanup(setattr, mydeploy, 'STREAMING', False)
+
+        put_file = S3Util.put_file
+
+        def fail_eu_scripts(source_file, md5, path, headers, bucket):
+            if bucket.name == 'eu-js':
+                raise IOError('region unreachable')
+            return put_file(source_file, md5, path, headers, bucket)
+
+        targets = [{'name': 'us'},
+                   {'name': 'eu', 'css_bucket': 'eu-css', 'js_bucket': 'eu-js', 'image_bucket': 'eu-image'}]
+
+        with mock.patch('mydeploy.TARGETS', targets):
+            with mock.patch('mydeploy.S3Util.put_file', side_effect=fail_eu_scripts):
+                output = self.execute()
+
+        self.assertIn('Failed upload of fixtures/end_to_end/scripts/apply.js to eu: OSError', output)
+        self.assertIn('Target us: 3 uploaded, 0 failed', output)
+        self.assertIn('Target eu: 2 uploaded, 1 failed', output)
+        self.assertIn('Processed 2 files, 1 failed', output)
+
+        self.assertTrue(exists('scripts/apply-' + VALID_VERSION + '.js', self.bucket_js))
+        self.assertFalse(exists('scripts/apply-' + VALID_VERSION + '.js', eu_js))
+
+        key = eu_css.get_key('css/common-' + VALID_VERSION + '.css')
+        self.assertEqual(key.get_contents_as_string(), self.bucket_css.get_key(key.key).get_contents_as_string())
@@ -0,0 +1,169 @@
+import unittest
+
+from mycache import ArtifactCache
+
+from myimages import (
+    ImageOptimiser,
+    iter_png_chunks,
+    make_png_chunk,
+    optimise_jpeg,
+    optimise_png,
+    PNG_SIGNATURE,
+    )
+
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+
+
+def make_png(chunks=(), compresslevel=0, row=bytes(range(48))):
+    pixels = b''.join(b'\x00' + row for _ in range(16))
+
+    return (PNG_SIGNATURE +
+            make_png_chunk(b'IHDR', struct.pack('>IIBBBBB', 16, 16, 8, 2, 0, 0, 0)) +
+            b''.join(make_png_chunk(kind, body) for kind, body in chunks) +
+            make_png_chunk(b'IDAT', zlib.compress(pixels, compresslevel)) +
+            make_png_chunk(b'IEND', b''))
+
+
+def segment(marker, body):
+    return b'\xff' + bytes([marker]) + struct.pack('>H', len(body) + 2) + body
+
+
+def make_exif(orientation):
+    entry = struct.pack('<HHIHH', 0x0112, 3, 1, orientation, 0)
+    return b'Exif\0\0II*\0' + struct.pack('<IH', 8, 1) + entry + b'\0\0\0\0'
+
+
+def make_jpeg(*segments):
+    return (b'\xff\xd8' + b''.join(segments) + segment(0xdb, b'\0' * 65) +
+            segment(0xda, b'\x01\x01\x00\x00\x3f\x00') + b'\x12\x34\xff\x00\x56' + b'\xff\xd9')
+
+
+def get_pixels(png):
+    return zlib.decompress(b''.join(body for kind, body in iter_png_chunks(png) if kind == b'IDAT'))
+
+
+class PNGOptimisationTest(unittest.TestCase):
+
+    def test_png_should_be_recompressed_without_changing_pixels(self):
+        png = make_png(compresslevel=0)
+        optimised = optimise_png(png)
+
+        self.assertLess(len(optimised), len(png))
+        self.assertEqual(get_pixels(optimised), get_pixels(png))
+
+    def test_metadata_chunks_should_be_stripped_and_others_kept(self):
+        png = make_png([(b'tEXt', b'Software\0editor'), (b'gAMA', b'\0\0\xb1\x8f')], compresslevel=9)
+        kinds = [kind for kind, _ in iter_png_chunks(optimise_png(png))]
+
+        self.assertEqual(kinds, [b'IHDR', b'gAMA', b'IDAT', b'IEND'])
+
+    def test_animated_or_broken_png_should_be_left_unchanged(self):
+        animated = make_png([(b'acTL', b'\0\0\0\1\0\0\0\0')])
+
+        self.assertEqual(optimise_png(animated), animated)
+        self.assertEqual(optimise_png(animated[:-20]), animated[:-20])
+
+
+class JPEGOptimisationTest(unittest.TestCase):
+
+    def test_metadata_segments_should_be_stripped_and_scan_kept(self):
+        jfif = segment(0xe0, b'JFIF\0\1\1\0\0\1\0\1\0\0')
+        jpeg = make_jpeg(jfif, segment(0xe1, make_exif(1)),
+                         segment(0xe1, b'http://ns.adobe.com/xap/1.0/\0<x/>'),
+                         segment(0xfe, b'comment'))
+
+        self.assertEqual(optimise_jpeg(jpeg), make_jpeg(jfif))
+
+    def test_exif_with_rotation_and_colour_segments_should_be_kept(self):
+        jpeg = make_jpeg(segment(0xe1, make_exif(6)),
+                         segment(0xe2, b'ICC_PROFILE\0\1\1profile'),
+                         segment(0xee, b'Adobe\0\144\0\0\0\0\1'))
+
+        self.assertEqual(optimise_jpeg(jpeg), jpeg)
+
+    def test_non_jpeg_data_should_be_left_unchanged(self):
+        self.assertEqual(optimise_jpeg(b'\xff\xd8garbage'), b'\xff\xd8garbage')
+
+
+class ImageOptimiserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.cache = ArtifactCache(os.path.join(self.folder, 'cache'), 1024 * 1024)
+
+    def write(self, name, content):
+        path = os.path.join(self.folder, name)
+
+        with open(path, 'wb') as f:
+            f.write(content)
+
+        return path
+
+    def optimiser(self):
+        optimiser = ImageOptimiser(self.cache, workers=2, jpegtran_path=self.folder + '/')
+        self.addCleanup(optimiser.close)
+        return optimiser
+
+    def test_images_should_be_optimised_in_worker_processes_and_reported(self):
+        png = make_png()
+        first = self.write('a.png', png)
+        duplicate = self.write('b.png', png)
+        gif = self.write('c.gif', b'GIF89a')
+        optimiser = self.optimiser()
+
+        for path in (first, duplicate, gif):
+            optimiser.submit(path)
+
+        path, bytes_in, bytes_out = optimiser.optimise(first)
+
+        with open(path, 'rb') as f:
+            self.assertEqual(get_pixels(f.read()), get_pixels(png))
+
+        self.assertEqual(optimiser.optimise(duplicate)[2], bytes_out)
+        self.assertEqual(optimiser.optimise(gif), (gif, 6, 6))
+        self.assertEqual(len(optimiser.jobs), 2)
+        self.assertEqual(optimiser.summary(),
+                         'Images: 3 optimised, ' + str(2 * (bytes_in - bytes_out)) + ' of ' +
+                         str(2 * bytes_in + 6) + ' bytes saved (' +
+                         str(round(100.0 * 2 * (bytes_in - bytes_out) / (2 * bytes_in + 6), 1)) + '%)')
+
+    def test_optimised_images_should_be_restored_from_cache_by_content(self):
+        png = make_png()
+        self.optimiser().optimise(self.write('a.png', png))
+
+        optimiser = self.optimiser()
+        path, bytes_in, bytes_out = optimiser.optimise(self.write('renamed.png', png))
+
+        self.assertEqual(self.cache.hits, 1)
+        self.assertTrue(path.startswith(optimiser.folder))
+        self.assertLess(bytes_out, bytes_in)
+
+        with open(path, 'rb') as f:
+            self.assertEqual(get_pixels(f.read()), get_pixels(png))
+
+    def test_edited_image_should_be_optimised_again_and_counts_reset(self):
+        path = self.write('a.png', make_png())
+        optimiser = self.optimiser()
+        first_path, first_in, first_out = optimiser.optimise(path)
+
+        with open(first_path, 'rb') as f:
+            first = f.read()
+
+        edited = make_png(row=bytes(range(48, 96)))
+        self.write('a.png', edited)
+        optimiser.reset_counts()
+        second_path, second_in, second_out = optimiser.optimise(path)
+
+        with open(second_path, 'rb') as f:
+            second = f.read()
+
+        self.assertEqual(second_in, len(edited))
+        self.assertNotEqual(second, first)
+        self.assertEqual(get_pixels(second), get_pixels(edited))
+        self.assertEqual(optimiser.files, 1)
+        self.assertEqual(optimiser.bytes_in, len(edited))
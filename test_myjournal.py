@@ -0,0 +1,53 @@
+import unittest
+
+from myjournal import Journal
+
+import os
+import shutil
+import tempfile
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.path = os.path.join(self.folder, 'deploy.journal')
+
+    def test_recorded_stages_should_load_back_in_a_new_journal(self):
+        journal = Journal(self.path)
+        journal.record('bucket', 'css/a-1.css', 'build', {'brotli_path': None})
+        journal.record('bucket', 'css/a-1.css', 'upload', {'md5': 'abc', 'size': 3})
+        journal.close()
+
+        loaded = Journal(self.path)
+
+        self.assertEqual(loaded.load(), 2)
+        self.assertEqual(loaded.get('bucket', 'css/a-1.css', 'upload')['md5'], 'abc')
+        self.assertIsNone(loaded.get('bucket', 'css/a-1.css', 'rename'))
+        self.assertIsNone(loaded.get('other', 'css/a-1.css', 'upload'))
+
+    def test_unfinished_last_line_should_be_ignored_and_not_corrupt_new_records(self):
+        journal = Journal(self.path)
+        journal.record('bucket', 'a', 'upload')
+        journal.close()
+
+        with open(self.path, 'a') as f:
+            f.write('{"bucket": "bucket", "key": "b", "st')
+
+        journal = Journal(self.path)
+        self.assertEqual(journal.load(), 1)
+        journal.record('bucket', 'c', 'upload')
+        journal.close()
+
+        loaded = Journal(self.path)
+        self.assertEqual(loaded.load(), 2)
+        self.assertIsNotNone(loaded.get('bucket', 'c', 'upload'))
+
+    def test_remove_should_delete_the_file(self):
+        journal = Journal(self.path)
+        self.assertEqual(journal.load(), 0)
+        journal.record('bucket', 'a', 'upload')
+        journal.remove()
+
+        self.assertFalse(os.path.exists(self.path))
@@ -0,0 +1,146 @@
+import unittest
+from unittest import mock
+
+import mylimiter
+
+from mylimiter import (
+    AdaptiveLimiter,
+    is_throttling,
+    )
+
+from myretry import call
+
+from mys3async import S3Error
+
+import boto.exception
+import io
+import threading
+
+from contextlib import redirect_stdout
+
+
+class AdaptiveLimiterTest(unittest.TestCase):
+
+    def test_throttling_should_halve_the_limit_once_per_window(self):
+        limiter = AdaptiveLimiter('bucket', 8, 1, 16)
+        first = limiter.acquire()
+        second = limiter.acquire()
+
+        limiter.release(first, 'upload', throttled=True)
+        limiter.release(second, 'upload', throttled=True)
+        self.assertEqual(limiter.limit, 4)
+
+        limiter.release(limiter.acquire(), 'upload', throttled=True)
+        self.assertEqual(limiter.limit, 2)
+        self.assertEqual(limiter.throttled, 3)
+
+    def test_limit_should_only_grow_while_in_use_and_stay_within_bounds(self):
+        limiter = AdaptiveLimiter('bucket', 2, 1, 3)
+
+        for _ in range(10):
+            limiter.release(limiter.acquire(), 'exists')
+
+        self.assertEqual(limiter.limit, 2)
+
+        for _ in range(10):
+            started = [limiter.acquire() for _ in range(int(limiter.limit))]
+
+            for value in started:
+                limiter.release(value, 'exists')
+
+        self.assertEqual(limiter.limit, 3)
+        self.assertIn('bucket: 2 -> 3 (2 - 3), ', limiter.summary())
+
+    def test_requests_over_the_limit_should_wait_for_a_slot(self):
+        limiter = AdaptiveLimiter('bucket', 1, 1, 1)
+        started = limiter.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            limiter.release(limiter.acquire())
+            acquired.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+
+        self.assertFalse(acquired.wait(0.05))
+        limiter.release(started)
+        thread.join()
+        self.assertTrue(acquired.is_set())
+
+    def test_sustained_slower_fixed_size_requests_should_lower_the_limit(self):
+        limiter = AdaptiveLimiter('bucket', 10, 1, 10, latency_factor=3)
+
+        for _ in range(mylimiter.LATENCY_SAMPLES):
+            self.assertFalse(limiter.is_slow('exists', 0.01))
+
+        for _ in range(mylimiter.LATENCY_SAMPLES):
+            self.assertFalse(limiter.is_slow('upload', 0.01))
+
+        self.assertFalse(limiter.is_slow('upload', 10.0))
+        slow = [limiter.is_slow('exists', 0.5) for _ in range(3)]
+
+        self.assertEqual(slow, [True, True, True])
+
+        with mock.patch.object(limiter, 'is_slow', return_value=True):
+            limiter.release(limiter.acquire(), 'exists')
+
+        self.assertEqual(limiter.limit, 9)
+        self.assertEqual(limiter.slow, 1)
+
+    def test_throttling_errors_should_be_told_apart_from_other_failures(self):
+        self.assertTrue(is_throttling(boto.exception.S3ResponseError(503, 'Slow Down')))
+        self.assertTrue(is_throttling(S3Error(400, 'RequestLimitExceeded')))
+        self.assertFalse(is_throttling(S3Error(500, 'InternalError')))
+        self.assertFalse(is_throttling(ConnectionResetError()))
+
+
+class SharedLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.limiters = mylimiter.start()
+        self.addCleanup(mylimiter.start)
+
+    @mock.patch('mylimiter.S3_LIMIT_INITIAL', 16)
+    def test_throttled_calls_should_lower_the_limit_of_their_bucket_only(self):
+        errors = [S3Error(503, 'SlowDown')] * 2
+
+        def put(path, bucket):
+            if errors and bucket == 'css':
+                raise errors.pop()
+            return path
+
+        with mock.patch('myretry.time.sleep'):
+            with redirect_stdout(io.StringIO()):
+                self.assertEqual(call('upload', 'css', put, 'a', 'css'), 'a')
+                self.assertEqual(call('upload', 'js', put, 'b', 'js'), 'b')
+
+        self.assertEqual(mylimiter.get('css').limit, 16 / 4)
+        self.assertEqual(mylimiter.get('js').limit, 16)
+
+        summary = self.limiters.summary()
+        self.assertIn('css: 16 -> ', summary)
+        self.assertIn('3 requests, 2 throttled', summary)
+
+    @mock.patch.multiple('mylimiter', S3_LIMIT_INITIAL=0, UPLOAD_WORKERS=4, DELETE_CONCURRENCY=6,
+                         S3_CONCURRENCY=64, S3_BACKEND='boto')
+    def test_initial_limit_should_default_to_the_requests_the_workers_send_at_once(self):
+        self.assertEqual(mylimiter.get('css').initial, 6)
+
+        with mock.patch('mylimiter.S3_BACKEND', 'asyncio'):
+            self.assertEqual(mylimiter.get_initial_limit(), 64)
+
+    @mock.patch('mylimiter.S3_ADAPTIVE_LIMIT', False)
+    def test_calls_should_not_be_limited_when_disabled(self):
+        self.assertIs(mylimiter.get('css'), mylimiter.UNLIMITED)
+        self.assertEqual(call('upload', 'css', lambda bucket: bucket, 'css'), 'css')
+        self.assertIsNone(self.limiters.summary())
+
+    def test_limits_should_not_carry_over_to_the_next_run(self):
+        with mock.patch('mylimiter.S3_LIMIT_INITIAL', 16):
+            self.limiters.get('css').release(self.limiters.get('css').acquire(), throttled=True)
+
+            self.assertEqual(mylimiter.get('css').limit, 8)
+            self.assertIsNot(mylimiter.start(), self.limiters)
+            self.assertIsNone(mylimiter.current().summary())
+            self.assertEqual(mylimiter.get('css').limit, 16)
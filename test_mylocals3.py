@@ -0,0 +1,85 @@
+import unittest
+
+from mylocals3 import LocalS3Server
+
+import boto
+import boto.s3.connection
+import io
+import time
+
+
+class LocalS3ServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalS3Server().start()
+        self.addCleanup(self.server.stop)
+
+        connection = boto.connect_s3(
+            'id', 'secret', host=self.server.host, port=self.server.port,
+            is_secure=False,
+            calling_format=boto.s3.connection.OrdinaryCallingFormat())
+        self.bucket = connection.create_bucket('mybucket')
+
+    def put(self, name, content, **headers):
+        key = self.bucket.new_key(name)
+        key.set_contents_from_string(content, headers=headers)
+        return key
+
+    def test_stored_object_should_be_readable_with_its_headers(self):
+        self.put('css/a.css', b'body{}', **{'Content-Encoding': 'gzip'})
+
+        key = self.bucket.get_key('css/a.css')
+
+        self.assertEqual(key.get_contents_as_string(), b'body{}')
+        self.assertEqual(key.content_encoding, 'gzip')
+        self.assertIsNone(self.bucket.get_key('css/missing.css'))
+
+    def test_listing_should_follow_prefix_across_pages(self):
+        for number in range(5):
+            self.put('css/' + str(number) + '.css', b'x')
+        self.put('js/a.js', b'x')
+
+        keys = [key.name for key in self.bucket.list(prefix='css/')]
+        page = self.bucket.get_all_keys(prefix='css/', max_keys=2)
+
+        self.assertEqual(keys, ['css/' + str(n) + '.css' for n in range(5)])
+        self.assertEqual(len(page), 2)
+        self.assertTrue(page.is_truncated)
+
+    def test_multi_object_delete_should_remove_every_key(self):
+        self.put('a', b'x')
+        self.put('b', b'x')
+
+        result = self.bucket.delete_keys(['a', 'b'], quiet=False)
+
+        self.assertEqual(sorted(key.key for key in result.deleted), ['a', 'b'])
+        self.assertEqual(list(self.bucket.list()), [])
+
+    def test_multipart_upload_should_join_parts_in_order(self):
+        upload = self.bucket.initiate_multipart_upload('big')
+        upload.upload_part_from_file(io.BytesIO(b'second'), 2)
+        upload.upload_part_from_file(io.BytesIO(b'first'), 1)
+        upload.complete_upload()
+
+        key = self.bucket.get_key('big')
+
+        self.assertEqual(key.get_contents_as_string(), b'firstsecond')
+        self.assertTrue(key.etag.endswith('-2"'))
+
+    def test_copied_object_should_keep_content_and_headers(self):
+        original = self.put('a', b'content', **{'Content-Type': 'text/css'})
+
+        self.bucket.copy_key('b', 'mybucket', 'a')
+        copy = self.bucket.get_key('b')
+
+        self.assertEqual(copy.get_contents_as_string(), b'content')
+        self.assertEqual(copy.content_type, 'text/css')
+        self.assertEqual(copy.etag, original.etag)
+
+    def test_latency_should_delay_every_request(self):
+        self.server.latency = 0.05
+
+        start = time.time()
+        self.bucket.get_key('missing')
+
+        self.assertGreaterEqual(time.time() - start, 0.05)
@@ -0,0 +1,117 @@
+import unittest
+
+import mymetrics
+
+from mymetrics import (
+    Metrics,
+    percentile,
+    )
+
+import json
+import os
+import shutil
+import tempfile
+
+
+class PercentileTest(unittest.TestCase):
+
+    def test_percentile_should_use_nearest_rank(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.95), 95)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([7], 0.99), 7)
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_timer_should_record_bytes_and_compression_ratio(self):
+        metrics = Metrics('deploy')
+
+        with metrics.timer('gzip') as sample:
+            sample.bytes_in = 1000
+            sample.bytes_out = 250
+
+        entry = metrics.report()['stages']['gzip']
+
+        self.assertEqual(entry['calls'], 1)
+        self.assertEqual((entry['bytes_in'], entry['bytes_out']), (1000, 250))
+        self.assertEqual(entry['ratio'], 0.25)
+        self.assertEqual(entry['errors'], 0)
+
+    def test_failed_call_should_be_timed_and_counted_as_error(self):
+        metrics = Metrics('deploy')
+
+        with self.assertRaises(ValueError):
+            with metrics.timer('upload'):
+                raise ValueError('network down')
+
+        entry = metrics.report()['stages']['upload']
+        self.assertEqual((entry['calls'], entry['errors']), (1, 1))
+
+    def test_quantiles_should_be_computed_per_stage(self):
+        metrics = Metrics('deploy')
+
+        for seconds in range(1, 101):
+            metrics.record('upload', seconds / 100.0)
+        metrics.count('upload', 'retries', 2)
+
+        entry = metrics.report()['stages']['upload']
+
+        self.assertEqual((entry['p50'], entry['p95'], entry['p99']),
+                         (0.5, 0.95, 0.99))
+        self.assertEqual(entry['max'], 1.0)
+        self.assertEqual(entry['retries'], 2)
+        self.assertIn('2 retries', metrics.summary())
+
+    def test_prometheus_output_should_have_quantiles_and_counters(self):
+        metrics = Metrics('cleanup')
+        metrics.record('delete', 0.5)
+
+        output = metrics.to_prometheus()
+
+        self.assertIn('newdeployments_stage_seconds{job="cleanup",'
+                      'stage="delete",quantile="0.95"} 0.5', output)
+        self.assertIn('newdeployments_stage_seconds_count{job="cleanup",'
+                      'stage="delete"} 1', output)
+        self.assertIn('newdeployments_stage_errors_total{job="cleanup",'
+                      'stage="delete"} 0', output)
+
+    def test_report_should_be_written_per_job_and_format(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        metrics = Metrics('deploy')
+        metrics.record('minify', 0.1)
+
+        json_path = metrics.write(folder)
+        prometheus_path = metrics.write(folder, 'prometheus')
+
+        self.assertEqual(os.path.basename(json_path), 'mydeploy.json')
+        self.assertEqual(os.path.basename(prometheus_path), 'mydeploy.prom')
+
+        with open(json_path) as f:
+            self.assertEqual(json.load(f)['stages']['minify']['calls'], 1)
+
+        self.assertEqual(sorted(os.listdir(folder)),
+                         ['mydeploy.json', 'mydeploy.prom'])
+
+
+class HooksTest(unittest.TestCase):
+
+    def test_hooks_should_record_into_latest_started_run(self):
+        metrics = mymetrics.start('deploy')
+
+        @mymetrics.timed('exists')
+        def exists():
+            return True
+
+        self.assertTrue(exists())
+        self.assertEqual(list(mymetrics.timed_iter('list', [1, 2, 3])),
+                         [1, 2, 3])
+
+        stages = metrics.report()['stages']
+        self.assertEqual(stages['exists']['calls'], 1)
+        self.assertEqual(stages['list']['calls'], 1)
+        self.assertIs(mymetrics.current(), metrics)
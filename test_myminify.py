@@ -0,0 +1,86 @@
+import unittest
+
+from myminify import (
+    minify,
+    minify_css,
+    minify_file,
+    minify_js,
+    )
+
+import os
+import shutil
+import tempfile
+
+
+class CSSMinifierTest(unittest.TestCase):
+
+    def test_whitespace_comments_and_last_semicolons_should_be_removed(self):
+        css = ('/* header */\n.a ,\n.b > .c {\n    color : red;\n'
+               '    margin: 0 auto;\n}\n\n@media (max-width: 10px) { .d { top: 0; } }\n')
+
+        self.assertEqual(minify_css(css),
+                         '.a,.b>.c{color :red;margin:0 auto}'
+                         '@media (max-width:10px){.d{top:0}}')
+
+    def test_strings_and_important_comments_should_be_kept(self):
+        css = '/*! license */\n.a:before { content: "a ;  } b"; }\n.b :hover { x: 1 }'
+
+        self.assertEqual(minify_css(css),
+                         '/*! license */.a:before{content:"a ;  } b"}.b :hover{x:1}')
+
+    def test_fixture_should_shrink(self):
+        with open('fixtures/styles.css') as f:
+            css = f.read()
+
+        self.assertLess(len(minify_css(css)), len(css))
+
+
+class JSMinifierTest(unittest.TestCase):
+
+    def test_whitespace_and_comments_should_be_removed(self):
+        js = '// header\nfunction f(a, b) {\n    /* sum */\n    return a + b;\n}\n'
+
+        self.assertEqual(minify_js(js), 'function f(a,b){return a+b;}')
+
+    def test_tokens_should_not_be_merged(self):
+        self.assertEqual(minify_js('var a = b + +c - -d / e / f;'),
+                         'var a=b+ +c- -d/e/f;')
+        self.assertEqual(minify_js('x = 1 .toString()'), 'x=1 .toString()')
+
+    def test_newlines_should_be_kept_where_semicolons_may_be_inserted(self):
+        self.assertEqual(minify_js('var a = b\n++c\nreturn\nd'),
+                         'var a=b\n++c\nreturn\nd')
+        self.assertEqual(minify_js('f(a,\n  b)\n.then(g)'), 'f(a,b).then(g)')
+
+    def test_strings_templates_and_regexes_should_be_kept(self):
+        js = ('var s = "a  // b", t = `x  ${ {a: "}"}.a }  y`;\n'
+              'if (/ a\\/[/ ]/g.test(s)) return / b /;')
+
+        self.assertEqual(minify_js(js),
+                         'var s="a  // b",t=`x  ${ {a: "}"}.a }  y`;'
+                         'if(/ a\\/[/ ]/g.test(s))return/ b /;')
+
+    def test_minifying_twice_should_change_nothing(self):
+        with open('fixtures/cells.js') as f:
+            once = minify_js(f.read())
+
+        self.assertEqual(minify_js(once), once)
+
+
+class MinifyFileTest(unittest.TestCase):
+
+    def test_minify_file_should_write_minified_bytes(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        output = os.path.join(folder, 'styles.css')
+
+        minify_file('css', 'fixtures/styles.css', output)
+
+        with open('fixtures/styles.css', 'rb') as f:
+            expected = minify('css', f.read())
+
+        with open(output, 'rb') as f:
+            self.assertEqual(f.read(), expected)
+
+    def test_undecodable_bytes_should_be_preserved(self):
+        self.assertEqual(minify('js', b'var a = "\xff";\n'), b'var a="\xff";')
@@ -0,0 +1,95 @@
+import unittest
+
+from mypipeline import Pipeline
+
+import threading
+
+
+class PipelineTest(unittest.TestCase):
+
+    def test_pipeline_should_pass_every_item_through_all_stages_in_order(self):
+        visited = []
+        lock = threading.Lock()
+
+        def stage(name):
+            def function(item):
+                with lock:
+                    visited.append((item, name))
+            return function
+
+        pipeline = Pipeline([('first', stage('first'), 2),
+                             ('second', stage('second'), 3)])
+        failures = pipeline.run(range(10))
+
+        self.assertEqual(failures, [])
+        self.assertEqual(pipeline.completed, 10)
+
+        for item in range(10):
+            self.assertLess(visited.index((item, 'first')),
+                            visited.index((item, 'second')))
+
+    def test_failed_item_should_be_reported_and_not_stop_other_items(self):
+        uploaded = []
+
+        def build(item):
+            if item == 3:
+                raise ValueError('broken file')
+
+        pipeline = Pipeline([('build', build, 2),
+                             ('upload', uploaded.append, 1)])
+        failures = pipeline.run(range(5))
+
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(failures[0][0], 3)
+        self.assertEqual(failures[0][1], 'build')
+        self.assertIsInstance(failures[0][2], ValueError)
+
+        self.assertEqual(sorted(uploaded), [0, 1, 2, 4])
+        self.assertEqual(pipeline.completed, 4)
+
+    def test_stage_workers_should_run_concurrently(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        pipeline = Pipeline([('wait', lambda item: barrier.wait(), 3)])
+        failures = pipeline.run(range(3))
+
+        self.assertEqual(failures, [])
+        self.assertEqual(pipeline.completed, 3)
+
+    def test_items_in_flight_should_be_bounded_by_queue_size_and_workers(self):
+        release = threading.Event()
+        produced = []
+
+        def items():
+            for item in range(100):
+                produced.append(item)
+                yield item
+
+        def slow(item):
+            release.wait(5)
+
+        runner = threading.Thread(
+            target=Pipeline([('slow', slow, 2)], queue_size=3).run,
+            args=(items(),))
+        runner.start()
+
+        threading.Event().wait(0.2)
+        self.assertLessEqual(len(produced), 2 + 3 + 1)
+
+        release.set()
+        runner.join()
+        self.assertEqual(len(produced), 100)
+
+    def test_error_from_items_iterator_should_propagate_after_workers_stop(self):
+        processed = []
+
+        def items():
+            yield 1
+            raise IOError('index unreadable')
+
+        pipeline = Pipeline([('store', processed.append, 2)])
+
+        with self.assertRaises(IOError):
+            pipeline.run(items())
+
+        self.assertEqual(processed, [1])
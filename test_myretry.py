@@ -0,0 +1,93 @@
+import unittest
+from unittest import mock
+
+import mymetrics
+
+from myretry import (
+    call,
+    get_delay,
+    is_transient,
+    )
+
+from mys3async import S3Error
+
+import boto.exception
+import io
+import socket
+
+from contextlib import redirect_stdout
+
+
+def failing(*errors):
+    errors = list(errors)
+
+    def function(value):
+        if errors:
+            raise errors.pop(0)
+        return value
+
+    return function
+
+
+@mock.patch('myretry.S3_BACKOFF_MAX', 1.0)
+@mock.patch('myretry.S3_BACKOFF_BASE', 0.25)
+@mock.patch('myretry.S3_RETRIES', 3)
+class RetryTest(unittest.TestCase):
+
+    def call(self, function):
+        with redirect_stdout(io.StringIO()):
+            return call('upload', None, function, 'done')
+
+    @mock.patch('myretry.time.sleep')
+    def test_transient_errors_should_be_retried_with_growing_backoff(self, mock_sleep):
+        metrics = mymetrics.start('test')
+        function = failing(boto.exception.S3ResponseError(503, 'Slow Down'),
+                           ConnectionResetError())
+
+        self.assertEqual(self.call(function), 'done')
+
+        first, second = [args[0] for args, _ in mock_sleep.call_args_list]
+        self.assertTrue(0 <= first <= 0.25)
+        self.assertTrue(0 <= second <= 0.5)
+        self.assertEqual(metrics.report()['stages']['upload']['retries'], 2)
+
+    @mock.patch('myretry.time.sleep')
+    def test_error_should_be_raised_when_attempts_run_out(self, mock_sleep):
+        function = failing(*[S3Error(500, 'InternalError')] * 3)
+
+        with self.assertRaises(S3Error):
+            self.call(function)
+
+        self.assertEqual(mock_sleep.call_count, 2)
+
+    @mock.patch('myretry.time.sleep')
+    def test_permanent_errors_should_not_be_retried(self, mock_sleep):
+        function = failing(boto.exception.S3ResponseError(403, 'Forbidden'))
+
+        with self.assertRaises(boto.exception.S3ResponseError):
+            self.call(function)
+
+        self.assertFalse(mock_sleep.called)
+
+    @mock.patch('myretry.random.uniform', side_effect=lambda low, high: high)
+    def test_delay_should_double_up_to_the_maximum(self, mock_uniform):
+        self.assertEqual([get_delay(attempt) for attempt in range(1, 5)],
+                         [0.25, 0.5, 1.0, 1.0])
+
+
+class TransientErrorTest(unittest.TestCase):
+
+    def test_server_errors_throttling_and_dropped_connections_should_be_transient(self):
+        timeout = boto.exception.S3ResponseError(400, 'Bad Request')
+        timeout.error_code = 'RequestTimeout'
+
+        for error in (boto.exception.BotoServerError(503, 'Slow Down'),
+                      S3Error(429, 'TooManyRequests'), timeout,
+                      ConnectionResetError(), socket.timeout()):
+            self.assertTrue(is_transient(error), error)
+
+    def test_client_and_local_errors_should_not_be_transient(self):
+        for error in (boto.exception.S3ResponseError(404, 'Not Found'),
+                      S3Error(403, 'AccessDenied'),
+                      FileNotFoundError(), ValueError()):
+            self.assertFalse(is_transient(error), error)
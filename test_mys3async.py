@@ -0,0 +1,186 @@
+import unittest
+from unittest import mock
+
+from mylocals3 import LocalS3Server
+
+from mys3async import (
+    AsyncS3Client,
+    AsyncS3Util,
+    S3Error,
+    string_to_sign,
+    )
+
+import asyncio
+import boto
+import mylimiter
+import myretry
+import boto.s3.connection
+import boto.utils
+
+
+class SignatureTest(unittest.TestCase):
+
+    def test_string_to_sign_should_match_boto(self):
+        headers = {'Date': 'Thu, 01 Jan 2015 00:00:00 GMT',
+                   'Content-Type': 'text/css',
+                   'Content-MD5': 'ZGlnZXN0',
+                   'x-amz-acl': 'public-read'}
+
+        self.assertEqual(string_to_sign('PUT', '/mybucket/css/a.css', headers),
+                         boto.utils.canonical_string('PUT', '/mybucket/css/a.css',
+                                                     headers))
+
+
+class AsyncS3ClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalS3Server().start()
+        self.addCleanup(self.server.stop)
+        self.server.create_bucket('mybucket')
+
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def client(self, concurrency=8, timeout=70):
+        client = AsyncS3Client('id', 'secret', self.server.host, self.server.port,
+                               is_secure=False, path_style=True,
+                               concurrency=concurrency, timeout=timeout)
+        self.addCleanup(self.run_until_complete, client.close())
+        return client
+
+    def run_until_complete(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_uploaded_object_should_exist(self):
+        client = self.client()
+
+        etag = self.run_until_complete(client.put('mybucket', 'css/a.css', b'body{}',
+                                   {'Content-Type': 'text/css'}))
+
+        self.assertEqual(len(etag), 32)
+        self.assertTrue(self.run_until_complete(client.exists('mybucket', 'css/a.css')))
+        self.assertFalse(self.run_until_complete(client.exists('mybucket', 'css/b.css')))
+        self.assertEqual(self.run_until_complete(client.etag('mybucket', 'css/a.css')), etag)
+        self.assertIsNone(self.run_until_complete(client.etag('mybucket', 'css/b.css')))
+
+    def test_listing_should_follow_pages(self):
+        client = self.client()
+
+        for number in range(5):
+            self.run_until_complete(client.put('mybucket', 'css/' + str(number) + '.css', b'x'))
+
+        page, truncated = self.run_until_complete(client.list_page('mybucket', 'css/', max_keys=2))
+        entries = self.run_until_complete(client.list('mybucket', 'css/'))
+
+        self.assertEqual(len(page), 2)
+        self.assertTrue(truncated)
+        self.assertEqual([entry[0] for entry in entries],
+                         ['css/' + str(number) + '.css' for number in range(5)])
+        self.assertEqual(entries[0][2], 1)
+
+    def test_delete_should_report_deleted_keys(self):
+        client = self.client()
+        self.run_until_complete(client.put('mybucket', 'a', b'x'))
+
+        deleted, errors = self.run_until_complete(client.delete_keys('mybucket', ['a']))
+
+        self.assertEqual((deleted, errors), (['a'], []))
+        self.assertFalse(self.run_until_complete(client.exists('mybucket', 'a')))
+
+    def test_error_response_should_raise_with_s3_code(self):
+        client = self.client()
+
+        with self.assertRaises(S3Error) as context:
+            self.run_until_complete(client.list_page('missingbucket'))
+
+        self.assertEqual(context.exception.status, 404)
+        self.assertEqual(context.exception.code, 'NoSuchBucket')
+
+    def test_requests_in_flight_should_be_capped_and_connections_reused(self):
+        client = self.client(concurrency=4)
+        self.server.latency = 0.02
+
+        async def check_all():
+            return await asyncio.gather(*[client.exists('mybucket', str(number))
+                                          for number in range(20)])
+
+        results = self.run_until_complete(check_all())
+
+        self.assertEqual(results, [False] * 20)
+        self.assertLessEqual(self.server.max_in_flight, 4)
+        self.assertLessEqual(client.stats()['opened'], 4)
+        self.assertGreaterEqual(client.stats()['reused'], 16)
+
+    def test_unanswered_request_should_time_out_as_a_transient_error(self):
+        client = self.client(timeout=0.1)
+        self.server.latency = 0.5
+
+        with self.assertRaises(asyncio.TimeoutError) as context:
+            self.run_until_complete(client.exists('mybucket', 'css/a.css'))
+
+        self.assertTrue(myretry.is_transient(context.exception))
+        self.assertEqual(client.stats()['idle'], 0)
+
+
+class AsyncS3UtilTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalS3Server().start()
+        self.addCleanup(self.server.stop)
+
+        connection = boto.connect_s3(
+            'id', 'secret', host=self.server.host, port=self.server.port,
+            is_secure=False,
+            calling_format=boto.s3.connection.OrdinaryCallingFormat())
+        self.bucket = connection.create_bucket('mybucket')
+
+    def test_facade_should_work_with_boto_buckets(self):
+        AsyncS3Util.put(self.bucket, 'images/a.png', b'png',
+                        {'Cache-Control': b'max-age=31536000, no transform, public'})
+
+        self.assertTrue(AsyncS3Util.file_exists_in_s3_bucket('images/a.png', self.bucket))
+        self.assertEqual(AsyncS3Util.files_exist([('images/a.png', self.bucket),
+                                                  ('images/b.png', self.bucket)]),
+                         [True, False])
+        self.assertEqual(list(AsyncS3Util.list_keys(self.bucket, 'images/')),
+                         ['images/a.png'])
+        self.assertEqual(self.bucket.get_key('images/a.png').cache_control,
+                         'max-age=31536000, no transform, public')
+        self.assertEqual(self.bucket.get_key('images/a.png').content_type, 'image/png')
+
+        result = AsyncS3Util.delete_keys(self.bucket, ['images/a.png'])
+
+        self.assertEqual([deleted.key for deleted in result.deleted], ['images/a.png'])
+        self.assertEqual(result.errors, [])
+        self.assertIsNone(self.bucket.get_key('images/a.png'))
+
+    def test_batched_existence_checks_should_stay_within_the_limit_of_their_bucket(self):
+        mylimiter.start()
+        self.addCleanup(mylimiter.start)
+        self.server.latency = 0.02
+
+        with mock.patch.multiple('mylimiter', S3_ADAPTIVE_LIMIT=True, S3_LIMIT_INITIAL=2, S3_LIMIT_MAX=2):
+            results = AsyncS3Util.files_exist([(str(number), self.bucket) for number in range(10)])
+
+        self.assertEqual(results, [False] * 10)
+        self.assertLessEqual(self.server.max_in_flight, 2)
+        self.assertEqual(mylimiter.get('mybucket').calls, 10)
+
+    def test_failed_existence_check_should_be_retried_without_the_rest_of_its_batch(self):
+        original = AsyncS3Client.exists
+        sent = []
+
+        async def exists(client, bucket, key):
+            sent.append(key)
+
+            if sent.count(key) == 1 and key == '3':
+                raise ConnectionResetError()
+
+            return await original(client, bucket, key)
+
+        with mock.patch.object(AsyncS3Client, 'exists', exists), \
+                mock.patch.object(myretry, 'get_delay', return_value=0):
+            results = AsyncS3Util.files_exist([(str(number), self.bucket) for number in range(10)])
+
+        self.assertEqual(results, [False] * 10)
+        self.assertEqual(sorted(sent), sorted([str(number) for number in range(10)] + ['3']))
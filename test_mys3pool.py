@@ -0,0 +1,76 @@
+import unittest
+
+from mys3pool import (
+    ConnectionPool,
+    PooledBucket,
+    )
+
+import threading
+
+
+class FakeConnection(object):
+
+    def get_bucket(self, name, validate=True):
+        return (self, name)
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def test_checked_in_connection_should_be_reused(self):
+        pool = ConnectionPool(FakeConnection, 4)
+
+        with pool.connection() as first:
+            pass
+
+        with pool.connection() as second:
+            self.assertIs(second, first)
+
+        self.assertEqual(pool.stats(), {'opened': 1, 'reused': 1, 'idle': 1, 'in_use': 0})
+        self.assertEqual(pool.summary(), 'Connections: 1 opened, 1 reused, 1 idle')
+
+    def test_checkout_should_wait_for_a_connection_once_max_size_is_reached(self):
+        pool = ConnectionPool(FakeConnection, 1)
+        held = pool.checkout()
+        acquired = []
+
+        waiter = threading.Thread(target=lambda: acquired.append(pool.checkout()))
+        waiter.start()
+        waiter.join(0.1)
+
+        self.assertEqual(acquired, [])
+
+        pool.checkin(held)
+        waiter.join(5)
+
+        self.assertEqual(acquired, [held])
+        self.assertEqual(pool.opened, 1)
+
+    def test_failed_connection_should_not_use_up_the_pool(self):
+        attempts = []
+
+        def factory():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise IOError('unreachable')
+            return FakeConnection()
+
+        pool = ConnectionPool(factory, 1)
+
+        with self.assertRaises(IOError):
+            pool.checkout()
+
+        self.assertIsInstance(pool.checkout(), FakeConnection)
+
+
+class PooledBucketTest(unittest.TestCase):
+
+    def test_checkout_should_bind_bucket_to_a_pooled_connection(self):
+        pool = ConnectionPool(FakeConnection, 2)
+        bucket = PooledBucket(pool, 'mybucket')
+
+        with bucket.checkout() as (connection, name):
+            self.assertEqual(name, 'mybucket')
+            self.assertEqual(pool.stats()['in_use'], 1)
+
+        self.assertIs(bucket.connection, connection)
+        self.assertEqual(pool.stats()['in_use'], 0)
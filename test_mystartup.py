@@ -0,0 +1,53 @@
+import unittest
+
+from mystartup import (
+    get_import_times,
+    parse_import_times,
+    StartupProfile,
+    )
+
+import sys
+
+IMPORT_TIME_OUTPUT = '''import time: self [us] | cumulative | imported package
+import time:       100 |        100 | zipimport
+import time:        50 |         50 |     json.decoder
+import time:       200 |        250 |   json
+import time:       300 |        300 |   heavy
+import time:        10 |        560 | mymodule
+'''
+
+
+class ImportTimesTest(unittest.TestCase):
+
+    def test_direct_imports_of_module_should_be_sorted_by_cumulative_time(self):
+        total, children = parse_import_times(IMPORT_TIME_OUTPUT, 'mymodule')
+
+        self.assertEqual(total, 0.00056)
+        self.assertEqual(children, [('heavy', 0.0003), ('json', 0.00025)])
+
+    def test_missing_module_should_return_none(self):
+        self.assertIsNone(parse_import_times(IMPORT_TIME_OUTPUT, 'other'))
+
+    @unittest.skipIf(sys.version_info < (3, 7), '-X importtime needs python 3.7')
+    def test_import_times_should_be_measured_in_a_fresh_interpreter(self):
+        total, children = get_import_times('mystartup')
+
+        self.assertGreater(total, 0)
+        self.assertIn('subprocess', [name for name, _ in children])
+
+
+class StartupProfileTest(unittest.TestCase):
+
+    def test_summary_should_list_phases_in_order(self):
+        profile = StartupProfile('mystartup')
+
+        with profile.phase('first'):
+            pass
+
+        with profile.phase('second'):
+            pass
+
+        summary = profile.summary()
+
+        self.assertIn('Startup phases:', summary)
+        self.assertLess(summary.index('  first'), summary.index('  second'))
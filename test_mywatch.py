@@ -0,0 +1,185 @@
+import unittest
+from unittest import mock
+
+import mydeploy
+
+from mywatch import (
+    find_changes,
+    get_entries,
+    watch_main,
+    )
+
+import boto
+from contextlib import redirect_stdout
+import gzip
+import io
+import moto
+import os
+import shutil
+import tempfile
+
+VALID_VERSION = '000000000012'
+
+
+def write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def write_index(path, version, bundle=False):
+    write(path, '<staticFiles>'
+                '<file url="a.js"><fileType>js</fileType><fileVersion>' + version + '</fileVersion></file>'
+                '<file url="b.js"><fileType>js</fileType><fileVersion>' + VALID_VERSION + '</fileVersion></file>' +
+                ('<bundle url="all.js"><fileType>js</fileType><member url="a.js"/><member url="b.js"/></bundle>'
+                 if bundle else '') +
+                '</staticFiles>')
+
+
+class WatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        os.makedirs(os.path.join(self.folder, 'scripts'))
+        self.xml_path = os.path.join(self.folder, 'index.xml')
+        self.connection_pools = {'css_bucket': '', 'js_bucket': '', 'image_bucket': ''}
+
+        write(os.path.join(self.folder, 'scripts', 'a.js'), 'var a = 1\n')
+        write(os.path.join(self.folder, 'scripts', 'b.js'), 'var b = 2\n')
+
+        patcher = mock.patch.multiple('mydeploy', PREFIX_PATH=self.folder + '/', XML_PATH=self.xml_path,
+                                      CSS_MINIFIER='python', JS_MINIFIER='python')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def parse(self):
+        with redirect_stdout(io.StringIO()):
+            return list(mydeploy.iter_file_objects(self.connection_pools, self.xml_path, validate=True))
+
+    def changes(self, known):
+        file_objects = self.parse()
+        out = io.StringIO()
+
+        with redirect_stdout(out):
+            changed = find_changes(known, file_objects, get_entries(file_objects))
+
+        return [item.url for item in changed], out.getvalue()
+
+    def test_only_new_bumped_or_modified_entries_should_change(self):
+        write_index(self.xml_path, VALID_VERSION, bundle=True)
+        known = get_entries(self.parse())
+
+        self.assertEqual(self.changes({})[0], ['a.js', 'b.js', 'all.js'])
+        self.assertEqual(self.changes(known)[0], [])
+
+        write_index(self.xml_path, '000000000013', bundle=True)
+        self.assertEqual(self.changes(known)[0], ['a.js', 'all.js'])
+
+        write_index(self.xml_path, VALID_VERSION, bundle=True)
+        write(os.path.join(self.folder, 'scripts', 'b.js'), 'var b = 22\n')
+        changed, output = self.changes(known)
+
+        self.assertEqual(changed, ['b.js', 'all.js'])
+        self.assertIn('scripts/b.js keeps version ' + VALID_VERSION + ', it is only uploaded if', output)
+
+    @moto.mock_s3
+    def test_watch_should_deploy_changes_with_warm_connections(self):
+        connection = boto.connect_s3('key', 'secret')
+
+        for name in ('watch-css', 'watch-js', 'watch-image'):
+            connection.create_bucket(name)
+
+        write_index(self.xml_path, VALID_VERSION)
+        edits = {1: lambda: write_index(self.xml_path, '000000000013'),
+                 2: lambda: write(os.path.join(self.folder, 'scripts', 'a.js'), 'var a = 11\n')}
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            edits.get(len(sleeps), lambda: None)()
+
+        out = io.StringIO()
+
+        with mock.patch.multiple('mydeploy', AWS_CONFIG_PATH='fixtures/end_to_end/boto2.cfg', AWS_PROFILE='dev',
+                                 CSS_BUCKET='watch-css', JS_BUCKET='watch-js', IMAGE_BUCKET='watch-image',
+                                 UPLOAD_WORKERS=1):
+            with mock.patch('mywatch.time.sleep', side_effect=sleep):
+                with redirect_stdout(out):
+                    watch_main(polls=4)
+
+        output = out.getvalue()
+        keys = sorted(key.key for key in connection.get_bucket('watch-js').list())
+
+        self.assertEqual(keys, ['scripts/a-000000000012.js', 'scripts/a-000000000013.js',
+                                'scripts/b-000000000012.js'])
+        self.assertIn('Deployed 2 changed entries', output)
+        self.assertEqual(output.count('Deployed 1 changed entries'), 1)
+        self.assertIn('Connections: 1 opened', output.split('Deployed 1 changed entries')[1])
+        self.assertFalse(os.path.exists(os.path.join(self.folder, 'scripts', 'a-000000000013.js')))
+
+    @moto.mock_s3
+    def test_watch_should_deploy_a_content_edit_keeping_its_version_when_not_deployed_yet(self):
+        connection = boto.connect_s3('key', 'secret')
+
+        for name in ('watch-css', 'watch-js', 'watch-image'):
+            connection.create_bucket(name)
+
+        write_index(self.xml_path, VALID_VERSION)
+        edits = {1: lambda: connection.get_bucket('watch-js').delete_key('scripts/a-' + VALID_VERSION + '.js'),
+                 2: lambda: write(os.path.join(self.folder, 'scripts', 'a.js'), 'var a = 11\n')}
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            edits.get(len(sleeps), lambda: None)()
+
+        out = io.StringIO()
+
+        with mock.patch.multiple('mydeploy', AWS_CONFIG_PATH='fixtures/end_to_end/boto2.cfg', AWS_PROFILE='dev',
+                                 CSS_BUCKET='watch-css', JS_BUCKET='watch-js', IMAGE_BUCKET='watch-image',
+                                 UPLOAD_WORKERS=1):
+            with mock.patch('mywatch.time.sleep', side_effect=sleep):
+                with redirect_stdout(out):
+                    watch_main(polls=5)
+
+        output = out.getvalue()
+        content = connection.get_bucket('watch-js').get_key('scripts/a-' + VALID_VERSION + '.js').get_contents_as_string()
+
+        self.assertIn('scripts/a.js keeps version ' + VALID_VERSION + ', it is only uploaded if', output)
+        self.assertEqual(output.count('Deployed 1 changed entries'), 1)
+        self.assertEqual(gzip.decompress(content), b'var a=11')
+
+    @moto.mock_s3
+    def test_watch_should_retry_failed_entries_without_waiting_for_a_change(self):
+        connection = boto.connect_s3('key', 'secret')
+
+        for name in ('watch-css', 'watch-js', 'watch-image'):
+            connection.create_bucket(name)
+
+        write_index(self.xml_path, VALID_VERSION)
+        put_file = mydeploy.S3Util.put_file
+        failed = []
+
+        def fail_once(source_file, md5, path, headers, bucket):
+            if path.startswith('scripts/a-') and not failed:
+                failed.append(path)
+                raise IOError('connection reset')
+            return put_file(source_file, md5, path, headers, bucket)
+
+        out = io.StringIO()
+
+        with mock.patch.multiple('mydeploy', AWS_CONFIG_PATH='fixtures/end_to_end/boto2.cfg', AWS_PROFILE='dev',
+                                 CSS_BUCKET='watch-css', JS_BUCKET='watch-js', IMAGE_BUCKET='watch-image',
+                                 UPLOAD_WORKERS=1):
+            with mock.patch('mydeploy.S3Util.put_file', side_effect=fail_once):
+                with mock.patch('mywatch.time.sleep'):
+                    with redirect_stdout(out):
+                        watch_main(polls=3)
+
+        output = out.getvalue()
+        keys = sorted(key.key for key in connection.get_bucket('watch-js').list())
+
+        self.assertIn('Deployed 2 changed entries', output)
+        self.assertIn('failed ones are retried at the next poll', output)
+        self.assertEqual(output.count('Deployed 1 changed entries'), 1)
+        self.assertEqual(keys, ['scripts/a-000000000012.js', 'scripts/b-000000000012.js'])